@@ -1,16 +1,18 @@
+-- Pełna przebudowa raportu dla jednej doby. Do bieżącej pracy służy przyrostowy raport
+-- delay_report utrzymywany przez reporting/delay_report.py (DelayReportBuilder).
 DROP MATERIALIZED VIEW IF EXISTS daily_report;
 
 CREATE MATERIALIZED VIEW daily_report AS
 SELECT
-    vp.entity_id,
+    t.vehicle_id AS entity_id,
     t.trip_id,
     t.route_id,
     r.route_short_name,
     t.stop_sequence,
     t.arrival_delay,
     (to_timestamp(t.timestamp) AT TIME ZONE 'Europe/Warsaw') AS local_timestamp,
-    vp.latitude,
-    vp.longitude,
+    t.latitude,
+    t.longitude,
     stt.stop_id,
     s.stop_name,
     stt.arrival_time,
@@ -32,15 +34,21 @@ SELECT
     -- Średnie opóźnienie linii dla danego przystanku, ignorując stop_sequence=0
     AVG(t.arrival_delay) FILTER (WHERE t.stop_sequence > 0) OVER (PARTITION BY r.route_id, stt.stop_id) AS route_stop_avg_delay
 
+-- Wiersze statyczne są wersjonowane różnicowo: dopasowujemy wiersz widoczny w wersji rekordu dynamicznego.
+-- Pozycja pojazdu (vehicle_id, latitude, longitude) jest dołączana do trip_updates już w ETL.
 FROM trip_updates t
-JOIN trips tr ON t.trip_id = tr.trip_id AND t.version_id = tr.version_id
-JOIN routes r ON tr.route_id = r.route_id AND tr.version_id = r.version_id
-JOIN stop_times stt ON t.trip_id = stt.trip_id AND t.version_id = stt.version_id AND t.stop_sequence = stt.stop_sequence
-LEFT JOIN vehicle_positions vp ON t.trip_id = vp.trip_id AND t.version_id = vp.version_id AND t.timestamp = vp.timestamp
-LEFT JOIN calendar c ON tr.service_id = c.service_id AND tr.version_id = c.version_id
-LEFT JOIN stops s ON stt.stop_id = s.stop_id
-WHERE t.timestamp >= EXTRACT(EPOCH FROM TIMESTAMP '2024-12-09 04:00:00 Europe/Warsaw')
-  AND t.timestamp < EXTRACT(EPOCH FROM TIMESTAMP '2024-12-10 04:00:00 Europe/Warsaw')
+JOIN trips tr ON t.trip_id = tr.trip_id AND static_row_visible(tr.version_id, tr.valid_to_version, t.version_id)
+JOIN routes r ON tr.route_id = r.route_id AND static_row_visible(r.version_id, r.valid_to_version, t.version_id)
+JOIN stop_times stt ON t.trip_id = stt.trip_id AND t.stop_sequence = stt.stop_sequence
+    AND static_row_visible(stt.version_id, stt.valid_to_version, t.version_id)
+LEFT JOIN calendar c ON tr.service_id = c.service_id AND static_row_visible(c.version_id, c.valid_to_version, t.version_id)
+LEFT JOIN stops s ON stt.stop_id = s.stop_id AND static_row_visible(s.version_id, s.valid_to_version, t.version_id)
+-- Granice doby przewozowej jako stałe bigint, aby planista odciął wszystkie partycje poza jedną:
+-- 1733713200 = EXTRACT(EPOCH FROM TIMESTAMPTZ '2024-12-09 04:00 Europe/Warsaw')::bigint,
+-- 1733799600 = EXTRACT(EPOCH FROM TIMESTAMPTZ '2024-12-10 04:00 Europe/Warsaw')::bigint.
+-- Sprawdzenie: EXPLAIN tego SELECT-a pokazuje skan tylko partycji trip_updates_p20241209.
+WHERE t.timestamp >= 1733713200
+  AND t.timestamp < 1733799600
 ORDER BY t.trip_id, t.timestamp, t.stop_sequence;
 
 CREATE INDEX idx_daily_report_tripid_local_timestamp ON daily_report(trip_id, local_timestamp);
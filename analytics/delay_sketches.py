@@ -0,0 +1,243 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from utils.atomic_io import atomic_path
+from utils.leases import LeaseManager
+
+
+class TDigest:
+    """
+    Szkic kwantyli t-digest (wariant scalający): posortowane centroidy (średnia, waga),
+    których rozmiar ogranicza funkcja skali k1 - małe centroidy na krańcach rozkładu,
+    duże w środku. Szkice łączą się przez sklejenie centroidów i ponowną kompresję,
+    więc wynik nie zależy od podziału danych między paczki, doby czy procesy.
+    """
+
+    def __init__(self, compression: float = 100.0, means: Optional[np.ndarray] = None,
+                 weights: Optional[np.ndarray] = None, min_value: float = np.inf, max_value: float = -np.inf):
+        self.compression = compression
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self, values: Iterable[float]) -> "TDigest":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values):
+            self.min_value = min(self.min_value, float(values.min()))
+            self.max_value = max(self.max_value, float(values.max()))
+            self._compress(np.r_[self.means, values], np.r_[self.weights, np.ones(len(values))])
+        return self
+
+    @classmethod
+    def merge_all(cls, digests: Sequence["TDigest"], compression: Optional[float] = None) -> "TDigest":
+        digests = [d for d in digests if len(d.means)]
+        merged = cls(compression or (digests[0].compression if digests else 100.0))
+        if digests:
+            merged.min_value = min(d.min_value for d in digests)
+            merged.max_value = max(d.max_value for d in digests)
+            merged._compress(np.concatenate([d.means for d in digests]),
+                             np.concatenate([d.weights for d in digests]))
+        return merged
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # Centroid trafia do klastra floor(k1(q)) liczonego w środku swojej masy,
+        # więc każdy klaster obejmuje przyrost k nie większy niż 1
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        cluster = np.floor(k).astype(np.int64)
+        starts = np.r_[0, np.flatnonzero(np.diff(cluster)) + 1]
+        cluster_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / cluster_weights
+        self.weights = cluster_weights
+
+    def quantile(self, q: float) -> float:
+        if not len(self.means):
+            return float('nan')
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * total, np.r_[0.0, centers, total],
+                               np.r_[self.min_value, self.means, self.max_value]))
+
+
+# Klucz szkicu: (początek okna w epoch, linia, przystanek)
+SketchKey = Tuple[int, str, str]
+
+
+class DelaySketchStore:
+    """
+    Strumieniowe szkice kwantyli opóźnień per (okno czasowe, linia, przystanek).
+
+    ETL dolicza każdą paczkę trip_updates (`add_batch`) i zapisuje jej szkice do
+    osobnego pliku Parquet (`flush`). Pliki z różnych paczek, dób i procesów łączą
+    się przy odczycie (`percentiles`), a `compact` scala je w jeden plik. Percentyle
+    dla dowolnego zakresu okien, linii czy przystanków liczone są z kilobajtów
+    centroidów, bez skanowania surowych danych. W trybie workerów scalanie wykonuje
+    naraz tylko posiadacz dzierżawy `sketches`.
+    """
+
+    SCHEMA = pa.schema([
+        ('window_start', pa.int64()),
+        ('route_id', pa.string()),
+        ('stop_id', pa.string()),
+        ('min_value', pa.float64()),
+        ('max_value', pa.float64()),
+        ('means', pa.list_(pa.float64())),
+        ('weights', pa.list_(pa.float64())),
+    ])
+
+    def __init__(self, sketch_dir: Path, compression: float = 100.0, window_seconds: int = 3600,
+                 max_files: int = 200, leases: Optional[LeaseManager] = None):
+        self.sketch_dir = Path(sketch_dir)
+        self.compression = compression
+        self.window_seconds = window_seconds
+        self.max_files = max_files
+        self.leases = leases
+        self.pending: Dict[SketchKey, TDigest] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "DelaySketchStore":
+        sketch_config = config['etl'].get('delay_sketches', {})
+        return cls(Path(config['data_storage']['processed_dir']) / "sketches" / "delay",
+                   compression=sketch_config.get('compression', 100.0),
+                   window_seconds=sketch_config.get('window_seconds', 3600),
+                   max_files=sketch_config.get('max_files', 200),
+                   leases=LeaseManager.from_config(config, 'sketches'))
+
+    def add_batch(self, df: pd.DataFrame):
+        """
+        Dolicza opóźnienia przyjazdu z paczki trip_updates do szkiców w pamięci.
+        """
+        batch = df[df['arrival_delay'].notna() & (df['stop_sequence'] > 0)
+                   & df['route_id'].notna() & (df['stop_id'].fillna('') != '')]
+        if batch.empty:
+            return
+        windows = batch['timestamp'].astype('int64') // self.window_seconds * self.window_seconds
+        grouped = batch['arrival_delay'].astype('float64').groupby(
+            [windows.to_numpy(), batch['route_id'].to_numpy(), batch['stop_id'].to_numpy()])
+        for (window_start, route_id, stop_id), delays in grouped:
+            key = (int(window_start), str(route_id), str(stop_id))
+            digest = self.pending.get(key)
+            if digest is None:
+                digest = self.pending[key] = TDigest(self.compression)
+            digest.update(delays.to_numpy())
+
+    def flush(self, timestamp: Optional[str] = None) -> Optional[Path]:
+        """
+        Zapisuje szkice z pamięci do nowego pliku i czyści bufor. Po przekroczeniu
+        `max_files` plików scala je w jeden.
+        """
+        if not self.pending:
+            return None
+        timestamp = timestamp or datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        self.sketch_dir.mkdir(parents=True, exist_ok=True)
+        output_file = self.sketch_dir / f"delay_sketches_{timestamp}.parquet"
+        with atomic_path(output_file) as tmp_file:
+            pq.write_table(self._to_table(self.pending), tmp_file)
+        logger.info(f"Zapisano {len(self.pending)} szkiców opóźnień: {output_file}")
+        self.pending = {}
+        if len(list(self.sketch_dir.glob("delay_sketches_*.parquet"))) > self.max_files:
+            self.compact()
+        return output_file
+
+    def load(self, start: Optional[int] = None, end: Optional[int] = None,
+             route_id: Optional[str] = None, stop_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Wczytuje zapisane szkice z okien [start, end) (epoch), opcjonalnie dla linii/przystanku.
+        """
+        files = sorted(self.sketch_dir.glob("delay_sketches_*.parquet"))
+        if not files:
+            return pd.DataFrame(columns=self.SCHEMA.names)
+        filters = []
+        if start is not None:
+            filters.append(('window_start', '>=', start))
+        if end is not None:
+            filters.append(('window_start', '<', end))
+        if route_id is not None:
+            filters.append(('route_id', '==', route_id))
+        if stop_id is not None:
+            filters.append(('stop_id', '==', stop_id))
+        table = pq.ParquetDataset([str(f) for f in files], filters=filters or None).read()
+        return table.to_pandas()
+
+    def percentiles(self, start: Optional[int] = None, end: Optional[int] = None,
+                    quantiles: Sequence[float] = (0.5, 0.9, 0.99), group_by: Sequence[str] = ('route_id',),
+                    route_id: Optional[str] = None, stop_id: Optional[str] = None) -> pd.DataFrame:
+        """
+        Zwraca percentyle opóźnienia dla zakresu okien, pogrupowane po `group_by`
+        (podzbiór window_start, route_id, stop_id; pusta lista - jeden wynik łączny).
+        """
+        sketches = self.load(start, end, route_id, stop_id)
+        group_by = list(group_by)
+        columns = group_by + ['delay_count'] + [f"p{round(q * 100):g}" for q in quantiles]
+        if sketches.empty:
+            return pd.DataFrame(columns=columns)
+        groups = sketches.groupby(group_by, sort=True) if group_by else [((), sketches)]
+        rows = []
+        for key, part in groups:
+            digest = self._merge_rows(part)
+            key = key if isinstance(key, tuple) else (key,)
+            rows.append([*key, digest.count, *(digest.quantile(q) for q in quantiles)])
+        return pd.DataFrame(rows, columns=columns)
+
+    def compact(self) -> Optional[Path]:
+        """
+        Scala wszystkie pliki szkiców w jeden (po kluczu), usuwając pliki źródłowe.
+        Gdy scala inny worker, nic nie robi (None).
+        """
+        if self.leases is not None and not self.leases.acquire('compact'):
+            return None
+        try:
+            return self._compact()
+        finally:
+            if self.leases is not None:
+                self.leases.release('compact')
+
+    def _compact(self) -> Optional[Path]:
+        files = sorted(self.sketch_dir.glob("delay_sketches_*.parquet"))
+        if len(files) < 2:
+            return None
+        sketches = pq.ParquetDataset([str(f) for f in files]).read().to_pandas()
+        merged = {key: self._merge_rows(part)
+                  for key, part in sketches.groupby(['window_start', 'route_id', 'stop_id'], sort=True)}
+        output_file = self.sketch_dir / f"delay_sketches_{datetime.utcnow():%Y%m%d%H%M%S}_compacted.parquet"
+        with atomic_path(output_file) as tmp_file:
+            pq.write_table(self._to_table(merged), tmp_file)
+        for f in files:
+            if f != output_file:
+                f.unlink(missing_ok=True)
+        logger.info(f"Scalono {len(files)} plików szkiców opóźnień do {output_file} ({len(merged)} kluczy).")
+        return output_file
+
+    def _merge_rows(self, rows: pd.DataFrame) -> TDigest:
+        return TDigest.merge_all([
+            TDigest(self.compression, np.asarray(means), np.asarray(weights), min_value, max_value)
+            for means, weights, min_value, max_value
+            in zip(rows['means'], rows['weights'], rows['min_value'], rows['max_value'])
+        ], self.compression)
+
+    def _to_table(self, digests: Dict[SketchKey, TDigest]) -> pa.Table:
+        keys = list(digests)
+        return pa.table({
+            'window_start': [key[0] for key in keys],
+            'route_id': [key[1] for key in keys],
+            'stop_id': [key[2] for key in keys],
+            'min_value': [digests[key].min_value for key in keys],
+            'max_value': [digests[key].max_value for key in keys],
+            'means': [digests[key].means for key in keys],
+            'weights': [digests[key].weights for key in keys],
+        }, schema=self.SCHEMA)
@@ -0,0 +1,187 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+
+# Pliki ETL mają w nazwie czas utworzenia folderu snapshotów (starsze pliki - czas
+# zapisu przez ETL): trip_updates_20241209101500.parquet
+FILE_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+class ParquetQuery:
+    """
+    Zapytania analityczne bezpośrednio na katalogu data_storage/processed, bez Postgresa.
+
+    Czytane są tylko potrzebne kolumny (projekcja) i grupy wierszy spełniające filtr
+    (predicate pushdown na statystykach Parquet). Pliki dynamiczne spoza okna czasowego
+    są pomijane na podstawie czasu w nazwie pliku (pliki za późne) i statystyk kolumny
+    `timestamp` ze stopki pliku (pliki za wczesne - folder snapshotów może pozostawać
+    otwarty dowolnie długo, więc nazwa nie ogranicza czasu jego rekordów od góry). Metody `iter_*` zwracają
+    dane partiami, co ogranicza zużycie pamięci przy dużych zakresach.
+    """
+
+    def __init__(self, processed_dir: Path, file_lag_seconds: int = 3600):
+        self.processed_dir = Path(processed_dir)
+        self.dynamic_dir = self.processed_dir / "dynamic"
+        # Plik o czasie T w nazwie zawiera rekordy najwyżej o tyle starsze od T
+        self.file_lag_seconds = file_lag_seconds
+        # Pliki są zapisywane atomowo i nie zmieniają się, więc zakresy czasu można zapamiętać
+        self._time_ranges: Dict[Path, Optional[Tuple[int, int]]] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ParquetQuery":
+        return cls(Path(config['data_storage']['processed_dir']))
+
+    # --- dane dynamiczne -------------------------------------------------
+
+    def dataset(self, table: str, start: Optional[int] = None, end: Optional[int] = None) -> ds.Dataset:
+        """
+        Zwraca dataset plików tabeli dynamicznej (trip_updates, vehicle_positions, ...),
+        ograniczony do plików, które mogą zawierać rekordy z przedziału [start, end) (epoch).
+        """
+        files = self._dynamic_files(table, start, end)
+        return ds.dataset([str(f) for f in files], format="parquet")
+
+    def iter_batches(self, table: str, columns: Optional[Sequence[str]] = None,
+                     filter: Optional[ds.Expression] = None, start: Optional[int] = None,
+                     end: Optional[int] = None, batch_size: int = 65536) -> Iterator[pa.RecordBatch]:
+        files = self._dynamic_files(table, start, end)
+        if not files:
+            return
+        dataset = ds.dataset([str(f) for f in files], format="parquet")
+        time_filter = self._time_filter(start, end)
+        if time_filter is not None:
+            filter = time_filter if filter is None else filter & time_filter
+        yield from dataset.to_batches(columns=list(columns) if columns else None, filter=filter,
+                                      batch_size=batch_size)
+
+    def read(self, table: str, columns: Optional[Sequence[str]] = None,
+             filter: Optional[ds.Expression] = None, start: Optional[int] = None,
+             end: Optional[int] = None) -> pd.DataFrame:
+        batches = list(self.iter_batches(table, columns, filter, start, end))
+        if not batches:
+            return pd.DataFrame(columns=list(columns) if columns else None)
+        return pa.Table.from_batches(batches).to_pandas()
+
+    # --- pomocnicze zapytania o opóźnienia --------------------------------
+
+    DELAY_COLUMNS = ('trip_id', 'route_id', 'stop_sequence', 'stop_id', 'arrival_delay',
+                     'departure_delay', 'timestamp')
+
+    def trip_delays(self, trip_id: str, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """
+        Opóźnienia jednego kursu posortowane po przystanku i czasie.
+        """
+        df = self.read('trip_updates', self.DELAY_COLUMNS, ds.field('trip_id') == trip_id, start, end)
+        return df.drop_duplicates().sort_values(['stop_sequence', 'timestamp'], ignore_index=True)
+
+    def route_delays(self, route_id: str, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """
+        Opóźnienia wszystkich kursów linii w oknie czasowym.
+        """
+        df = self.read('trip_updates', self.DELAY_COLUMNS, ds.field('route_id') == route_id, start, end)
+        return df.drop_duplicates().sort_values(['trip_id', 'stop_sequence', 'timestamp'], ignore_index=True)
+
+    def window_delays(self, start: int, end: int, columns: Sequence[str] = DELAY_COLUMNS) -> pd.DataFrame:
+        """
+        Wszystkie opóźnienia z przedziału [start, end) (epoch w sekundach).
+        """
+        return self.read('trip_updates', columns, start=start, end=end).drop_duplicates(ignore_index=True)
+
+    def route_delay_summary(self, start: int, end: int) -> pd.DataFrame:
+        """
+        Średnie opóźnienie przyjazdu per linia liczone przyrostowo po partiach,
+        więc pamięć nie zależy od długości okna.
+        """
+        sums, counts = {}, {}
+        for batch in self.iter_batches('trip_updates', ('route_id', 'arrival_delay', 'stop_sequence'),
+                                       ds.field('stop_sequence') > 0, start, end):
+            part = batch.to_pandas().dropna(subset=['arrival_delay'])
+            grouped = part.groupby('route_id')['arrival_delay'].agg(['sum', 'count'])
+            for route_id, row in grouped.iterrows():
+                sums[route_id] = sums.get(route_id, 0) + row['sum']
+                counts[route_id] = counts.get(route_id, 0) + row['count']
+        summary = pd.DataFrame({'delay_sum': pd.Series(sums), 'delay_count': pd.Series(counts)})
+        summary['avg_delay'] = summary['delay_sum'] / summary['delay_count']
+        return summary.rename_axis('route_id').reset_index()
+
+    # --- dane statyczne ----------------------------------------------------
+
+    def static_folder(self, at: Optional[datetime] = None) -> Optional[Path]:
+        """
+        Zwraca folder gtfs_* obowiązujący w chwili `at` (domyślnie najnowszy).
+        """
+        folders = sorted(self.processed_dir.glob('gtfs_*'))
+        if at is not None:
+            at = at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+            folders = [f for f in folders if self._folder_time(f.name, 'gtfs_') <= at]
+        return folders[-1] if folders else None
+
+    def static_table(self, table: str, columns: Optional[Sequence[str]] = None,
+                     filter: Optional[ds.Expression] = None, at: Optional[datetime] = None) -> pd.DataFrame:
+        folder = self.static_folder(at)
+        if folder is None or not (folder / f"{table}.parquet").exists():
+            raise FileNotFoundError(f"Brak pliku {table}.parquet w danych statycznych ({self.processed_dir}).")
+        dataset = ds.dataset(str(folder / f"{table}.parquet"), format="parquet")
+        return dataset.to_table(columns=list(columns) if columns else None, filter=filter).to_pandas()
+
+    # --- wewnętrzne --------------------------------------------------------
+
+    def _dynamic_files(self, table: str, start: Optional[int], end: Optional[int]) -> List[Path]:
+        table_dir = self.dynamic_dir / table
+        files = sorted(table_dir.glob(f"{table}_*.parquet"))
+        if start is None and end is None:
+            return files
+        selected = []
+        for file_path in files:
+            try:
+                written_at = self._folder_time(file_path.stem, f"{table}_").timestamp()
+            except ValueError:
+                selected.append(file_path)
+                continue
+            if end is not None and written_at - self.file_lag_seconds >= end:
+                continue
+            if start is not None and written_at < start:
+                time_range = self._time_range(file_path)
+                if time_range is not None and time_range[1] < start:
+                    continue
+            selected.append(file_path)
+        logger.debug(f"Wybrano {len(selected)} z {len(files)} plików {table} dla okna [{start}, {end}).")
+        return selected
+
+    def _time_range(self, file_path: Path) -> Optional[Tuple[int, int]]:
+        """
+        (min, max) kolumny `timestamp` ze statystyk grup wierszy; None, gdy ich brak.
+        """
+        if file_path not in self._time_ranges:
+            time_range = None
+            try:
+                metadata = pq.read_metadata(file_path)
+                column = metadata.schema.to_arrow_schema().get_field_index('timestamp')
+                if column >= 0:
+                    stats = [metadata.row_group(i).column(column).statistics for i in range(metadata.num_row_groups)]
+                    if stats and all(s is not None and s.has_min_max for s in stats):
+                        time_range = (min(s.min for s in stats), max(s.max for s in stats))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Nie można odczytać statystyk pliku {file_path}: {e}")
+            self._time_ranges[file_path] = time_range
+        return self._time_ranges[file_path]
+
+    @staticmethod
+    def _time_filter(start: Optional[int], end: Optional[int]) -> Optional[ds.Expression]:
+        expression = None
+        if start is not None:
+            expression = ds.field('timestamp') >= start
+        if end is not None:
+            upper = ds.field('timestamp') < end
+            expression = upper if expression is None else expression & upper
+        return expression
+
+    @staticmethod
+    def _folder_time(name: str, prefix: str) -> datetime:
+        # Znaczniki czasu w nazwach plików są w UTC (datetime.utcnow w ETL i fetcherach)
+        return datetime.strptime(name[len(prefix):], FILE_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
@@ -0,0 +1,202 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from loguru import logger
+
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_gtfs_times(values: pd.Series) -> np.ndarray:
+    """
+    Zamienia czasy GTFS "HH:MM:SS" na sekundy od początku doby rozkładowej.
+    Obsługuje godziny >= 24 (kursy po północy). Brakujące wartości dają -1.
+    """
+    parts = values.astype('string').str.strip().str.split(':', expand=True)
+    if parts.shape[1] < 3:
+        return np.full(len(values), -1, dtype=np.int32)
+    seconds = (pd.to_numeric(parts[0], errors='coerce') * 3600
+               + pd.to_numeric(parts[1], errors='coerce') * 60
+               + pd.to_numeric(parts[2], errors='coerce'))
+    return seconds.fillna(-1).to_numpy(dtype=np.int32)
+
+
+def _parse_gtfs_dates(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values.astype(str), format='%Y%m%d', errors='coerce').dt.date
+
+
+@dataclass
+class ServiceDaySchedule:
+    """
+    Rozkład jednej doby: aktywne kursy i ich czasy przyjazdu/odjazdu (sekundy od
+    początku doby rozkładowej) w układzie CSR - przystanki kursu `i` to zakres
+    [offsets[i], offsets[i + 1]).
+    """
+    service_date: date
+    trip_ids: np.ndarray
+    offsets: np.ndarray
+    stop_sequence: np.ndarray
+    stop_ids: np.ndarray
+    arrival: np.ndarray
+    departure: np.ndarray
+    day_origin: int
+
+    def __post_init__(self):
+        self._trip_positions = {trip_id: i for i, trip_id in enumerate(self.trip_ids)}
+        self._stop_keys: Optional[pd.MultiIndex] = None
+
+    def is_active(self, trip_id: str) -> bool:
+        return trip_id in self._trip_positions
+
+    def trip_slice(self, trip_id: str) -> Optional[slice]:
+        position = self._trip_positions.get(trip_id)
+        if position is None:
+            return None
+        return slice(self.offsets[position], self.offsets[position + 1])
+
+    def scheduled(self, trip_id: str, stop_sequence: int) -> Optional[Tuple[int, int]]:
+        """
+        Zwraca rozkładowy (przyjazd, odjazd) w sekundach epoch dla przystanku kursu;
+        None, gdy przystanku nie ma w rozkładzie albo nie ma on czasów (przystanek
+        niebędący punktem kontrolnym).
+        """
+        trip_range = self.trip_slice(trip_id)
+        if trip_range is None:
+            return None
+        sequences = self.stop_sequence[trip_range]
+        i = np.searchsorted(sequences, stop_sequence)
+        if i >= len(sequences) or sequences[i] != stop_sequence:
+            return None
+        i += trip_range.start
+        if self.arrival[i] < 0 or self.departure[i] < 0:
+            return None
+        return int(self.day_origin + self.arrival[i]), int(self.day_origin + self.departure[i])
+
+    def scheduled_arrivals(self, trip_ids: np.ndarray, stop_sequences: np.ndarray) -> np.ndarray:
+        """
+        Wektorowo: rozkładowy przyjazd (epoch) dla par (kurs, przystanek); -1, gdy brak
+        w rozkładzie lub przystanek nie ma czasu przyjazdu.
+        """
+        if self._stop_keys is None:
+            self._stop_keys = pd.MultiIndex.from_arrays([np.repeat(self.trip_ids, np.diff(self.offsets)),
+                                                         self.stop_sequence])
+        wanted = pd.MultiIndex.from_arrays([np.asarray(trip_ids, dtype=object), np.asarray(stop_sequences)])
+        positions = self._stop_keys.get_indexer(wanted)
+        result = np.full(len(positions), -1, dtype=np.int64)
+        found = positions >= 0
+        arrival = self.arrival[positions[found]]
+        result[found] = np.where(arrival >= 0, self.day_origin + arrival.astype(np.int64), -1)
+        return result
+
+    def to_arrow(self) -> pa.Table:
+        return pa.table({
+            'trip_id': np.repeat(self.trip_ids, np.diff(self.offsets)),
+            'stop_sequence': self.stop_sequence,
+            'stop_id': self.stop_ids,
+            'arrival_seconds': self.arrival,
+            'departure_seconds': self.departure,
+        })
+
+
+class ScheduleEngine:
+    """
+    Rozwinięcie rozkładu (calendar + calendar_dates + stop_times) dla wersji danych
+    statycznych, z pamięcią podręczną per doba rozkładowa.
+
+    stop_times są wczytywane raz na wersję i przechowywane jako tablice NumPy
+    posortowane po kursie, więc wybór aktywnych kursów doby to operacje wektorowe,
+    a odczyt rozkładu kursu - O(1).
+    """
+
+    _cache: Dict[str, "ScheduleEngine"] = {}
+
+    def __init__(self, calendar: pd.DataFrame, calendar_dates: pd.DataFrame, trips: pd.DataFrame,
+                 stop_times: pd.DataFrame, timezone: str = "Europe/Warsaw", max_cached_days: int = 14):
+        self.timezone = timezone
+        self.max_cached_days = max_cached_days
+        self._days: Dict[date, ServiceDaySchedule] = {}
+
+        self.calendar = calendar.assign(
+            start_date=_parse_gtfs_dates(calendar['start_date']),
+            end_date=_parse_gtfs_dates(calendar['end_date']),
+        )
+        self.calendar_dates = calendar_dates.assign(date=_parse_gtfs_dates(calendar_dates['date']))
+        self.trip_service = trips.set_index('trip_id')['service_id']
+
+        stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'], ignore_index=True)
+        trip_codes, self.trip_ids = pd.factorize(stop_times['trip_id'])
+        self.offsets = np.r_[0, np.cumsum(np.bincount(trip_codes, minlength=len(self.trip_ids)))]
+        self.stop_sequence = stop_times['stop_sequence'].to_numpy(dtype=np.int32)
+        self.stop_ids = stop_times['stop_id'].astype(str).to_numpy()
+        self.arrival = parse_gtfs_times(stop_times['arrival_time'])
+        self.departure = parse_gtfs_times(stop_times['departure_time'])
+        logger.info(f"Wczytano rozkład: {len(self.trip_ids)} kursów, {len(stop_times)} postojów.")
+
+    @classmethod
+    def for_static_folder(cls, folder: Path, timezone: str = "Europe/Warsaw") -> "ScheduleEngine":
+        """
+        Zwraca (z pamięci podręcznej) silnik rozkładu dla folderu gtfs_* - jeden na wersję.
+        """
+        folder = Path(folder)
+        key = str(folder.resolve())
+        if key not in cls._cache:
+            cls._cache[key] = cls(
+                calendar=pd.read_parquet(folder / 'calendar.parquet'),
+                calendar_dates=pd.read_parquet(folder / 'calendar_dates.parquet'),
+                trips=pd.read_parquet(folder / 'trips.parquet', columns=['trip_id', 'service_id']),
+                stop_times=pd.read_parquet(folder / 'stop_times.parquet',
+                                           columns=['trip_id', 'stop_sequence', 'stop_id',
+                                                    'arrival_time', 'departure_time']),
+                timezone=timezone,
+            )
+        return cls._cache[key]
+
+    def active_services(self, service_date: date) -> set:
+        weekday = WEEKDAY_COLUMNS[service_date.weekday()]
+        in_range = (self.calendar['start_date'] <= service_date) & (self.calendar['end_date'] >= service_date)
+        services = set(self.calendar.loc[in_range & (self.calendar[weekday] == 1), 'service_id'])
+        exceptions = self.calendar_dates[self.calendar_dates['date'] == service_date]
+        services |= set(exceptions.loc[exceptions['exception_type'] == 1, 'service_id'])
+        services -= set(exceptions.loc[exceptions['exception_type'] == 2, 'service_id'])
+        return services
+
+    def day(self, service_date: date) -> ServiceDaySchedule:
+        """
+        Zwraca rozkład doby `service_date` (z pamięci podręcznej, jeśli był już liczony).
+        """
+        if service_date in self._days:
+            return self._days[service_date]
+
+        services = self.active_services(service_date)
+        trip_services = self.trip_service.reindex(self.trip_ids).to_numpy()
+        active = np.flatnonzero(pd.Series(trip_services).isin(services).to_numpy())
+        counts = self.offsets[active + 1] - self.offsets[active]
+        rows = np.repeat(self.offsets[active], counts) + (
+            np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+        schedule = ServiceDaySchedule(
+            service_date=service_date,
+            trip_ids=np.asarray(self.trip_ids)[active],
+            offsets=np.r_[0, np.cumsum(counts)],
+            stop_sequence=self.stop_sequence[rows],
+            stop_ids=self.stop_ids[rows],
+            arrival=self.arrival[rows],
+            departure=self.departure[rows],
+            day_origin=self.day_origin(service_date),
+        )
+        if len(self._days) >= self.max_cached_days:
+            self._days.pop(next(iter(self._days)))
+        self._days[service_date] = schedule
+        return schedule
+
+    def day_origin(self, service_date: date) -> int:
+        """
+        Punkt odniesienia czasów GTFS: "południe minus 12 h" czasu lokalnego doby rozkładowej
+        (w dni zmiany czasu różni się od północy o godzinę).
+        """
+        noon = datetime.combine(service_date, time(12), tzinfo=ZoneInfo(self.timezone))
+        return int(noon.timestamp()) - 12 * 3600
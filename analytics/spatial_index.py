@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+EARTH_RADIUS_M = 6371008.8
+
+
+class LocalProjection:
+    """
+    Rzut równoodległościowy wokół punktu odniesienia - wystarczająco dokładny
+    w skali miasta, a pozwala liczyć odległości w metrach na zwykłych wektorach.
+    """
+
+    def __init__(self, lat0: float, lon0: float):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.cos_lat0 = np.cos(np.radians(lat0))
+
+    def to_xy(self, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        x = np.radians(lon - self.lon0) * self.cos_lat0 * EARTH_RADIUS_M
+        y = np.radians(lat - self.lat0) * EARTH_RADIUS_M
+        return x, y
+
+
+class GridIndex:
+    """
+    Siatka kwadratowych komórek o boku `cell_size` metrów. Element może należeć
+    do wielu komórek (odcinki trasy). Zapytanie zwraca pary (punkt, element)
+    z komórek 3x3 wokół punktu, więc wynik jest pewny do odległości `cell_size`.
+    """
+
+    def __init__(self, cell_x: np.ndarray, cell_y: np.ndarray, items: np.ndarray, cell_size: float):
+        self.cell_size = cell_size
+        keys = self._key(cell_x, cell_y)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.items = items[order]
+
+    @staticmethod
+    def _key(cell_x, cell_y) -> np.ndarray:
+        return (np.asarray(cell_x, dtype=np.int64) << 32) + (np.asarray(cell_y, dtype=np.int64) & 0xFFFFFFFF)
+
+    def candidates(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Pozycje bez współrzędnych trafiają do odległej komórki i nie mają kandydatów
+        x = np.where(np.isfinite(x), x, 1e9)
+        y = np.where(np.isfinite(y), y, 1e9)
+        cx = np.floor(x / self.cell_size).astype(np.int64)
+        cy = np.floor(y / self.cell_size).astype(np.int64)
+        point_parts, item_parts = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = self._key(cx + dx, cy + dy)
+                lo = np.searchsorted(self.keys, keys, side='left')
+                hi = np.searchsorted(self.keys, keys, side='right')
+                counts = hi - lo
+                total = counts.sum()
+                if total == 0:
+                    continue
+                points = np.repeat(np.arange(len(x)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                point_parts.append(points)
+                item_parts.append(self.items[np.repeat(lo, counts) + offsets])
+        if not point_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(point_parts), np.concatenate(item_parts)
+
+
+def _argmin_per_point(points: np.ndarray, distances: np.ndarray, n_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dla par (punkt, kandydat) zwraca indeks najbliższej pary dla każdego punktu (-1, gdy brak).
+    """
+    best = np.full(n_points, -1, dtype=np.int64)
+    best_distance = np.full(n_points, np.nan)
+    if len(points) == 0:
+        return best, best_distance
+    order = np.lexsort((distances, points))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = points[order][1:] != points[order][:-1]
+    chosen = order[first]
+    best[points[chosen]] = chosen
+    best_distance[points[chosen]] = distances[chosen]
+    return best, best_distance
+
+
+@dataclass
+class ShapeProjection:
+    shape_id: np.ndarray
+    segment: np.ndarray
+    distance_m: np.ndarray
+    distance_along_m: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+
+
+class SpatialIndex:
+    """
+    Indeks przestrzenny przystanków i tras (shapes) jednej wersji danych statycznych.
+
+    Pozwala wektorowo, dla całych paczek pozycji pojazdów naraz, znaleźć najbliższy
+    przystanek oraz rzutować pozycję na najbliższy odcinek trasy (wraz z odległością
+    wzdłuż trasy). Wyniki są pewne do odległości `cell_size` metrów - dalsze punkty
+    dostają -1 / NaN.
+    """
+
+    _cache: Dict[str, "SpatialIndex"] = {}
+
+    def __init__(self, stops: pd.DataFrame, shapes: pd.DataFrame, cell_size: float = 250.0):
+        self.cell_size = cell_size
+        self.projection = LocalProjection(float(stops['stop_lat'].mean()), float(stops['stop_lon'].mean()))
+
+        self.stop_ids = stops['stop_id'].to_numpy()
+        self.stop_x, self.stop_y = self.projection.to_xy(stops['stop_lat'], stops['stop_lon'])
+        self.stop_grid = GridIndex(np.floor(self.stop_x / cell_size), np.floor(self.stop_y / cell_size),
+                                   np.arange(len(stops)), cell_size)
+        self._build_shape_segments(shapes)
+        logger.info(f"Zbudowano indeks przestrzenny: {len(stops)} przystanków, {len(self.seg_shape)} odcinków tras.")
+
+    @classmethod
+    def for_static_folder(cls, folder: Path, cell_size: float = 250.0) -> "SpatialIndex":
+        """
+        Zwraca (z pamięci podręcznej) indeks dla folderu gtfs_* - jeden na wersję danych statycznych.
+        """
+        key = f"{Path(folder).resolve()}:{cell_size}"
+        if key not in cls._cache:
+            stops = pd.read_parquet(Path(folder) / 'stops.parquet', columns=['stop_id', 'stop_lat', 'stop_lon'])
+            shapes = pd.read_parquet(Path(folder) / 'shapes.parquet',
+                                     columns=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'])
+            cls._cache[key] = cls(stops, shapes, cell_size)
+        return cls._cache[key]
+
+    def _build_shape_segments(self, shapes: pd.DataFrame):
+        shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'], ignore_index=True)
+        shape_codes, self.shape_ids = pd.factorize(shapes['shape_id'])
+        x, y = self.projection.to_xy(shapes['shape_pt_lat'], shapes['shape_pt_lon'])
+
+        same_shape = shape_codes[1:] == shape_codes[:-1]
+        start = np.nonzero(same_shape)[0]
+        self.seg_shape = shape_codes[start]
+        self.seg_ax, self.seg_ay = x[start], y[start]
+        self.seg_bx, self.seg_by = x[start + 1], y[start + 1]
+        lengths = np.hypot(self.seg_bx - self.seg_ax, self.seg_by - self.seg_ay)
+        self.seg_length = lengths
+
+        # Odległość wzdłuż trasy do początku odcinka: suma skumulowana resetowana na granicy trasy
+        cumulative = np.cumsum(lengths) - lengths
+        shape_start = np.r_[True, self.seg_shape[1:] != self.seg_shape[:-1]]
+        offsets = np.maximum.accumulate(np.where(shape_start, cumulative, 0))
+        self.seg_along = cumulative - offsets
+        self.seg_index_in_shape = np.arange(len(start)) - np.maximum.accumulate(
+            np.where(shape_start, np.arange(len(start)), 0))
+
+        # Odcinek trafia do każdej komórki swojego prostokąta ograniczającego
+        cs = self.cell_size
+        min_cx = np.floor(np.minimum(self.seg_ax, self.seg_bx) / cs).astype(np.int64)
+        max_cx = np.floor(np.maximum(self.seg_ax, self.seg_bx) / cs).astype(np.int64)
+        min_cy = np.floor(np.minimum(self.seg_ay, self.seg_by) / cs).astype(np.int64)
+        max_cy = np.floor(np.maximum(self.seg_ay, self.seg_by) / cs).astype(np.int64)
+        span_x, span_y = max_cx - min_cx + 1, max_cy - min_cy + 1
+        cells = span_x * span_y
+        seg = np.repeat(np.arange(len(start)), cells)
+        local = np.arange(cells.sum()) - np.repeat(np.cumsum(cells) - cells, cells)
+        cell_x = min_cx[seg] + local % span_x[seg]
+        cell_y = min_cy[seg] + local // span_x[seg]
+        self.segment_grid = GridIndex(cell_x, cell_y, seg, cs)
+
+    def nearest_stops(self, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zwraca (stop_id, odległość w metrach) najbliższego przystanku dla każdej pozycji.
+        Pozycje dalej niż `cell_size` od wszystkich przystanków dostają (None, NaN) -
+        poza tym promieniem siatka 3x3 nie gwarantuje, że kandydat jest najbliższy.
+        """
+        x, y = self.projection.to_xy(lat, lon)
+        points, items = self.stop_grid.candidates(x, y)
+        distances = np.hypot(self.stop_x[items] - x[points], self.stop_y[items] - y[points])
+        within = distances <= self.cell_size
+        points, items, distances = points[within], items[within], distances[within]
+        best, best_distance = _argmin_per_point(points, distances, len(x))
+        stop_ids = np.full(len(x), None, dtype=object)
+        found = best >= 0
+        stop_ids[found] = self.stop_ids[items[best[found]]]
+        return stop_ids, best_distance
+
+    def project_onto_shapes(self, lat, lon, shape_ids: Optional[np.ndarray] = None) -> ShapeProjection:
+        """
+        Rzutuje pozycje na najbliższy odcinek trasy. Gdy podano `shape_ids` (np. z kursu
+        pojazdu), brane są pod uwagę tylko odcinki tej trasy. Pozycje dalej niż
+        `cell_size` od wszystkich odcinków dostają None / -1 / NaN.
+        """
+        x, y = self.projection.to_xy(lat, lon)
+        points, segs = self.segment_grid.candidates(x, y)
+        if shape_ids is not None:
+            wanted = self.shape_ids.get_indexer(pd.Index(np.asarray(shape_ids, dtype=object)))
+            keep = self.seg_shape[segs] == wanted[points]
+            points, segs = points[keep], segs[keep]
+
+        ax, ay = self.seg_ax[segs], self.seg_ay[segs]
+        dx, dy = self.seg_bx[segs] - ax, self.seg_by[segs] - ay
+        length_sq = np.maximum(dx * dx + dy * dy, 1e-9)
+        t = np.clip(((x[points] - ax) * dx + (y[points] - ay) * dy) / length_sq, 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        distances = np.hypot(x[points] - px, y[points] - py)
+        within = distances <= self.cell_size
+        points, segs, t, px, py, distances = (points[within], segs[within], t[within], px[within], py[within],
+                                              distances[within])
+        best, best_distance = _argmin_per_point(points, distances, len(x))
+
+        n = len(x)
+        found = best >= 0
+        chosen = segs[best[found]]
+        shape_out = np.full(n, None, dtype=object)
+        shape_out[found] = np.asarray(self.shape_ids)[self.seg_shape[chosen]]
+        segment_out = np.full(n, -1, dtype=np.int64)
+        segment_out[found] = self.seg_index_in_shape[chosen]
+        along = np.full(n, np.nan)
+        along[found] = self.seg_along[chosen] + t[best[found]] * self.seg_length[chosen]
+        proj_x, proj_y = np.full(n, np.nan), np.full(n, np.nan)
+        proj_x[found], proj_y[found] = px[best[found]], py[best[found]]
+        proj_lat = self.projection.lat0 + np.degrees(proj_y / EARTH_RADIUS_M)
+        proj_lon = self.projection.lon0 + np.degrees(proj_x / (EARTH_RADIUS_M * self.projection.cos_lat0))
+        return ShapeProjection(shape_out, segment_out, best_distance, along, proj_lat, proj_lon)
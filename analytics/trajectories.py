@@ -0,0 +1,187 @@
+import json
+from pathlib import Path
+from typing import List
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+
+from analytics.parquet_query import ParquetQuery
+from analytics.spatial_index import LocalProjection
+
+# Kodowanie kompaktowe: współrzędne w mikrostopniach, czas w sekundach, jako różnice kolejnych punktów
+COORD_SCALE = 1_000_000
+
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Zwraca maskę punktów zachowanych przez uproszczenie Douglasa-Peuckera
+    (współrzędne w metrach). Skrajne punkty są zawsze zachowane.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = x[first], y[first]
+        dx, dy = x[last] - ax, y[last] - ay
+        px, py = x[first + 1:last] - ax, y[first + 1:last] - ay
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            distances = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+class TrajectoryBuilder:
+    """
+    Buduje uproszczone trajektorie pojazdów (per pojazd i kurs) z plików vehicle_positions
+    i zapisuje je w oknach czasowych jako GeoJSON lub kompaktowe pliki Parquet
+    z kodowaniem różnicowym - mapę całej doby wczytuje się z kilku megabajtów
+    zamiast z milionów wierszy daily_report.
+    """
+
+    POSITION_COLUMNS = ('entity_id', 'trip_id', 'latitude', 'longitude', 'timestamp')
+
+    def __init__(self, query: ParquetQuery, tolerance_m: float = 10.0, window_seconds: int = 3600):
+        self.query = query
+        self.tolerance_m = tolerance_m
+        self.window_seconds = window_seconds
+
+    def build(self, start: int, end: int) -> pd.DataFrame:
+        """
+        Zwraca uproszczone trajektorie z przedziału [start, end): jeden wiersz na (pojazd, kurs)
+        z tablicami lat, lon i timestamp.
+        """
+        positions = self.query.read('vehicle_positions', self.POSITION_COLUMNS,
+                                    ds.field('latitude').is_valid() & ds.field('longitude').is_valid(),
+                                    start, end)
+        columns = ['vehicle_id', 'trip_id', 'points_in', 'lat', 'lon', 'timestamp']
+        if positions.empty:
+            return pd.DataFrame(columns=columns)
+        positions = (positions.rename(columns={'entity_id': 'vehicle_id'})
+                     .drop_duplicates(subset=['vehicle_id', 'timestamp'])
+                     .sort_values(['vehicle_id', 'trip_id', 'timestamp'], ignore_index=True))
+        projection = LocalProjection(float(positions['latitude'].mean()), float(positions['longitude'].mean()))
+        x, y = projection.to_xy(positions['latitude'], positions['longitude'])
+        lat = positions['latitude'].to_numpy()
+        lon = positions['longitude'].to_numpy()
+        timestamps = positions['timestamp'].to_numpy(dtype=np.int64)
+
+        keys = positions[['vehicle_id', 'trip_id']].fillna({'trip_id': ''})
+        boundaries = np.r_[0, np.flatnonzero((keys.iloc[1:].to_numpy() != keys.iloc[:-1].to_numpy()).any(axis=1)) + 1,
+                           len(positions)]
+        rows = []
+        for first, last in zip(boundaries[:-1], boundaries[1:]):
+            keep = douglas_peucker(x[first:last], y[first:last], self.tolerance_m)
+            rows.append([keys.iat[first, 0], keys.iat[first, 1] or None, int(last - first),
+                         lat[first:last][keep], lon[first:last][keep], timestamps[first:last][keep]])
+        trajectories = pd.DataFrame(rows, columns=columns)
+        kept = int(trajectories['timestamp'].map(len).sum())
+        logger.info(f"Zbudowano {len(trajectories)} trajektorii: {len(positions)} -> {kept} punktów "
+                    f"(tolerancja {self.tolerance_m} m).")
+        return trajectories
+
+    def export_geojson(self, start: int, end: int, output_dir: Path) -> List[Path]:
+        """
+        Zapisuje trajektorie jako FeatureCollection (LineString, a dla pojedynczego odczytu Point)
+        w plikach per okno czasowe.
+        """
+        return [self._write_geojson(window_start, trajectories, Path(output_dir))
+                for window_start, trajectories in self._windows(start, end)]
+
+    def export_compact(self, start: int, end: int, output_dir: Path) -> List[Path]:
+        """
+        Zapisuje trajektorie jako Parquet z różnicami kolejnych punktów (int32) per okno czasowe.
+        """
+        return [self._write_compact(window_start, trajectories, Path(output_dir))
+                for window_start, trajectories in self._windows(start, end)]
+
+    @staticmethod
+    def read_compact(path: Path) -> pd.DataFrame:
+        """
+        Odczytuje plik zapisany przez export_compact, odtwarzając lat, lon i timestamp.
+        """
+        df = pq.read_table(path).to_pandas()
+        df['lat'] = [(np.asarray(origin) + np.cumsum(deltas)) / COORD_SCALE
+                     for origin, deltas in zip(df.pop('lat_origin'), df.pop('lat_deltas'))]
+        df['lon'] = [(np.asarray(origin) + np.cumsum(deltas)) / COORD_SCALE
+                     for origin, deltas in zip(df.pop('lon_origin'), df.pop('lon_deltas'))]
+        df['timestamp'] = [origin + np.cumsum(deltas)
+                           for origin, deltas in zip(df.pop('time_origin'), df.pop('time_deltas'))]
+        return df
+
+    def _windows(self, start: int, end: int):
+        window_start = start // self.window_seconds * self.window_seconds
+        while window_start < end:
+            window_end = min(window_start + self.window_seconds, end)
+            trajectories = self.build(max(window_start, start), window_end)
+            if not trajectories.empty:
+                yield window_start, trajectories
+            window_start += self.window_seconds
+
+    @staticmethod
+    def _geometry(lon: np.ndarray, lat: np.ndarray) -> dict:
+        # LineString w GeoJSON wymaga co najmniej dwóch pozycji - pojedynczy odczyt to Point
+        coordinates = np.column_stack([np.round(lon, 6), np.round(lat, 6)]).tolist()
+        if len(coordinates) == 1:
+            return {'type': 'Point', 'coordinates': coordinates[0]}
+        return {'type': 'LineString', 'coordinates': coordinates}
+
+    @staticmethod
+    def _write_geojson(window_start: int, trajectories: pd.DataFrame, output_dir: Path) -> Path:
+        features = [{
+            'type': 'Feature',
+            'geometry': TrajectoryBuilder._geometry(row.lon, row.lat),
+            'properties': {
+                'vehicle_id': row.vehicle_id,
+                'trip_id': row.trip_id,
+                'timestamps': row.timestamp.tolist(),
+            },
+        } for row in trajectories.itertuples(index=False)]
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_file = output_dir / f"trajectories_{window_start}.geojson"
+        with output_file.open('w', encoding='utf-8') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+        logger.info(f"Zapisano {len(features)} trajektorii do {output_file}")
+        return output_file
+
+    @staticmethod
+    def _write_compact(window_start: int, trajectories: pd.DataFrame, output_dir: Path) -> Path:
+        def encode(values: np.ndarray):
+            values = np.asarray(values, dtype=np.int64)
+            return int(values[0]), np.diff(values, prepend=values[0]).astype(np.int32)
+
+        lat = [encode(np.round(v * COORD_SCALE)) for v in trajectories['lat']]
+        lon = [encode(np.round(v * COORD_SCALE)) for v in trajectories['lon']]
+        time = [encode(v) for v in trajectories['timestamp']]
+        table = pa.table({
+            'vehicle_id': trajectories['vehicle_id'].astype(str),
+            'trip_id': trajectories['trip_id'],
+            'lat_origin': pa.array([v[0] for v in lat], pa.int64()),
+            'lat_deltas': pa.array([v[1] for v in lat], pa.list_(pa.int32())),
+            'lon_origin': pa.array([v[0] for v in lon], pa.int64()),
+            'lon_deltas': pa.array([v[1] for v in lon], pa.list_(pa.int32())),
+            'time_origin': pa.array([v[0] for v in time], pa.int64()),
+            'time_deltas': pa.array([v[1] for v in time], pa.list_(pa.int32())),
+        })
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_file = output_dir / f"trajectories_{window_start}.parquet"
+        pq.write_table(table, output_file, compression='zstd')
+        logger.info(f"Zapisano {len(trajectories)} trajektorii do {output_file}")
+        return output_file
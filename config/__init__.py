@@ -1,2 +1,8 @@
 # --- Plik: C:\Users\Admin\Desktop\bimby\config\__init__.py ---
-from .config import CONFIG
\ No newline at end of file
+from .config import DEFAULT_CONFIG_PATH, get_config, load_config
+
+
+def __getattr__(name: str):
+    if name == 'CONFIG':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
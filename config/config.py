@@ -1,8 +1,25 @@
 import yaml
 from pathlib import Path
+from typing import Optional, Union
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    CONFIG_PATH = Path(__file__).parent / config_path
+DEFAULT_CONFIG_PATH = Path(__file__).parent / "config.yaml"
+
+_CONFIG: Optional[dict] = None
+
+
+def resolve_config_path(config_path: Union[str, Path]) -> Path:
+    """
+    Ścieżka bezwzględna lub względna wobec katalogu roboczego; dla zgodności nazwa,
+    której nie ma w katalogu roboczym, jest szukana w katalogu config/.
+    """
+    path = Path(config_path)
+    if path.is_absolute() or path.exists():
+        return path
+    return Path(__file__).parent / path
+
+
+def load_config(config_path: Union[str, Path] = DEFAULT_CONFIG_PATH) -> dict:
+    CONFIG_PATH = resolve_config_path(config_path)
     try:
         with open(CONFIG_PATH, 'r') as f:
             config = yaml.safe_load(f)
@@ -12,4 +29,20 @@ def load_config(config_path: str = "config.yaml") -> dict:
     except yaml.YAMLError as e:
         raise ValueError(f"Błąd podczas parsowania pliku YAML: {e}")
 
-CONFIG = load_config()
+
+def get_config() -> dict:
+    """
+    Domyślna konfiguracja (config/config.yaml), wczytywana przy pierwszym użyciu,
+    a nie przy imporcie modułu - main.py wczytuje plik wskazany w --config.
+    """
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = load_config()
+    return _CONFIG
+
+
+def __getattr__(name: str):
+    # `from config import CONFIG` nadal działa, ale plik jest czytany dopiero wtedy
+    if name == 'CONFIG':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,15 +2,25 @@
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import aiohttp
 from pydantic import BaseModel
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from utils.retry import retry_async
+from utils.atomic_io import atomic_write_bytes
+from utils.manifest import Manifest
+from utils.retry import CircuitBreaker, CircuitOpenError, call_with_retry
 from utils.folder_manager import FolderManager
+from utils.pipeline import StageQueue
+from utils.tracing import TRACER, new_snapshot_id
+from data_acquisition.fetch_metrics import FETCH_SECONDS, FETCH_BYTES, FETCH_ERRORS, FETCH_OVERRUNS
+
+if TYPE_CHECKING:
+    # numpy i protobuf ładuje main.py tylko przy włączonym stanie bieżącym
+    from live.state_store import LiveStateStore
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +30,18 @@ class DynamicDataFetcherConfig(BaseModel):
     raw_dir: Path
 
 class DynamicDataFetcher:
-    def __init__(self, config):
+    """
+    Pobiera dane dynamiczne do folderów w `raw_dir`. W potoku (`main_async`) zgłasza
+    ukończone foldery do kolejki ETL (`folder_queue`), a surowe snapshoty do kolejki
+    stanu bieżącego (`live_queue`); bez kolejek stan bieżący aktualizuje bezpośrednio.
+
+    Ponowienia każdego kanału kończą się przed następnym cyklem (termin to ułamek
+    `retry.deadline_fraction` interwału), a każdy kanał ma własny bezpiecznik, więc
+    niedziałające źródło nie opóźnia pozostałych ani nie nakłada cykli na siebie.
+    """
+
+    def __init__(self, config, state_store: Optional["LiveStateStore"] = None,
+                 live_queue: Optional[StageQueue] = None, folder_queue: Optional[StageQueue] = None):
         self.config = DynamicDataFetcherConfig(
             interval_seconds=config['data_acquisition']['dynamic']['interval_seconds'],
             urls=config['data_acquisition']['dynamic']['urls'],
@@ -29,33 +50,90 @@ class DynamicDataFetcher:
         self.raw_dir = self.config.raw_dir
         self.raw_dir.mkdir(parents=True, exist_ok=True)
         self.max_files_per_folder = config['data_acquisition']['dynamic'].get('max_files_per_folder', 10)
-        self.folder_manager = FolderManager(self.raw_dir, self.max_files_per_folder)
+        self._done_folders: List[Path] = []
+        self.manifest = Manifest.from_config(config)
+        self.folder_manager = FolderManager(self.raw_dir, self.max_files_per_folder,
+                                            on_done=self._done_folders.append, manifest=self.manifest)
+        self.state_store = state_store
+        self.live_queue = live_queue
+        self.folder_queue = folder_queue
+        self.retry_config = config['data_acquisition']['dynamic'].get('retry', {})
+        self.breakers = {
+            key: CircuitBreaker(f"dynamic:{key}",
+                                failure_threshold=self.retry_config.get('breaker_failure_threshold', 5),
+                                reset_timeout=self.retry_config.get('breaker_reset_seconds', 60))
+            for key in self.config.urls
+        }
 
-    @retry_async(exceptions=(aiohttp.ClientError,), tries=3, delay=2, logger=logger)
-    async def fetch(self, session: aiohttp.ClientSession, key: str, url: str):
+    async def fetch(self, session: aiohttp.ClientSession, key: str, url: str, deadline: Optional[float] = None):
+        """
+        Pobiera kanał z ponowieniami (full jitter) zakończonymi przed terminem `deadline`
+        (time.monotonic()), o ile bezpiecznik kanału jest zamknięty.
+        """
+        await call_with_retry(self.fetch_once, session, key, url,
+                              exceptions=(aiohttp.ClientError,),
+                              tries=self.retry_config.get('tries', 3),
+                              delay=self.retry_config.get('delay', 1.0),
+                              max_delay=self.retry_config.get('max_delay', 4.0),
+                              jitter=True, deadline=deadline, breaker=self.breakers[key],
+                              name=f"dynamic:{key}", logger=logger)
+
+    async def fetch_once(self, session: aiohttp.ClientSession, key: str, url: str):
         """
         Asynchronicznie pobiera dane z podanego URL i zapisuje je do pliku.
         """
         timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        filename = f"{key}_{timestamp}.pb"
+        snapshot_id = new_snapshot_id()
+        # Identyfikator snapshotu w nazwie pliku pozwala śledzić go przez ETL i loader
+        filename = f"{key}_{timestamp}_{snapshot_id}.pb"
         category_folder = self.folder_manager.get_current_folder(key)
         filepath = category_folder / filename
 
-        async with session.get(url) as response:
-            response.raise_for_status()
-            data = await response.read()
-            filepath.write_bytes(data)
-            logger.info(f"Pobrano dane dynamiczne: {filepath}")
+        fetch_start = time.time()
+        try:
+            with FETCH_SECONDS.time(source='dynamic', feed=key):
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+        except Exception:
+            FETCH_ERRORS.inc(source='dynamic', feed=key)
+            raise
+        if response.status == 304:
+            logger.debug("Brak zmian w danych dynamicznych %s (304).", key)
+            return
+        FETCH_BYTES.inc(len(data), source='dynamic', feed=key)
+        atomic_write_bytes(filepath, data)
+        TRACER.record([snapshot_id], 'fetch', fetch_start, time.time(), feed=key, bytes=len(data))
+        logger.info("Pobrano dane dynamiczne: %s", filepath)
+
+        if self.live_queue is not None:
+            await self.live_queue.put((key, data))
+        elif self.state_store is not None:
+            try:
+                await asyncio.to_thread(self.state_store.apply_feed, data)
+            except Exception as e:
+                logger.exception(f"Błąd aktualizacji stanu bieżącego z {filepath}: {e}")
 
     async def fetch_all(self):
         """
         Pobiera wszystkie zdefiniowane dane dynamiczne jednocześnie.
         """
+        deadline = time.monotonic() + self.config.interval_seconds * self.retry_config.get('deadline_fraction', 0.9)
         async with aiohttp.ClientSession() as session:
             tasks = []
             for key, url in self.config.urls.items():
-                tasks.append(self.fetch(session, key, url))
-            await asyncio.gather(*tasks, return_exceptions=True)
+                tasks.append(self.fetch(session, key, url, deadline=deadline))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for key, result in zip(self.config.urls, results):
+            if isinstance(result, CircuitOpenError):
+                logger.debug("Pominięto kanał %s: %s", key, result)
+            elif isinstance(result, Exception):
+                logger.error("Nie pobrano kanału %s: %r", key, result)
+        done_folders = list(self._done_folders)
+        self._done_folders.clear()
+        if self.folder_queue is not None:
+            for folder in done_folders:
+                await self.folder_queue.put(folder)
 
     async def run(self):
         """
@@ -74,4 +152,5 @@ class DynamicDataFetcher:
                 await asyncio.sleep(sleep_duration)
             else:
                 logger.warning("Pobieranie trwało dłużej niż interwał czasowy.")
+                FETCH_OVERRUNS.inc(source='dynamic')
                 next_run = datetime.utcnow()
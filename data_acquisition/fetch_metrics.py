@@ -0,0 +1,9 @@
+# data_acquisition/fetch_metrics.py
+
+from utils.metrics import REGISTRY
+
+FETCH_SECONDS = REGISTRY.histogram('bimba_fetch_duration_seconds', 'Czas pobrania pliku', ('source', 'feed'))
+FETCH_BYTES = REGISTRY.counter('bimba_fetch_bytes_total', 'Pobrane bajty', ('source', 'feed'))
+FETCH_ERRORS = REGISTRY.counter('bimba_fetch_errors_total', 'Nieudane próby pobrania', ('source', 'feed'))
+FETCH_OVERRUNS = REGISTRY.counter('bimba_fetch_interval_overruns_total',
+                                  'Cykle pobierania dłuższe niż interwał', ('source',))
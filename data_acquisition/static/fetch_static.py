@@ -9,9 +9,11 @@ import aiohttp
 import pandas as pd
 from pydantic import BaseModel
 
+from utils.atomic_io import atomic_path, atomic_write_bytes
 from utils.hash_utils import calculate_hash
 from utils.last_modified_manager import LastModifiedManager
 from utils.retry import retry_async
+from data_acquisition.fetch_metrics import FETCH_SECONDS, FETCH_BYTES, FETCH_ERRORS
 from etl.transform_static_to_parquet import TransformStaticToParquet
 
 logger = logging.getLogger(__name__)
@@ -85,12 +87,13 @@ class StaticDataFetcher:
 
             # Zapis do Parquet w odpowiednim folderze
             processed_file = folder / f"vehicle_dictionary_{timestamp}.parquet"
-            df.to_parquet(processed_file, index=False)
+            with atomic_path(processed_file) as tmp_file:
+                df.to_parquet(tmp_file, index=False)
             logger.info(f"Zapisano plik: {processed_file}")
         except Exception as e:
             logger.exception(f"Błąd podczas przetwarzania pliku {csv_path}: {e}")
 
-    @retry_async(exceptions=(aiohttp.ClientError,), tries=3, delay=2, logger=logger)
+    @retry_async(exceptions=(aiohttp.ClientError,), tries=3, delay=2, logger=logger, jitter=True)
     async def fetch_file(
         self,
         session: aiohttp.ClientSession,
@@ -114,19 +117,29 @@ class StaticDataFetcher:
         existing_hash = metadata.get('Hash')
         logger.debug(f"Zapisany hash dla {url}: {existing_hash}")
 
-        async with session.get(url) as response:
-            response.raise_for_status()
-            new_data = await response.read()
-            new_hash = calculate_hash(new_data)
-            logger.debug(f"Nowy hash dla {url}: {new_hash}")
-
-            if new_hash == existing_hash:
-                logger.info(f"Brak nowych danych dla {url} (hash nie zmienił się).")
-                return None
-            else:
-                timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-                filename_with_timestamp = f"{key}_{timestamp}{Path(filename).suffix}"
-                return self._save_file(key, url, filename_with_timestamp, new_data)
+        try:
+            with FETCH_SECONDS.time(source='static', feed=key):
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    new_data = await response.read()
+        except Exception:
+            FETCH_ERRORS.inc(source='static', feed=key)
+            raise
+        if response.status == 304:
+            logger.info(f"Brak nowych danych dla {url} (304).")
+            return None
+        FETCH_BYTES.inc(len(new_data), source='static', feed=key)
+
+        new_hash = calculate_hash(new_data)
+        logger.debug(f"Nowy hash dla {url}: {new_hash}")
+
+        if new_hash == existing_hash:
+            logger.info(f"Brak nowych danych dla {url} (hash nie zmienił się).")
+            return None
+        else:
+            timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+            filename_with_timestamp = f"{key}_{timestamp}{Path(filename).suffix}"
+            return self._save_file(key, url, filename_with_timestamp, new_data)
 
     def _save_file(
         self,
@@ -150,7 +163,7 @@ class StaticDataFetcher:
         output_dir = self.raw_dir / key
         output_dir.mkdir(parents=True, exist_ok=True)
         filepath = output_dir / filename
-        filepath.write_bytes(data)
+        atomic_write_bytes(filepath, data)
         logger.info(f"Pobrano dane statyczne: {filepath}")
 
         file_hash = calculate_hash(data)
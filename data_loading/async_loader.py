@@ -0,0 +1,189 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Optional, Set, Tuple
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from loguru import logger
+
+from .load_to_db import DataLoader, BACKLOG_FILES, BATCH_SECONDS
+from utils.db_utils import remove_existing_keys
+from utils.notifications import ParquetReadyNotifier
+from utils.pipeline import StageQueue
+from utils.tracing import trace_load
+from utils.transformations import transform_dynamic_df
+
+
+def to_async_uri(uri: str) -> str:
+    """
+    Zamienia sterownik w URI bazy na asyncpg (np. postgresql+psycopg2:// -> postgresql+asyncpg://).
+    """
+    scheme, rest = uri.split('://', 1)
+    return f"{scheme.split('+')[0]}+asyncpg://{rest}"
+
+
+class AsyncDataLoader:
+    """
+    Asynchroniczna wersja DataLoader.
+
+    Dane dynamiczne ładowane są przez asyncpg z puli połączeń o zadanym rozmiarze,
+    równolegle dla różnych tabel (`loader.max_concurrency`). Zamiast stałego czekania
+    loader budzi się po powiadomieniu z ETL o nowym pliku Parquet, a `check_interval`
+    jest tylko zabezpieczeniem, gdy ETL działa w innym procesie. W potoku loader
+    budzi się po odebraniu plików z `parquet_queue`, co zwalnia miejsce dla ETL.
+    Dane statyczne (rzadkie, ciężkie obliczeniowo) ładuje synchroniczny DataLoader w wątku.
+    """
+
+    def __init__(self, config: dict, notifier: Optional[ParquetReadyNotifier] = None,
+                 parquet_queue: Optional[StageQueue] = None):
+        self.config = config
+        loader_config = self.config.get('loader', {})
+        database_config = self.config['database']
+        self.engine = create_async_engine(
+            database_config.get('async_uri') or to_async_uri(database_config['uri']),
+            pool_size=loader_config.get('async_pool_size', 5),
+            max_overflow=0,
+        )
+        self.static_loader = DataLoader(config)
+        self.notifier = notifier or ParquetReadyNotifier()
+        self.parquet_queue = parquet_queue
+        self.semaphore = asyncio.Semaphore(loader_config.get('max_concurrency', 2))
+        self.check_interval = self.config.get('check_interval', 30)
+        self._stop_event = asyncio.Event()
+
+        dynamic_dir = Path(self.config['data_storage']['dynamic_dir'])
+        self.dynamic_tables = [
+            (dynamic_dir / 'trip_updates', 'trip_updates', ('trip_id', 'timestamp', 'version_id')),
+            (dynamic_dir / 'vehicle_positions', 'vehicle_positions', ('entity_id', 'timestamp', 'version_id')),
+        ]
+
+    async def run(self):
+        await asyncio.to_thread(self.static_loader.run_initial_setup)
+        logger.info("Uruchamianie asynchronicznego ładowania danych.")
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    await asyncio.to_thread(self.static_loader.maintain_static_data)
+                    await self.load_dynamic_data()
+                    await asyncio.to_thread(self.static_loader.refresh_reports)
+                except Exception as e:
+                    logger.exception(f"Błąd podczas asynchronicznego przetwarzania danych: {e}")
+                await self._wait_for_work()
+        finally:
+            await self.engine.dispose()
+            logger.info("Zakończono asynchroniczne ładowanie danych.")
+
+    def stop(self):
+        self._stop_event.set()
+        self.notifier.notify()
+        logger.info("Przerwano asynchroniczne ładowanie danych.")
+
+    async def _wait_for_work(self):
+        if self._stop_event.is_set():
+            return
+        if self.parquet_queue is not None:
+            # Pliki z kolejki są i tak w katalogach - odebranie ich tylko budzi loader i zwalnia miejsce
+            notified = bool(await self.parquet_queue.get_batch(timeout=self.check_interval))
+        else:
+            notified = await self.notifier.wait(timeout=self.check_interval)
+        if not notified:
+            logger.debug(f"Brak powiadomień od ETL przez {self.check_interval} s - sprawdzam katalogi.")
+
+    async def load_dynamic_data(self):
+        version_id = await self._current_version()
+        if not version_id:
+            logger.error("Brak wersji danych statycznych. Najpierw załaduj dane statyczne.")
+            return
+        valid_trip_ids = await self._valid_trip_ids(version_id)
+        await asyncio.gather(*(
+            self._load_table(path, table_name, version_id, pk_cols, valid_trip_ids)
+            for path, table_name, pk_cols in self.dynamic_tables
+        ))
+
+    async def _load_table(self, path: Path, table_name: str, version_id: int,
+                          pk_cols: Tuple[str, ...], valid_trip_ids: Set[str]):
+        if not path.exists():
+            logger.warning(f"Brak folderu {path}")
+            return
+        async with self.semaphore:
+            files = await asyncio.to_thread(self.static_loader.candidate_files, path)
+            processed = await self._processed_files([str(f) for f in files])
+            new_files = [f for f in files if str(f) not in processed]
+            if processed:
+                await asyncio.to_thread(self.static_loader.record_loaded,
+                                        [f for f in files if str(f) in processed], table_name)
+            BACKLOG_FILES.set(len(new_files), table=table_name)
+            for file_path in new_files:
+                if self._stop_event.is_set():
+                    return
+                BACKLOG_FILES.dec(table=table_name)
+                leases = self.static_loader.leases
+                if leases is not None and not leases.acquire(file_path.name):
+                    continue
+                try:
+                    # Inny worker mógł załadować plik przed przejęciem dzierżawy
+                    if leases is None or not await self._processed_files([str(file_path)]):
+                        with BATCH_SECONDS.time(table=table_name):
+                            await self._load_file(file_path, table_name, version_id, pk_cols, valid_trip_ids)
+                except Exception as e:
+                    logger.exception(f"Błąd podczas wstawiania danych z pliku {file_path} do tabeli {table_name}: {e}")
+                finally:
+                    if leases is not None:
+                        leases.release(file_path.name)
+
+    async def _load_file(self, file_path: Path, table_name: str, version_id: int,
+                         pk_cols: Tuple[str, ...], valid_trip_ids: Set[str]):
+        df = await asyncio.to_thread(self._prepare_frame, file_path, table_name, version_id, valid_trip_ids)
+
+        load_start = time.time()
+        async with self.engine.connect() as conn:
+            if not df.empty:
+                df = await conn.run_sync(lambda sync_conn: remove_existing_keys(df, sync_conn, table_name, pk_cols))
+            if not df.empty:
+                await conn.run_sync(lambda sync_conn: self._insert(sync_conn, df, table_name))
+            await conn.execute(
+                text("INSERT INTO processed_files (file_path) VALUES (:file_path) ON CONFLICT (file_path) DO NOTHING;"),
+                {'file_path': str(file_path)},
+            )
+            await conn.commit()
+        await asyncio.to_thread(self.static_loader.record_loaded, [file_path], table_name)
+        await asyncio.to_thread(trace_load, file_path, table_name, load_start, time.time())
+        logger.info("Załadowano {} rekordów do tabeli {} z pliku {}.", len(df), table_name, file_path)
+
+    @staticmethod
+    def _prepare_frame(file_path: Path, table_name: str, version_id: int, valid_trip_ids: Set[str]) -> pd.DataFrame:
+        df = pd.read_parquet(file_path)
+        df['version_id'] = version_id
+        return transform_dynamic_df(df, table_name, valid_trip_ids=valid_trip_ids)
+
+    def _insert(self, sync_conn, df: pd.DataFrame, table_name: str):
+        with sync_conn.begin():
+            df.to_sql(table_name, sync_conn, if_exists='append', index=False)
+            self.static_loader.after_insert(sync_conn, table_name, df)
+
+    async def _current_version(self) -> Optional[int]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(
+                "SELECT version_id FROM static_data_versions WHERE published ORDER BY version_id DESC LIMIT 1;"
+            ))
+            row = result.fetchone()
+        return row[0] if row else None
+
+    async def _valid_trip_ids(self, version_id: int) -> Set[str]:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                text("SELECT trip_id FROM trips WHERE static_row_visible(version_id, valid_to_version, :version_id)"),
+                {'version_id': version_id},
+            )
+            return {row[0] for row in result}
+
+    async def _processed_files(self, file_paths) -> Set[str]:
+        if not file_paths:
+            return set()
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                text("SELECT file_path FROM processed_files WHERE file_path = ANY(:file_paths)"),
+                {'file_paths': list(file_paths)},
+            )
+            return {row[0] for row in result}
@@ -0,0 +1,45 @@
+import pandas as pd
+from sqlalchemy import text
+from loguru import logger
+
+from .schema_manager import SchemaManager
+from utils.db_utils import copy_insert
+
+
+class BulkStaticWriter:
+    """
+    Szybka ścieżka ładowania dużych tabel statycznych (pierwsze ładowanie miasta,
+    duże zmiany rozkładu).
+
+    Dane trafiają przez COPY do tabeli UNLOGGED bez indeksów, klucze obce są sprawdzane
+    jednym zapytaniem na klucz, a następnie wiersze są przenoszone jednym INSERT ... SELECT.
+    Gdy tabela docelowa jest pusta, jej klucz główny jest usuwany na czas ładowania
+    i odbudowywany jednym przebiegiem.
+    """
+
+    def __init__(self, min_rows: int = 100000):
+        self.min_rows = min_rows
+
+    def should_use(self, conn, table_name: str, rows: int) -> bool:
+        return rows >= self.min_rows or self._is_empty(conn, table_name)
+
+    def write(self, conn, df: pd.DataFrame, table_name: str, version_id: int):
+        staging_table = SchemaManager.create_staging_table(conn, table_name, suffix=f"_{version_id}")
+        df.to_sql(staging_table, conn, if_exists='append', index=False, method=copy_insert, chunksize=100000)
+        SchemaManager.validate_foreign_keys(conn, table_name, staging_table, version_id)
+
+        cold_start = self._is_empty(conn, table_name)
+        pk_dropped = cold_start and SchemaManager.drop_primary_key(conn, table_name)
+
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        conn.execute(text(f"INSERT INTO public.{table_name} ({columns}) SELECT {columns} FROM public.{staging_table};"))
+        if pk_dropped:
+            SchemaManager.restore_primary_key(conn, table_name)
+        conn.execute(text(f"DROP TABLE public.{staging_table};"))
+        if cold_start:
+            conn.execute(text(f"ANALYZE public.{table_name};"))
+        logger.info(f"Masowo załadowano {len(df)} rekordów do tabeli {table_name} (pierwsze ładowanie: {cold_start}).")
+
+    @staticmethod
+    def _is_empty(conn, table_name: str) -> bool:
+        return not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM public.{table_name});")).scalar()
@@ -1,25 +1,52 @@
+import asyncio
 import time
 from pathlib import Path
-from typing import Tuple
+from typing import Iterable, List, Optional, Set, Tuple
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from loguru import logger
 
 from .schema_manager import SchemaManager
+from .bulk_loader import BulkStaticWriter
+from .static_diff import StaticDiffLoader
+from .static_loader import ParallelStaticLoader
 from .version_manager import DataVersionManager
 from .processed_managers import ProcessedFoldersManager, ProcessedFilesManager
+from reporting.delay_report import DelayReportBuilder
+from reporting.delay_rollups import DelayRollups
 from utils.db_utils import remove_existing_keys
+from utils.leases import LeaseManager
+from utils.manifest import BOOTSTRAPPED, LOADED, WRITTEN, Manifest
+from utils.metrics import REGISTRY
+from utils.pipeline import StageQueue
+from utils.tracing import trace_load
 from utils.transformations import transform_static_df, transform_dynamic_df
 
+LOADED_ROWS = REGISTRY.counter('bimba_loader_rows_total', 'Wiersze wstawione do bazy', ('table',))
+BATCH_SECONDS = REGISTRY.histogram('bimba_loader_batch_seconds', 'Czas ładowania jednego pliku', ('table',))
+BACKLOG_FILES = REGISTRY.gauge('bimba_loader_backlog_files', 'Pliki Parquet oczekujące na załadowanie', ('table',))
+FRESHNESS_SECONDS = REGISTRY.gauge('bimba_data_freshness_seconds',
+                                   'Wiek najnowszego rekordu w ostatnio wstawionej paczce', ('table',))
+
 class DataLoader:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, parquet_queue: Optional[StageQueue] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
         self.config = config
-        self.engine = create_engine(self.config['database']['uri'])
+        loader_config = self.config.get('loader', {})
+        static_max_workers = loader_config.get('static_max_workers', 4)
+        self.engine = create_engine(
+            self.config['database']['uri'],
+            pool_size=self.config['database'].get('pool_size', static_max_workers + 1),
+        )
         self.Session = sessionmaker(bind=self.engine)
         self.session = self.Session()
 
-        self.schema_manager = SchemaManager(self.engine)
+        self.schema_manager = SchemaManager(self.engine, self.config['database'].get('partitioning'))
+        bulk_config = loader_config.get('bulk_load', {})
+        bulk_writer = BulkStaticWriter(bulk_config.get('min_rows', 100000)) if bulk_config.get('enabled', False) else None
+        self.static_diff_loader = StaticDiffLoader(self.engine, bulk_writer=bulk_writer)
+        self.static_loader = ParallelStaticLoader(self.load_static_file, max_workers=static_max_workers)
         self.version_manager = DataVersionManager(self.session)
         self.processed_folders = ProcessedFoldersManager(self.session)
         self.processed_files = ProcessedFilesManager(self.session)
@@ -28,12 +55,58 @@ class DataLoader:
         self.dynamic_trip_updates_path = Path(self.config['data_storage']['dynamic_dir']) / 'trip_updates'
         self.dynamic_vehicle_positions_path = Path(self.config['data_storage']['dynamic_dir']) / 'vehicle_positions'
         self.vehicle_dictionary_path = Path(self.config['data_storage'].get('vehicle_dictionary_dir', ''))
+        self.manifest = Manifest.from_config(self.config)
+        # W trybie workerów każdy plik Parquet ładuje ten loader, który ma jego dzierżawę
+        self.leases = LeaseManager.from_config(self.config, 'parquet')
+        # Partycje i dane statyczne obsługuje naraz tylko jeden worker
+        self.static_leases = LeaseManager.from_config(self.config, 'static')
+
+        partitioning_config = self.config['database'].get('partitioning', {})
+        reporting_config = self.config.get('reporting', {})
+        service_day_config = {
+            'timezone': partitioning_config.get('timezone', 'Europe/Warsaw'),
+            'day_start_hour': partitioning_config.get('day_start_hour', 4),
+        }
+        self.report_builder = DelayReportBuilder(self.engine, **service_day_config) \
+            if reporting_config.get('enabled', False) else None
+        self.rollups = DelayRollups(self.engine, **service_day_config) \
+            if reporting_config.get('rollups', False) else None
 
         self.check_interval = self.config.get('check_interval', 30)
+        # Loader działa w wątku, a kolejka od ETL należy do pętli zdarzeń głównego procesu
+        self.parquet_queue = parquet_queue
+        self.loop = loop
         self.stop_requested = False
 
     def run_initial_setup(self):
         self.schema_manager.create_tables_if_not_exists()
+        if self.report_builder:
+            self.report_builder.create_tables_if_not_exists()
+        if self.rollups:
+            self.rollups.create_tables_if_not_exists()
+        if self.static_leases is None:
+            self.version_manager.discard_unpublished_versions()
+
+    def maintain_static_data(self):
+        """
+        Utrzymanie partycji i ładowanie nowych danych statycznych. W trybie workerów
+        wykonuje je tylko posiadacz dzierżawy `static` - dwa loadery ładujące ten sam
+        folder GTFS tworzyłyby zdublowane wersje, a start kolejnego workera wycofywałby
+        wersję ładowaną właśnie przez inny.
+        """
+        if self.static_leases is None:
+            self.schema_manager.maintain_partitions()
+            self.load_static_data()
+            return
+        if not self.static_leases.acquire('static'):
+            return
+        try:
+            # Pod dzierżawą nikt inny nie ładuje - niepublikowane wersje to pozostałości awarii
+            self.version_manager.discard_unpublished_versions()
+            self.schema_manager.maintain_partitions()
+            self.load_static_data()
+        finally:
+            self.static_leases.release('static')
 
     def load_static_data(self):
         new_gtfs_folders = [f for f in sorted(self.static_data_path.glob('gtfs_*')) if not self.processed_folders.is_folder_processed(f.name)]
@@ -47,18 +120,26 @@ class DataLoader:
                 current_version = self.version_manager.create_new_version("Pierwsza wersja danych statycznych")
             return
         else:
-            new_version_id = self.version_manager.create_new_version(description="Nowe dane statyczne")
+            # Każdy folder GTFS to osobna wersja - ładowana jako różnica względem poprzedniej
             for folder in new_gtfs_folders:
-                self.load_static_folder(folder, new_version_id)
+                new_version_id = self.version_manager.create_new_version(
+                    description=f"Nowe dane statyczne: {folder.name}", published=False
+                )
+                try:
+                    self.load_static_folder(folder, new_version_id)
+                except Exception:
+                    self.version_manager.discard_version(new_version_id)
+                    raise
+                # Wersja staje się widoczna dopiero po załadowaniu wszystkich tabel
+                self.version_manager.publish_version(new_version_id)
                 self.processed_folders.mark_folder_as_processed(folder.name)
+                logger.info(f"Załadowano nowe dane statyczne do wersji {new_version_id}.")
 
             if new_vehicle_dict:
                 # Vehicle dictionary - nie ładujemy do bazy, tylko do Parquet, co już się dzieje gdzie indziej.
                 # Oznaczamy folder jako przetworzony, ale nie ładujemy do bazy
                 self.processed_folders.mark_folder_as_processed(self.vehicle_dictionary_path.name)
 
-            logger.info(f"Załadowano nowe dane statyczne do wersji {new_version_id}.")
-
     def load_static_folder(self, folder_path: Path, version_id: int):
         file_mapping = {
             'agency': 'agency.parquet',
@@ -72,10 +153,12 @@ class DataLoader:
             'stop_times': 'stop_times.parquet'
         }
 
-        for table_name, file_name in file_mapping.items():
-            file_path = folder_path / file_name
-            if file_path.exists():
-                self.load_static_file(file_path, table_name, version_id)
+        files = {
+            table_name: folder_path / file_name
+            for table_name, file_name in file_mapping.items()
+            if (folder_path / file_name).exists()
+        }
+        self.static_loader.load(files, version_id)
 
     def load_static_file(self, file_path: Path, table_name: str, version_id: int):
         # Pomijamy vehicle_dictionary - nie ładujemy do bazy
@@ -84,7 +167,6 @@ class DataLoader:
             return
 
         df = pd.read_parquet(file_path)
-        df['version_id'] = version_id
         df = transform_static_df(df, table_name)
 
         # Usuwamy duplikaty przed wstawieniem do bazy
@@ -94,8 +176,9 @@ class DataLoader:
         if removed > 0:
             logger.info(f"Usunięto {removed} duplikatów przed wstawieniem do tabeli {table_name}.")
 
-        df.to_sql(table_name, self.engine, if_exists='append', index=False)
-        logger.info(f"Załadowano {len(df)} rekordów do tabeli {table_name} z pliku {file_path}.")
+        # Wstawiamy tylko wiersze zmienione względem poprzedniej wersji
+        stats = self.static_diff_loader.load_table(df, table_name, version_id)
+        logger.info(f"Załadowano {stats['inserted']} rekordów do tabeli {table_name} z pliku {file_path}.")
 
     def load_dynamic_data(self):
         current_version = self.version_manager.get_current_version()
@@ -113,44 +196,116 @@ class DataLoader:
             logger.warning(f"Brak folderu {path}")
             return
 
-        files = sorted(path.glob('*.parquet'))
+        files = self.candidate_files(path)
         if not files:
             logger.info(f"Brak plików do załadowania w {path}")
             return
 
         new_files = [f for f in files if not self.processed_files.is_file_processed(str(f))]
+        self.record_loaded(set(files) - set(new_files), table_name)
+        BACKLOG_FILES.set(len(new_files), table=table_name)
         if not new_files:
             logger.info(f"Brak nowych plików do przetworzenia w {path}")
             return
 
         # Wczytanie valid_trip_ids do walidacji
-        trips_in_db = pd.read_sql(f"SELECT trip_id FROM trips WHERE version_id={version_id}", self.engine)
+        trips_in_db = pd.read_sql(
+            text("SELECT trip_id FROM trips WHERE static_row_visible(version_id, valid_to_version, :version_id)"),
+            self.engine,
+            params={'version_id': version_id},
+        )
         valid_trip_ids = set(trips_in_db['trip_id'])
 
         for file_path in new_files:
-            df = pd.read_parquet(file_path)
-            df['version_id'] = version_id
-            df = transform_dynamic_df(df, table_name, valid_trip_ids=valid_trip_ids)
-
-            if df.empty:
-                logger.info(f"Po czyszczeniu brak danych do załadowania z pliku {file_path}.")
-                self.processed_files.mark_file_as_processed(str(file_path))
+            BACKLOG_FILES.dec(table=table_name)
+            if self.leases is None:
+                self._load_dynamic_file(file_path, table_name, version_id, pk_cols, valid_trip_ids)
+                continue
+            if not self.leases.acquire(file_path.name):
                 continue
+            try:
+                # Inny worker mógł załadować plik przed przejęciem dzierżawy
+                if not self.processed_files.is_file_processed(str(file_path)):
+                    self._load_dynamic_file(file_path, table_name, version_id, pk_cols, valid_trip_ids)
+            finally:
+                self.leases.release(file_path.name)
+
+    def _load_dynamic_file(self, file_path: Path, table_name: str, version_id: int, pk_cols: Tuple[str, ...],
+                           valid_trip_ids: Set[str]):
+        df = pd.read_parquet(file_path)
+        df['version_id'] = version_id
+        df = transform_dynamic_df(df, table_name, valid_trip_ids=valid_trip_ids)
 
-            with self.engine.connect() as conn:
-                df = remove_existing_keys(df, conn, table_name, pk_cols)
+        if df.empty:
+            logger.info(f"Po czyszczeniu brak danych do załadowania z pliku {file_path}.")
+            self.mark_file_loaded(file_path, table_name)
+            return
 
-            if df.empty:
-                logger.info(f"Po usunięciu duplikatów brak danych do załadowania z pliku {file_path}.")
-                self.processed_files.mark_file_as_processed(str(file_path))
-                continue
+        with self.engine.connect() as conn:
+            df = remove_existing_keys(df, conn, table_name, pk_cols)
 
-            try:
-                df.to_sql(table_name, self.engine, if_exists='append', index=False)
-                self.processed_files.mark_file_as_processed(str(file_path))
-                logger.info(f"Załadowano {len(df)} rekordów do tabeli {table_name} z pliku {file_path}.")
-            except Exception as e:
-                logger.exception(f"Błąd podczas wstawiania danych z pliku {file_path} do tabeli {table_name}: {e}")
+        if df.empty:
+            logger.info(f"Po usunięciu duplikatów brak danych do załadowania z pliku {file_path}.")
+            self.mark_file_loaded(file_path, table_name)
+            return
+
+        try:
+            load_start = time.time()
+            with BATCH_SECONDS.time(table=table_name), self.engine.begin() as conn:
+                df.to_sql(table_name, conn, if_exists='append', index=False)
+                self.after_insert(conn, table_name, df)
+            trace_load(file_path, table_name, load_start, time.time())
+            self.mark_file_loaded(file_path, table_name)
+            logger.info("Załadowano {} rekordów do tabeli {} z pliku {}.", len(df), table_name, file_path)
+        except Exception as e:
+            logger.exception(f"Błąd podczas wstawiania danych z pliku {file_path} do tabeli {table_name}: {e}")
+
+    def candidate_files(self, path: Path) -> List[Path]:
+        """
+        Pliki Parquet tabeli do sprawdzenia, od najstarszego. Z manifestem są to pliki
+        zapisane przez ETL i jeszcze niezaładowane - katalog jest listowany tylko raz,
+        po włączeniu manifestu, aby przejąć pliki zapisane wcześniej.
+        """
+        if self.manifest is None:
+            return sorted(path.glob('*.parquet'))
+        if not self.manifest.has(BOOTSTRAPPED, path):
+            self.manifest.record_many([(WRITTEN, f, {}) for f in sorted(path.glob('*.parquet'))]
+                                      + [(BOOTSTRAPPED, path, {})])
+        # Ścieżki w postaci z konfiguracji, jak w processed_files
+        files = [path / f.name for f in self.manifest.pending(WRITTEN, LOADED, path)]
+        missing = [f for f in files if not f.exists()]
+        if missing:
+            logger.warning(f"Brak {len(missing)} plików z manifestu w {path} - pomijam je.")
+            self.manifest.record_many([(LOADED, f, {'missing': True}) for f in missing])
+        return [f for f in files if f.exists()]
+
+    def record_loaded(self, file_paths: Iterable[Path], table_name: str):
+        """
+        Zapisuje w manifeście załadowanie plików (już odnotowanych w processed_files).
+        """
+        if self.manifest is not None:
+            self.manifest.record_many([(LOADED, f, {'table': table_name}) for f in file_paths])
+
+    def mark_file_loaded(self, file_path: Path, table_name: str):
+        self.processed_files.mark_file_as_processed(str(file_path))
+        self.record_loaded([file_path], table_name)
+
+    def after_insert(self, conn, table_name: str, df: pd.DataFrame):
+        """
+        Aktualizuje struktury pochodne w tej samej transakcji co wstawienie danych dynamicznych.
+        """
+        LOADED_ROWS.inc(len(df), table=table_name)
+        FRESHNESS_SECONDS.set(time.time() - df['timestamp'].max(), table=table_name)
+        if table_name != 'trip_updates':
+            return
+        if self.report_builder:
+            self.report_builder.mark_trips(conn, df)
+        if self.rollups:
+            self.rollups.update(conn, df)
+
+    def refresh_reports(self):
+        if self.report_builder:
+            self.report_builder.refresh_pending()
 
     def run(self):
         """
@@ -160,16 +315,38 @@ class DataLoader:
         logger.info("Uruchamianie cyklicznego ładowania danych statycznych i dynamicznych.")
         while not self.stop_requested:
             try:
-                self.load_static_data()
+                self.maintain_static_data()
                 self.load_dynamic_data()
+                self.refresh_reports()
             except Exception as e:
                 logger.exception(f"Błąd podczas cyklicznego przetwarzania danych: {e}")
 
             if self.stop_requested:
                 break
 
+            self._wait_for_work()
+
+    def _wait_for_work(self):
+        """
+        Czeka do następnego przebiegu. Z kolejką od ETL budzi się po odebraniu plików,
+        co zwalnia w niej miejsce - przy polityce `block` ETL zwalnia, gdy loader nie nadąża.
+        """
+        if self.parquet_queue is None or self.loop is None:
             logger.info(f"Oczekiwanie {self.check_interval} sekund do następnego sprawdzenia.")
             time.sleep(self.check_interval)
+            return
+        future = asyncio.run_coroutine_threadsafe(self.parquet_queue.get_batch(timeout=self.check_interval),
+                                                  self.loop)
+        try:
+            # Pliki z kolejki są i tak w katalogach - odebranie ich tylko budzi loader
+            files = future.result(timeout=self.check_interval + 5)
+        except Exception as e:
+            future.cancel()
+            logger.warning(f"Nie udało się odebrać plików z kolejki ETL: {e}")
+            time.sleep(self.check_interval)
+            return
+        if not files:
+            logger.debug(f"Brak powiadomień od ETL przez {self.check_interval} s - sprawdzam katalogi.")
 
     def stop(self):
         self.stop_requested = True
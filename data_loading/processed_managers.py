@@ -31,4 +31,4 @@ class ProcessedFilesManager:
         query = text("INSERT INTO processed_files (file_path) VALUES (:file_path) ON CONFLICT (file_path) DO NOTHING;")
         self.session.execute(query, {'file_path': file_path})
         self.session.commit()
-        logger.info(f"Plik '{file_path}' oznaczony jako przetworzony.")
+        logger.debug("Plik '{}' oznaczony jako przetworzony.", file_path)
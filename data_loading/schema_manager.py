@@ -1,20 +1,86 @@
+import re
+import time
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
 from sqlalchemy import text
 from loguru import logger
 
+from utils.service_day import service_day_bounds, service_day_of
+
+# Klucze naturalne tabel statycznych. Wiersz o danym kluczu może mieć wiele wersji,
+# z których każda jest ważna w przedziale [version_id, valid_to_version).
+# feed_info nie ma klucza - porównywany jest cały wiersz (row_hash).
+STATIC_TABLE_KEYS = {
+    'agency': ('agency_id',),
+    'feed_info': ('row_hash',),
+    'stops': ('stop_id',),
+    'routes': ('route_id',),
+    'calendar': ('service_id',),
+    'calendar_dates': ('service_id', 'date'),
+    'shapes': ('shape_id', 'shape_pt_sequence'),
+    'trips': ('trip_id',),
+    'stop_times': ('trip_id', 'stop_sequence'),
+}
+
+# Logiczne klucze obce między tabelami statycznymi: (kolumna, tabela docelowa, kolumna docelowa).
+# Sprawdzane zbiorczo względem wierszy widocznych w ładowanej wersji (validate_foreign_keys).
+STATIC_FOREIGN_KEYS = {
+    'routes': [('agency_id', 'agency', 'agency_id')],
+    'calendar_dates': [('service_id', 'calendar', 'service_id')],
+    'trips': [('route_id', 'routes', 'route_id'), ('service_id', 'calendar', 'service_id')],
+    'stop_times': [('trip_id', 'trips', 'trip_id'), ('stop_id', 'stops', 'stop_id')],
+}
+
+# Zależności między tabelami statycznymi wynikające z kluczy obcych.
+# Wyznaczają kolejność ładowania - tabela ładowana jest po swoich zależnościach.
+STATIC_TABLE_DEPENDENCIES = {
+    table_name: tuple(sorted({ref_table for _, ref_table, _ in STATIC_FOREIGN_KEYS.get(table_name, [])}))
+    for table_name in STATIC_TABLE_KEYS
+}
+
+# Klucze obce usunięte przy przejściu na różnicowe wersjonowanie. Wiersze powiązane
+# mogą pochodzić z różnych wersji, więc spójność zapewnia widoczność w wersji, a nie FK.
+VERSIONED_FOREIGN_KEYS = {
+    'routes': ['routes_agency_id_version_id_fkey'],
+    'calendar_dates': ['calendar_dates_service_id_version_id_fkey'],
+    'trips': ['trips_route_id_version_id_fkey', 'trips_service_id_version_id_fkey'],
+    'stop_times': ['stop_times_trip_id_version_id_fkey', 'stop_times_stop_id_version_id_fkey'],
+    'trip_updates': ['trip_updates_trip_id_version_id_fkey', 'trip_updates_route_id_version_id_fkey',
+                     'trip_updates_stop_id_version_id_fkey'],
+    'vehicle_positions': ['vehicle_positions_trip_id_version_id_fkey'],
+}
+
+# Tabele dynamiczne partycjonowane dobowo po kolumnie timestamp (epoch w sekundach)
+PARTITIONED_TABLES = ('trip_updates', 'vehicle_positions')
+
 class SchemaManager:
-    def __init__(self, engine):
+    def __init__(self, engine, partitioning: Optional[dict] = None):
         self.engine = engine
+        partitioning = partitioning or {}
+        self.partitioning_enabled = partitioning.get('enabled', False)
+        self.partition_timezone = partitioning.get('timezone', 'Europe/Warsaw')
+        self.partition_day_start_hour = partitioning.get('day_start_hour', 4)
+        self.premake_days = partitioning.get('premake_days', 3)
+        self.retention_days = partitioning.get('retention_days')
+        self.retention_action = partitioning.get('retention_action', 'detach')
+        self.maintenance_interval = partitioning.get('maintenance_interval_seconds', 3600)
+        self._last_maintenance = 0.0
 
     def create_tables_if_not_exists(self):
+        partition_clause = " PARTITION BY RANGE (timestamp)" if self.partitioning_enabled else ""
         create_statements = [
             """
             CREATE TABLE IF NOT EXISTS public.static_data_versions (
                 version_id SERIAL PRIMARY KEY,
                 load_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                description TEXT
+                description TEXT,
+                published BOOLEAN NOT NULL DEFAULT TRUE
             );
             """,
             """
+            ALTER TABLE public.static_data_versions ADD COLUMN IF NOT EXISTS published BOOLEAN NOT NULL DEFAULT TRUE;
+            """,
+            """
             CREATE TABLE IF NOT EXISTS public.processed_folders (
                 id SERIAL PRIMARY KEY,
                 folder_name VARCHAR(255) UNIQUE NOT NULL,
@@ -37,6 +103,8 @@ class SchemaManager:
                 agency_phone TEXT,
                 agency_lang TEXT,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (agency_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
@@ -49,6 +117,8 @@ class SchemaManager:
                 feed_start_date DATE,
                 feed_end_date DATE,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
             """,
@@ -61,6 +131,8 @@ class SchemaManager:
                 stop_lon DOUBLE PRECISION NOT NULL,
                 zone_id TEXT,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (stop_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
@@ -76,8 +148,9 @@ class SchemaManager:
                 route_color TEXT,
                 route_text_color TEXT,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (route_id, version_id),
-                FOREIGN KEY (agency_id, version_id) REFERENCES public.agency (agency_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
             """,
@@ -94,6 +167,8 @@ class SchemaManager:
                 start_date DATE,
                 end_date DATE,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (service_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
@@ -104,8 +179,9 @@ class SchemaManager:
                 date DATE NOT NULL,
                 exception_type INT NOT NULL,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (service_id, date, version_id),
-                FOREIGN KEY (service_id, version_id) REFERENCES public.calendar (service_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
             """,
@@ -116,6 +192,8 @@ class SchemaManager:
                 shape_pt_lon DOUBLE PRECISION NOT NULL,
                 shape_pt_sequence INT NOT NULL,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (shape_id, shape_pt_sequence, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
@@ -132,9 +210,9 @@ class SchemaManager:
                 wheelchair_accessible INT,
                 brigade INT,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (trip_id, version_id),
-                FOREIGN KEY (route_id, version_id) REFERENCES public.routes (route_id, version_id),
-                FOREIGN KEY (service_id, version_id) REFERENCES public.calendar (service_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
             """,
@@ -149,9 +227,9 @@ class SchemaManager:
                 pickup_type INT,
                 drop_off_type INT,
                 version_id INT NOT NULL,
+                valid_to_version INT,
+                row_hash BIGINT,
                 PRIMARY KEY (trip_id, stop_sequence, version_id),
-                FOREIGN KEY (trip_id, version_id) REFERENCES public.trips (trip_id, version_id),
-                FOREIGN KEY (stop_id, version_id) REFERENCES public.stops (stop_id, version_id),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
             """,
@@ -170,15 +248,14 @@ class SchemaManager:
                 stop_id TEXT NULL,
                 start_time TEXT,
                 start_date TEXT,
+                vehicle_id TEXT,
+                latitude DOUBLE PRECISION,
+                longitude DOUBLE PRECISION,
+                position_timestamp BIGINT,
                 version_id INT NOT NULL,
                 PRIMARY KEY (trip_id, timestamp, version_id),
-                FOREIGN KEY (trip_id, version_id) REFERENCES public.trips (trip_id, version_id),
-                FOREIGN KEY (route_id, version_id) REFERENCES public.routes (route_id, version_id),
-                FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id),
-                FOREIGN KEY (stop_id, version_id) REFERENCES public.stops (stop_id, version_id)
-                ON DELETE NO ACTION DEFERRABLE INITIALLY DEFERRED
-            );
-            """,
+                FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
+            )""" + partition_clause + ";",
             """
             CREATE TABLE IF NOT EXISTS public.vehicle_positions (
                 entity_id TEXT NOT NULL,
@@ -192,12 +269,273 @@ class SchemaManager:
                 timestamp BIGINT NOT NULL,
                 version_id INT NOT NULL,
                 PRIMARY KEY (entity_id, timestamp, version_id),
-                FOREIGN KEY (trip_id, version_id) REFERENCES public.trips (trip_id, version_id),
+                FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
+            )""" + partition_clause + ";"
+        ]
+        create_statements.extend([
+            """
+            CREATE TABLE IF NOT EXISTS public.static_table_versions (
+                version_id INT NOT NULL,
+                table_name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                rows_inserted INT NOT NULL DEFAULT 0,
+                rows_closed INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (version_id, table_name),
                 FOREIGN KEY (version_id) REFERENCES public.static_data_versions (version_id)
             );
+            """,
             """
-        ]
+            CREATE OR REPLACE FUNCTION public.static_row_visible(row_version INT, row_valid_to INT, at_version INT)
+            RETURNS BOOLEAN LANGUAGE SQL IMMUTABLE AS $$
+                SELECT row_version <= at_version AND (row_valid_to IS NULL OR row_valid_to > at_version)
+            $$;
+            """,
+        ])
         with self.engine.begin() as conn:
+            legacy_bounds = self._detach_legacy_heap_tables(conn) if self.partitioning_enabled else {}
             for stmt in create_statements:
                 conn.execute(text(stmt))
+            self._migrate_static_versioning(conn)
+            self._migrate_trip_update_positions(conn, legacy_bounds)
+            for table_name, upper_bound in legacy_bounds.items():
+                conn.execute(text(f"""
+                    ALTER TABLE public.{table_name} ATTACH PARTITION public.{table_name}_legacy
+                    FOR VALUES FROM (MINVALUE) TO ({upper_bound});
+                """))
+                logger.info(f"Dotychczasowa tabela {table_name} dołączona jako partycja {table_name}_legacy.")
         logger.info("Wszystkie tabele zostały utworzone (jeśli wcześniej nie istniały).")
+        if self.partitioning_enabled:
+            self.maintain_partitions(force=True)
+
+    @staticmethod
+    def create_staging_table(conn, table_name: str, suffix: str = '') -> str:
+        """
+        Tworzy pustą tabelę UNLOGGED o strukturze tabeli docelowej, bez indeksów i kluczy,
+        do szybkiego ładowania COPY. Zwraca nazwę tabeli.
+        """
+        staging_table = f"staging_{table_name}{suffix}"
+        conn.execute(text(f"DROP TABLE IF EXISTS public.{staging_table};"))
+        conn.execute(text(f"CREATE UNLOGGED TABLE public.{staging_table} (LIKE public.{table_name} INCLUDING DEFAULTS);"))
+        return staging_table
+
+    @staticmethod
+    def validate_foreign_keys(conn, table_name: str, source_table: str, version_id: int):
+        """
+        Sprawdza jednym zapytaniem na klucz, czy wiersze `source_table` wskazują na wiersze
+        widoczne w wersji `version_id`. Zgłasza ValueError przy naruszeniu.
+        """
+        for column, ref_table, ref_column in STATIC_FOREIGN_KEYS.get(table_name, []):
+            missing = conn.execute(text(f"""
+                SELECT COUNT(*) FROM public.{source_table} s
+                WHERE s.{column} IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM public.{ref_table} r
+                      WHERE r.{ref_column} = s.{column}
+                        AND static_row_visible(r.version_id, r.valid_to_version, :version_id)
+                  );
+            """), {'version_id': version_id}).scalar()
+            if missing:
+                raise ValueError(
+                    f"{missing} wierszy {table_name}.{column} wskazuje na nieistniejące {ref_table}.{ref_column} "
+                    f"w wersji {version_id}."
+                )
+
+    @staticmethod
+    def drop_primary_key(conn, table_name: str) -> bool:
+        """
+        Usuwa klucz główny tabeli statycznej przed masowym ładowaniem. Zwraca True, jeśli istniał.
+        """
+        if table_name not in STATIC_TABLE_KEYS or STATIC_TABLE_KEYS[table_name] == ('row_hash',):
+            return False
+        conn.execute(text(f"ALTER TABLE public.{table_name} DROP CONSTRAINT IF EXISTS {table_name}_pkey;"))
+        return True
+
+    @staticmethod
+    def restore_primary_key(conn, table_name: str):
+        """
+        Odbudowuje klucz główny tabeli statycznej jednym przebiegiem po załadowaniu danych.
+        """
+        columns = ', '.join(STATIC_TABLE_KEYS[table_name] + ('version_id',))
+        conn.execute(text(f"ALTER TABLE public.{table_name} ADD CONSTRAINT {table_name}_pkey PRIMARY KEY ({columns});"))
+
+    def _detach_legacy_heap_tables(self, conn) -> dict:
+        """
+        Zmienia nazwę niepartycjonowanych tabel dynamicznych na <tabela>_legacy, aby
+        po utworzeniu tabeli partycjonowanej dołączyć je jako partycję z całą historią.
+        Zwraca górną granicę (epoch) zakresu partycji legacy dla każdej tabeli.
+        """
+        bounds = {}
+        for table_name in PARTITIONED_TABLES:
+            relkind = conn.execute(text(
+                "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = 'public' AND c.relname = :name;"
+            ), {'name': table_name}).scalar()
+            if relkind != 'r':
+                continue
+            max_ts = conn.execute(text(f"SELECT MAX(timestamp) FROM public.{table_name};")).scalar()
+            last_day = service_day_of(max_ts, self.partition_timezone, self.partition_day_start_hour) \
+                if max_ts is not None else self._today()
+            bounds[table_name] = self._day_bounds(last_day)[1]
+            conn.execute(text(f"ALTER TABLE public.{table_name} RENAME TO {table_name}_legacy;"))
+            conn.execute(text(f"ALTER TABLE public.{table_name}_legacy RENAME CONSTRAINT {table_name}_pkey TO {table_name}_legacy_pkey;"))
+            # Złożone klucze obce do tabel statycznych usuwa migracja wersjonowania tylko
+            # z nowej tabeli nadrzędnej - dołączona partycja zachowałaby je dla starych wierszy
+            for constraint in VERSIONED_FOREIGN_KEYS.get(table_name, []):
+                conn.execute(text(f"ALTER TABLE public.{table_name}_legacy DROP CONSTRAINT IF EXISTS {constraint};"))
+            logger.info(f"Tabela {table_name} zostanie przekształcona w tabelę partycjonowaną.")
+        return bounds
+
+    def maintain_partitions(self, force: bool = False):
+        """
+        Tworzy partycje dobowe z wyprzedzeniem i stosuje politykę retencji.
+        Wywoływane cyklicznie przez loader; bez `force` działa co `maintenance_interval` sekund.
+        """
+        if not self.partitioning_enabled:
+            return
+        if not force and time.monotonic() - self._last_maintenance < self.maintenance_interval:
+            return
+        self.ensure_partitions()
+        self.apply_retention()
+        self._last_maintenance = time.monotonic()
+
+    def ensure_partitions(self, today: Optional[date] = None):
+        today = today or self._today()
+        with self.engine.begin() as conn:
+            for table_name in PARTITIONED_TABLES:
+                partitions = self._list_partitions(conn, table_name)
+                existing = {name for name, _, _ in partitions}
+                covered_until = max((upper for _, _, upper in partitions if upper is not None), default=None)
+                if f"{table_name}_default" not in existing:
+                    conn.execute(text(f"CREATE TABLE IF NOT EXISTS public.{table_name}_default PARTITION OF public.{table_name} DEFAULT;"))
+                for offset in range(self.premake_days + 1):
+                    day = today + timedelta(days=offset)
+                    name = f"{table_name}_p{day:%Y%m%d}"
+                    start, end = self._day_bounds(day)
+                    if name in existing or (covered_until is not None and start < covered_until):
+                        continue
+                    conn.execute(text(f"""
+                        CREATE TABLE IF NOT EXISTS public.{name} PARTITION OF public.{table_name}
+                        FOR VALUES FROM ({start}) TO ({end});
+                    """))
+                    logger.info(f"Utworzono partycję {name} [{start}, {end}).")
+
+    def ensure_partition_range(self, first_day: date, last_day: date):
+        """
+        Tworzy brakujące partycje dobowe dla dób [first_day, last_day] (np. przed
+        ładowaniem danych historycznych). Doba pokryta istniejącą partycją jest pomijana,
+        a gdy partycja domyślna zawiera już wiersze z tej doby, dane zostają w niej.
+        """
+        if not self.partitioning_enabled:
+            return
+        with self.engine.begin() as conn:
+            for table_name in PARTITIONED_TABLES:
+                ranges = [(lower, upper) for _, lower, upper in self._list_partitions(conn, table_name)
+                          if upper is not None]
+                day = first_day
+                while day <= last_day:
+                    start, end = self._day_bounds(day)
+                    name = f"{table_name}_p{day:%Y%m%d}"
+                    day += timedelta(days=1)
+                    if any((lower is None or lower < end) and start < upper for lower, upper in ranges):
+                        continue
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(text(f"""
+                                CREATE TABLE IF NOT EXISTS public.{name} PARTITION OF public.{table_name}
+                                FOR VALUES FROM ({start}) TO ({end});
+                            """))
+                        logger.info(f"Utworzono partycję {name} [{start}, {end}).")
+                    except Exception as e:
+                        logger.warning(f"Nie utworzono partycji {name} - wiersze trafią do partycji domyślnej: {e}")
+
+    def apply_retention(self, today: Optional[date] = None):
+        """
+        Odłącza (retention_action='detach') lub usuwa (retention_action='drop') partycje
+        starsze niż `retention_days` dób przewozowych. Odłączone partycje pozostają
+        zwykłymi tabelami, które można zarchiwizować.
+        """
+        if not self.retention_days:
+            return
+        today = today or self._today()
+        cutoff = self._day_bounds(today - timedelta(days=self.retention_days))[0]
+        with self.engine.begin() as conn:
+            for table_name in PARTITIONED_TABLES:
+                for name, _, upper in self._list_partitions(conn, table_name):
+                    if upper is None or upper > cutoff:
+                        continue
+                    conn.execute(text(f"ALTER TABLE public.{table_name} DETACH PARTITION public.{name};"))
+                    if self.retention_action == 'drop':
+                        conn.execute(text(f"DROP TABLE public.{name};"))
+                        logger.info(f"Usunięto partycję {name} (retencja {self.retention_days} dni).")
+                    else:
+                        logger.info(f"Odłączono partycję {name} (retencja {self.retention_days} dni).")
+
+    @staticmethod
+    def _list_partitions(conn, table_name: str) -> List[Tuple[str, Optional[int], Optional[int]]]:
+        """
+        Zwraca listę (nazwa, dolna granica, górna granica) partycji tabeli.
+        MINVALUE oraz partycja domyślna mają granice równe None.
+        """
+        rows = conn.execute(text("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:parent AS regclass);
+        """), {'parent': f"public.{table_name}"}).fetchall()
+        partitions = []
+        for name, bound in rows:
+            match = re.search(r"FROM \((\S+)\) TO \((\S+)\)", bound or "")
+            if not match:
+                partitions.append((name, None, None))
+                continue
+            lower, upper = (None if value == 'MINVALUE' else int(value.strip("'")) for value in match.groups())
+            partitions.append((name, lower, upper))
+        return partitions
+
+    def _day_bounds(self, day: date) -> Tuple[int, int]:
+        return service_day_bounds(day, self.partition_timezone, self.partition_day_start_hour)
+
+    def _today(self) -> date:
+        return service_day_of(int(time.time()), self.partition_timezone, self.partition_day_start_hour)
+
+    @staticmethod
+    def _migrate_trip_update_positions(conn, legacy_bounds: dict):
+        """
+        Dodaje kolumny pozycji pojazdu (dołączanej w ETL) do istniejącej tabeli trip_updates
+        oraz do odłączonej tabeli *_legacy, aby dało się ją podpiąć jako partycję.
+        """
+        tables = ['trip_updates'] + (['trip_updates_legacy'] if 'trip_updates' in legacy_bounds else [])
+        for table_name in tables:
+            for column, column_type in (('vehicle_id', 'TEXT'), ('latitude', 'DOUBLE PRECISION'),
+                                        ('longitude', 'DOUBLE PRECISION'), ('position_timestamp', 'BIGINT')):
+                conn.execute(text(f"ALTER TABLE public.{table_name} ADD COLUMN IF NOT EXISTS {column} {column_type};"))
+
+    def _migrate_static_versioning(self, conn):
+        """
+        Dostosowuje bazę utworzoną przed wprowadzeniem różnicowego wersjonowania:
+        dodaje kolumny ważności, usuwa złożone klucze obce i zamyka wiersze starszych
+        pełnych kopii, tak aby w każdej wersji widoczna była dokładnie jedna kopia.
+        Tabele, które mają już kolumnę row_hash (migrowane lub utworzone w nowym
+        schemacie), są pomijane - zamknięcie wierszy skanuje całą tabelę.
+        """
+        migrated = {row[0] for row in conn.execute(text("""
+            SELECT table_name FROM information_schema.columns
+            WHERE table_schema = 'public' AND column_name = 'row_hash' AND table_name = ANY(:tables);
+        """), {'tables': list(STATIC_TABLE_KEYS)})}
+        for table_name in STATIC_TABLE_KEYS:
+            if table_name in migrated:
+                continue
+            conn.execute(text(f"ALTER TABLE public.{table_name} ADD COLUMN IF NOT EXISTS valid_to_version INT;"))
+            conn.execute(text(f"ALTER TABLE public.{table_name} ADD COLUMN IF NOT EXISTS row_hash BIGINT;"))
+            conn.execute(text(f"""
+                UPDATE public.{table_name} t
+                SET valid_to_version = (
+                    SELECT MIN(v.version_id) FROM public.static_data_versions v WHERE v.version_id > t.version_id
+                )
+                WHERE t.valid_to_version IS NULL
+                  AND t.row_hash IS NULL
+                  AND t.version_id < (SELECT MAX(version_id) FROM public.{table_name});
+            """))
+        for table_name, constraints in VERSIONED_FOREIGN_KEYS.items():
+            for constraint in constraints:
+                conn.execute(text(f"ALTER TABLE public.{table_name} DROP CONSTRAINT IF EXISTS {constraint};"))
@@ -0,0 +1,135 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from loguru import logger
+
+from .bulk_loader import BulkStaticWriter
+from .schema_manager import STATIC_TABLE_KEYS
+from utils.hash_utils import calculate_hash
+
+
+def compute_row_hashes(df: pd.DataFrame) -> pd.Series:
+    """
+    Liczy 64-bitowy hash treści każdego wiersza (bez version_id i kolumn technicznych).
+    Kolumny są sortowane, więc kolejność kolumn w pliku nie wpływa na wynik.
+    """
+    content_cols = sorted(c for c in df.columns if c not in ('version_id', 'valid_to_version', 'row_hash'))
+    hashes = pd.util.hash_pandas_object(df[content_cols], index=False).to_numpy()
+    return pd.Series(hashes.view(np.int64), index=df.index)
+
+
+def compute_content_hash(row_hashes: pd.Series) -> str:
+    """
+    Zwraca hash całej tabeli niezależny od kolejności wierszy.
+    """
+    return calculate_hash(np.sort(row_hashes.to_numpy()).tobytes())
+
+
+class StaticDiffLoader:
+    """
+    Ładuje tabelę statyczną jako różnicę względem wiersza aktualnie ważnego.
+
+    Niezmienione wiersze pozostają w bazie z pierwotnym version_id, zmienione lub usunięte
+    są zamykane (valid_to_version), a nowe i zmienione wstawiane z nowym version_id.
+    Wiersz jest widoczny w wersji V, gdy static_row_visible(version_id, valid_to_version, V).
+    """
+
+    def __init__(self, engine, bulk_writer: Optional[BulkStaticWriter] = None):
+        self.engine = engine
+        self.bulk_writer = bulk_writer
+
+    def load_table(self, df: pd.DataFrame, table_name: str, version_id: int) -> Dict[str, int]:
+        keys = STATIC_TABLE_KEYS[table_name]
+        df = df.drop(columns=['version_id'], errors='ignore')
+        df['row_hash'] = compute_row_hashes(df)
+        if table_name == 'feed_info':
+            df = df.drop_duplicates(subset=['row_hash'])
+        content_hash = compute_content_hash(df['row_hash'])
+
+        with self.engine.begin() as conn:
+            if content_hash == self._last_content_hash(conn, table_name):
+                self._record(conn, table_name, version_id, content_hash, 0, 0)
+                logger.info(f"Tabela {table_name} nie zmieniła się - pozostaje bez zmian w wersji {version_id}.")
+                return {'inserted': 0, 'closed': 0}
+
+            current = pd.read_sql(
+                text(f"SELECT {', '.join(dict.fromkeys(keys + ('version_id', 'row_hash')))} "
+                     f"FROM {table_name} WHERE valid_to_version IS NULL AND version_id < :version_id"),
+                conn,
+                params={'version_id': version_id},
+            )
+            to_insert, to_close = self._diff(df, current, keys)
+
+            if not to_close.empty:
+                self._close_rows(conn, table_name, to_close, keys, version_id)
+            if not to_insert.empty:
+                to_insert = to_insert.assign(version_id=version_id)
+                if self.bulk_writer and self.bulk_writer.should_use(conn, table_name, len(to_insert)):
+                    self.bulk_writer.write(conn, to_insert, table_name, version_id)
+                else:
+                    to_insert.to_sql(table_name, conn, if_exists='append', index=False, chunksize=10000)
+            self._record(conn, table_name, version_id, content_hash, len(to_insert), len(to_close))
+
+        logger.info(f"Tabela {table_name}, wersja {version_id}: wstawiono {len(to_insert)}, "
+                    f"zamknięto {len(to_close)}, bez zmian {len(df) - len(to_insert)} rekordów.")
+        return {'inserted': len(to_insert), 'closed': len(to_close)}
+
+    @staticmethod
+    def _diff(new: pd.DataFrame, current: pd.DataFrame, keys: Tuple[str, ...]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Zwraca (wiersze do wstawienia, klucze wierszy do zamknięcia).
+        """
+        if current.empty:
+            return new, current
+        if keys == ('row_hash',):
+            unchanged_new = new['row_hash'].isin(current['row_hash'])
+            unchanged_current = current['row_hash'].isin(new['row_hash'])
+        else:
+            # Dla typów dat porównujemy ich tekstową postać, bo read_sql i parquet dają różne dtypes
+            new_keys = new[list(keys)].astype(str).assign(row_hash=new['row_hash'])
+            current_keys = current[list(keys)].astype(str).assign(row_hash=current['row_hash'])
+            merged = new_keys.merge(current_keys.drop_duplicates(), on=list(keys) + ['row_hash'], how='left', indicator=True)
+            unchanged_new = pd.Series((merged['_merge'] == 'both').to_numpy(), index=new.index)
+            merged = current_keys.merge(new_keys.drop_duplicates(), on=list(keys) + ['row_hash'], how='left', indicator=True)
+            unchanged_current = pd.Series((merged['_merge'] == 'both').to_numpy(), index=current.index)
+        to_close = current.loc[~unchanged_current, list(dict.fromkeys(keys + ('version_id',)))]
+        return new[~unchanged_new], to_close
+
+    @staticmethod
+    def _close_rows(conn, table_name: str, to_close: pd.DataFrame, keys: Tuple[str, ...], version_id: int):
+        temp_table = f"temp_close_{table_name}"
+        key_cols = list(dict.fromkeys(keys + ('version_id',)))
+        conn.execute(text(f"""
+            CREATE TEMPORARY TABLE {temp_table} ON COMMIT DROP AS
+            SELECT {', '.join(key_cols)} FROM {table_name} WITH NO DATA;
+        """))
+        to_close.to_sql(temp_table, conn, if_exists='append', index=False, chunksize=10000)
+        join_condition = ' AND '.join(f"t.{col} = c.{col}" for col in key_cols)
+        conn.execute(text(f"""
+            UPDATE {table_name} t
+            SET valid_to_version = :version_id
+            FROM {temp_table} c
+            WHERE {join_condition} AND t.valid_to_version IS NULL;
+        """), {'version_id': version_id})
+
+    @staticmethod
+    def _last_content_hash(conn, table_name: str) -> Optional[str]:
+        row = conn.execute(text("""
+            SELECT content_hash FROM static_table_versions
+            WHERE table_name = :table_name
+            ORDER BY version_id DESC LIMIT 1;
+        """), {'table_name': table_name}).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _record(conn, table_name: str, version_id: int, content_hash: str, inserted: int, closed: int):
+        conn.execute(text("""
+            INSERT INTO static_table_versions (version_id, table_name, content_hash, rows_inserted, rows_closed)
+            VALUES (:version_id, :table_name, :content_hash, :inserted, :closed)
+            ON CONFLICT (version_id, table_name) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash,
+                rows_inserted = EXCLUDED.rows_inserted,
+                rows_closed = EXCLUDED.rows_closed;
+        """), {'version_id': version_id, 'table_name': table_name, 'content_hash': content_hash,
+               'inserted': inserted, 'closed': closed})
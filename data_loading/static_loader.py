@@ -0,0 +1,50 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+from loguru import logger
+
+from .schema_manager import STATIC_TABLE_DEPENDENCIES
+
+
+def dependency_levels(tables: Iterable[str]) -> List[List[str]]:
+    """
+    Dzieli tabele na poziomy grafu zależności (sortowanie topologiczne Kahna).
+    Tabele z jednego poziomu nie zależą od siebie i mogą być ładowane równolegle.
+    Zależności od tabel spoza `tables` są pomijane.
+    """
+    remaining = {t: {d for d in STATIC_TABLE_DEPENDENCIES.get(t, ()) if d in tables} for t in tables}
+    levels = []
+    while remaining:
+        level = sorted(t for t, deps in remaining.items() if not deps)
+        if not level:
+            raise ValueError(f"Cykl w zależnościach tabel statycznych: {sorted(remaining)}")
+        levels.append(level)
+        for t in level:
+            del remaining[t]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
+
+
+class ParallelStaticLoader:
+    """
+    Ładuje pliki jednej wersji danych statycznych poziomami grafu zależności,
+    równolegle w obrębie poziomu. Każda tabela korzysta z osobnego połączenia z puli.
+    """
+
+    def __init__(self, load_file: Callable[[Path, str, int], None], max_workers: int = 4):
+        self.load_file = load_file
+        self.max_workers = max_workers
+
+    def load(self, files: Dict[str, Path], version_id: int):
+        levels = dependency_levels(files.keys())
+        logger.info(f"Ładowanie wersji {version_id} w {len(levels)} poziomach: {levels}")
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="static-loader") as executor:
+            for level in levels:
+                futures: List[Tuple[str, Future]] = [
+                    (table_name, executor.submit(self.load_file, files[table_name], table_name, version_id))
+                    for table_name in level
+                ]
+                # result() propaguje pierwszy wyjątek - kolejny poziom nie zostanie uruchomiony
+                for table_name, future in futures:
+                    future.result()
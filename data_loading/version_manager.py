@@ -1,23 +1,59 @@
+from typing import List
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from loguru import logger
 
+from .schema_manager import STATIC_TABLE_KEYS
+
 class DataVersionManager:
     def __init__(self, session: Session):
         self.session = session
 
-    def create_new_version(self, description: str = '') -> int:
-        query = text("INSERT INTO static_data_versions (description) VALUES (:description) RETURNING version_id;")
-        result = self.session.execute(query, {'description': description})
+    def create_new_version(self, description: str = '', published: bool = True) -> int:
+        query = text("INSERT INTO static_data_versions (description, published) VALUES (:description, :published) RETURNING version_id;")
+        result = self.session.execute(query, {'description': description, 'published': published})
         self.session.commit()
         version_id = result.fetchone()[0]
         logger.info(f"Utworzono nową wersję danych statycznych: {version_id}")
         return version_id
 
     def get_current_version(self) -> int:
-        query = text("SELECT version_id FROM static_data_versions ORDER BY version_id DESC LIMIT 1;")
+        query = text("SELECT version_id FROM static_data_versions WHERE published ORDER BY version_id DESC LIMIT 1;")
         result = self.session.execute(query)
         row = result.fetchone()
         if row:
             return row[0]
         return None
+
+    def publish_version(self, version_id: int):
+        """
+        Udostępnia w pełni załadowaną wersję czytelnikom jedną transakcją.
+        Do tego momentu get_current_version zwraca poprzednią wersję.
+        """
+        query = text("UPDATE static_data_versions SET published = TRUE WHERE version_id = :version_id;")
+        self.session.execute(query, {'version_id': version_id})
+        self.session.commit()
+        logger.info(f"Opublikowano wersję danych statycznych: {version_id}")
+
+    def discard_version(self, version_id: int):
+        """
+        Wycofuje nieopublikowaną wersję: usuwa jej wiersze i ponownie otwiera
+        wiersze, które ta wersja zamknęła.
+        """
+        params = {'version_id': version_id}
+        for table_name in STATIC_TABLE_KEYS:
+            self.session.execute(text(f"DELETE FROM {table_name} WHERE version_id = :version_id;"), params)
+            self.session.execute(text(f"UPDATE {table_name} SET valid_to_version = NULL WHERE valid_to_version = :version_id;"), params)
+        self.session.execute(text("DELETE FROM static_table_versions WHERE version_id = :version_id;"), params)
+        self.session.execute(text("DELETE FROM static_data_versions WHERE version_id = :version_id AND NOT published;"), params)
+        self.session.commit()
+        logger.warning(f"Wycofano nieopublikowaną wersję danych statycznych: {version_id}")
+
+    def discard_unpublished_versions(self) -> List[int]:
+        """
+        Wycofuje wersje pozostawione przez przerwane ładowanie (np. po awarii procesu).
+        """
+        rows = self.session.execute(text("SELECT version_id FROM static_data_versions WHERE NOT published ORDER BY version_id DESC;")).fetchall()
+        for (version_id,) in rows:
+            self.discard_version(version_id)
+        return [row[0] for row in rows]
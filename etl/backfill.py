@@ -0,0 +1,381 @@
+"""
+Ponowne przetworzenie historycznych snapshotów GTFS-RT (np. po poprawce parsera
+lub zmianie schematu) - poza bieżącym potokiem.
+
+Snapshoty `.pb` z katalogów surowych danych lub archiwów (.zip, .tar, .tar.gz) z
+zakresu dat są grupowane w paczki (kanał, godzina UTC z nazwy pliku). Archiwa tar
+są najpierw wypakowywane jednym sekwencyjnym przebiegiem do katalogu przebiegu
+(odczyt pojedynczego elementu .tar.gz dekompresuje archiwum od początku). Paczki są
+dekodowane i zapisywane do Parquet równolegle w procesach, a gotowe pliki od razu
+ładowane do bazy w wątkach: COPY do tabeli tymczasowej i jeden INSERT ... ON CONFLICT
+DO NOTHING na plik. Postęp zapisuje manifest w katalogu przebiegu, więc przerwany
+backfill wznawia się od miejsca przerwania.
+
+Bieżący potok nie jest zakłócany: pliki trafiają do `backfill.output_dir`
+(nieskanowanego przez loader), procesy dekodujące mają obniżony priorytet
+(`backfill.nice`), a loader używa własnej, małej puli połączeń.
+
+Przykład:
+    python main.py backfill --start 2024-11-01 --end 2024-11-30 --source data_storage/raw/dynamic
+"""
+
+import os
+import re
+import tarfile
+import time
+import uuid
+import zipfile
+from contextlib import ExitStack
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+from loguru import logger
+from sqlalchemy import text
+
+from data_loading.load_to_db import DataLoader, LOADED_ROWS
+from etl.transform_pb_to_parquet import TRIP_UPDATE_COLUMNS, VEHICLE_POSITION_COLUMNS
+from etl.trip_vehicle_join import join_positions_to_trip_updates
+from parsers.feed_parser import parse_feed
+from utils.atomic_io import atomic_path, atomic_write_bytes
+from utils.db_utils import copy_insert
+from utils.manifest import ETL_DONE, LOADED, WRITTEN, Manifest
+from utils.metrics import REGISTRY
+from utils.service_day import service_day_of
+from utils.transformations import deduplicate_before_parquet, transform_dynamic_df
+
+BACKFILL_BATCHES = REGISTRY.counter('bimba_backfill_batches_total', 'Paczki snapshotów przetworzone przez backfill')
+BACKFILL_SNAPSHOTS = REGISTRY.counter('bimba_backfill_snapshots_total', 'Snapshoty zdekodowane przez backfill')
+
+# <kanał>_<YYYYmmddHHMMSS>[_<id snapshotu>].pb
+SNAPSHOT_NAME = re.compile(r"^(?P<feed>.+?)_(?P<timestamp>\d{14})(?:_[0-9a-f]{16})?\.pb$")
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+PRIMARY_KEYS = {'trip_updates': ('trip_id', 'timestamp', 'version_id'),
+                'vehicle_positions': ('entity_id', 'timestamp', 'version_id')}
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Snapshot w źródle: plik `path` albo element `member` archiwum zip `path`.
+    """
+    path: str
+    member: Optional[str]
+    feed: str
+    fetched_at: datetime
+
+    def read(self, archive: Optional[zipfile.ZipFile] = None) -> bytes:
+        """
+        Treść snapshotu; `archive` to otwarte już archiwum `path` (bez niego archiwum
+        jest otwierane na nowo, z ponownym odczytem katalogu centralnego).
+        """
+        if self.member is None:
+            return Path(self.path).read_bytes()
+        if archive is not None:
+            return archive.read(self.member)
+        with zipfile.ZipFile(self.path) as archive:
+            return archive.read(self.member)
+
+
+def parse_snapshot_name(name: str) -> Optional[Tuple[str, datetime]]:
+    match = SNAPSHOT_NAME.match(Path(name).name)
+    if not match:
+        return None
+    fetched_at = datetime.strptime(match['timestamp'], "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+    return match['feed'], fetched_at
+
+
+def discover_snapshots(sources: Iterable[Path], feeds: Set[str], start: datetime, end: datetime) -> Iterator[Snapshot]:
+    """
+    Snapshoty kanałów `feeds` pobrane w [start, end) ze wskazanych katalogów (rekurencyjnie)
+    i archiwów zip. Archiwa tar trzeba najpierw wypakować (`unpack_tar`).
+    """
+    for source in sources:
+        source = Path(source)
+        if source.is_dir():
+            entries = ((str(path), None, path.name) for path in source.rglob("*.pb"))
+        elif source.name.endswith('.zip'):
+            entries = ((str(source), member, member) for member in archive_members(source))
+        else:
+            logger.warning(f"Pominięto nieobsługiwane źródło backfillu: {source}")
+            continue
+        for path, member, name in entries:
+            parsed = parse_snapshot_name(name)
+            if parsed and parsed[0] in feeds and start <= parsed[1] < end:
+                yield Snapshot(path, member, *parsed)
+
+
+def archive_members(archive_path: Path) -> List[str]:
+    with zipfile.ZipFile(archive_path) as archive:
+        return [name for name in archive.namelist() if name.endswith('.pb')]
+
+
+def unpack_tar(archive_path: Path, target_dir: Path, feeds: Set[str], start: datetime, end: datetime) -> int:
+    """
+    Wypakowuje do `target_dir` snapshoty kanałów `feeds` z [start, end) jednym
+    sekwencyjnym przebiegiem archiwum (tryb strumieniowy) i oznacza katalog plikiem
+    `.done`. Zwraca liczbę wypakowanych snapshotów; katalog już oznaczony jest pomijany.
+    """
+    done_file = target_dir / ".done"
+    if done_file.exists():
+        return sum(1 for _ in target_dir.glob("*.pb"))
+    target_dir.mkdir(parents=True, exist_ok=True)
+    unpacked = 0
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            parsed = parse_snapshot_name(member.name)
+            if not parsed or parsed[0] not in feeds or not start <= parsed[1] < end:
+                continue
+            # Nazwa snapshotu zawiera kanał i czas pobrania, więc jest unikalna bez ścieżki w archiwum
+            (target_dir / Path(member.name).name).write_bytes(archive.extractfile(member).read())
+            unpacked += 1
+    atomic_write_bytes(done_file, b"")
+    logger.info(f"Wypakowano {unpacked} snapshotów z {archive_path} do {target_dir}.")
+    return unpacked
+
+
+def group_batches(snapshots: Iterable[Snapshot]) -> Dict[str, List[Snapshot]]:
+    """
+    Paczki (kanał, godzina UTC) uporządkowane chronologicznie; klucz paczki to
+    <kanał>_<YYYYmmddHH> i wyznacza nazwy plików wynikowych.
+    """
+    batches: Dict[str, List[Snapshot]] = {}
+    for snapshot in snapshots:
+        batches.setdefault(f"{snapshot.feed}_{snapshot.fetched_at:%Y%m%d%H}", []).append(snapshot)
+    return {key: sorted(batch, key=lambda s: (s.fetched_at, s.path, s.member or ''))
+            for key, batch in sorted(batches.items(), key=lambda item: (item[0].rsplit('_', 1)[1], item[0]))}
+
+
+def init_decode_worker(nice: int):
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+def decode_batch(key: str, snapshots: List[Snapshot], output_dir: str, join_positions: bool,
+                 join_tolerance: int) -> Dict[str, Optional[str]]:
+    """
+    Dekoduje paczkę i zapisuje (atomowo) trip_updates_<klucz>.parquet oraz
+    vehicle_positions_<klucz>.parquet. Zwraca ścieżki plików tabel (None dla pustych).
+    Uruchamiane w procesie roboczym.
+    """
+    trip_updates, vehicle_positions = [], []
+    with ExitStack() as stack:
+        # Każde archiwum paczki jest otwierane raz
+        archives: Dict[str, zipfile.ZipFile] = {}
+        for snapshot in snapshots:
+            try:
+                if snapshot.member is not None and snapshot.path not in archives:
+                    archives[snapshot.path] = stack.enter_context(zipfile.ZipFile(snapshot.path))
+                data = parse_feed(snapshot.read(archives.get(snapshot.path)))
+            except Exception as e:
+                logger.error(f"Błąd dekodowania snapshotu {snapshot.path} {snapshot.member or ''}: {e}")
+                continue
+            trip_updates.extend(data['trip_updates'])
+            vehicle_positions.extend(data['vehicle_positions'])
+
+    positions_df = deduplicate_before_parquet(pd.DataFrame(vehicle_positions, columns=VEHICLE_POSITION_COLUMNS))
+    trip_updates_df = deduplicate_before_parquet(pd.DataFrame(trip_updates, columns=TRIP_UPDATE_COLUMNS))
+    if join_positions and not trip_updates_df.empty:
+        trip_updates_df = join_positions_to_trip_updates(trip_updates_df, positions_df, join_tolerance)
+
+    outputs = {}
+    for table_name, df in (('trip_updates', trip_updates_df), ('vehicle_positions', positions_df)):
+        if df.empty:
+            outputs[table_name] = None
+            continue
+        output_file = Path(output_dir) / table_name / f"{table_name}_{key}.parquet"
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(output_file) as tmp_file:
+            df.to_parquet(tmp_file, index=False)
+        outputs[table_name] = str(output_file)
+    return outputs
+
+
+class Backfill:
+    """
+    Jeden przebieg backfillu: zakres dat [start, end] (doby UTC z nazw snapshotów),
+    źródła i kanały. Katalog przebiegu `<backfill.output_dir>/<run_name>` zawiera pliki
+    Parquet, manifest z postępem (paczka zdekodowana, plik zapisany, plik załadowany)
+    i snapshoty wypakowane z archiwów tar (`unpacked/<archiwum>`).
+    """
+
+    def __init__(self, config: dict, start: date, end: date, sources: List[Path], feeds: Optional[List[str]] = None,
+                 run_name: Optional[str] = None, workers: Optional[int] = None, load_workers: Optional[int] = None,
+                 version_id: Optional[int] = None, load: bool = True):
+        backfill_config = config.get('backfill', {})
+        etl_config = config['etl']
+        self.config = config
+        self.start = datetime.combine(start, datetime.min.time(), tzinfo=timezone.utc)
+        self.end = datetime.combine(end + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        self.sources = [Path(source) for source in sources]
+        self.feeds = set(feeds or [Path(etl_config['input_dir']).name])
+        self.run_dir = Path(backfill_config.get('output_dir', "data_storage/backfill")) / (
+            run_name or f"{start:%Y%m%d}_{end:%Y%m%d}")
+        self.workers = workers or backfill_config.get('workers') or os.cpu_count()
+        self.load_workers = load_workers or backfill_config.get('load_workers', 4)
+        self.nice = backfill_config.get('nice', 10)
+        self.join_positions = etl_config.get('join_positions', True)
+        self.join_tolerance = etl_config.get('position_join_tolerance_seconds', 30)
+        self.version_id = version_id
+        self.load = load
+        self.manifest = Manifest(self.run_dir / "checkpoint.sqlite", retention_days=None)
+        self.loader: Optional[DataLoader] = None
+        self.valid_trip_ids: Set[str] = set()
+
+    def run(self) -> Dict[str, int]:
+        started_at = time.monotonic()
+        if self.load:
+            self._prepare_loader()
+
+        batches = group_batches(discover_snapshots(self._unpacked_sources(), self.feeds, self.start, self.end))
+        done = {key for key in batches if self.manifest.has(ETL_DONE, self.run_dir / key)}
+        todo = {key: batch for key, batch in batches.items() if key not in done}
+        logger.info(f"Backfill {self.run_dir.name}: {len(batches)} paczek "
+                    f"({sum(len(batch) for batch in batches.values())} snapshotów), "
+                    f"{len(done)} już zdekodowanych; {self.workers} procesów, {self.load_workers} wątków ładowania.")
+
+        stats = {'batches': 0, 'snapshots': 0, 'files_loaded': 0, 'rows_loaded': 0}
+        with ProcessPoolExecutor(self.workers, initializer=init_decode_worker, initargs=(self.nice,)) as decode_pool, \
+                ThreadPoolExecutor(self.load_workers) as load_pool:
+            loads: List[Future] = []
+            if self.load:
+                # Pliki zapisane przed przerwaniem, ale niezaładowane
+                for table_name in PRIMARY_KEYS:
+                    for path in self.manifest.pending(WRITTEN, LOADED, self.run_dir / table_name):
+                        loads.append(load_pool.submit(self.load_file, path, table_name))
+
+            decodes = {decode_pool.submit(decode_batch, key, batch, str(self.run_dir), self.join_positions,
+                                          self.join_tolerance): key
+                       for key, batch in todo.items()}
+            for future in as_completed(decodes):
+                key = decodes[future]
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    logger.exception(f"Nie zdekodowano paczki {key}: {e}")
+                    continue
+                written = {table_name: Path(path) for table_name, path in outputs.items() if path}
+                self.manifest.record_many([(WRITTEN, path, {'table': table_name})
+                                           for table_name, path in written.items()]
+                                          + [(ETL_DONE, self.run_dir / key, {'snapshots': len(todo[key])})])
+                stats['batches'] += 1
+                stats['snapshots'] += len(todo[key])
+                BACKFILL_BATCHES.inc()
+                BACKFILL_SNAPSHOTS.inc(len(todo[key]))
+                if self.load:
+                    loads.extend(load_pool.submit(self.load_file, path, table_name)
+                                 for table_name, path in written.items())
+                self._log_progress(stats, len(todo), started_at)
+
+            for future in as_completed(loads):
+                rows = future.result()
+                if rows is not None:
+                    stats['files_loaded'] += 1
+                    stats['rows_loaded'] += rows
+
+        if self.load and self.loader is not None:
+            self.loader.refresh_reports()
+        stats['seconds'] = round(time.monotonic() - started_at, 1)
+        logger.info(f"Backfill {self.run_dir.name} zakończony: {stats}")
+        return stats
+
+    def _unpacked_sources(self) -> List[Path]:
+        """
+        Źródła z archiwami tar zastąpionymi katalogami ich wypakowanych snapshotów.
+        """
+        sources = []
+        for source in self.sources:
+            if source.is_file() and source.name.endswith(TAR_SUFFIXES):
+                target_dir = self.run_dir / "unpacked" / source.name
+                unpack_tar(source, target_dir, self.feeds, self.start, self.end)
+                source = target_dir
+            sources.append(source)
+        return sources
+
+    def _log_progress(self, stats: Dict[str, int], total: int, started_at: float):
+        if stats['batches'] % 50 and stats['batches'] != total:
+            return
+        elapsed = time.monotonic() - started_at
+        logger.info(f"Backfill: {stats['batches']}/{total} paczek, "
+                    f"{stats['snapshots'] / max(elapsed, 1e-9):.1f} snapshotów/s.")
+
+    def _prepare_loader(self):
+        config = {**self.config, 'database': {**self.config['database'],
+                                              'pool_size': self.load_workers + 1}}
+        self.loader = DataLoader(config)
+        self.loader.schema_manager.create_tables_if_not_exists()
+        if self.version_id is None:
+            self.version_id = self.loader.version_manager.get_current_version()
+        if not self.version_id:
+            raise RuntimeError("Brak wersji danych statycznych - najpierw załaduj dane statyczne lub podaj --version-id.")
+        schema = self.loader.schema_manager
+        first_day, last_day = (service_day_of(int(moment.timestamp()), schema.partition_timezone,
+                                              schema.partition_day_start_hour) for moment in (self.start, self.end))
+        if schema.retention_days and first_day < schema._today() - timedelta(days=schema.retention_days):
+            logger.warning(f"Backfill sięga dalej niż retencja partycji ({schema.retention_days} dni) - "
+                           f"najstarsze doby zostaną odłączone przy najbliższym utrzymaniu partycji.")
+        schema.ensure_partition_range(first_day, last_day)
+        trips = pd.read_sql(
+            text("SELECT trip_id FROM trips WHERE static_row_visible(version_id, valid_to_version, :version_id)"),
+            self.loader.engine, params={'version_id': self.version_id})
+        self.valid_trip_ids = set(trips['trip_id'])
+
+    def load_file(self, path: Path, table_name: str) -> Optional[int]:
+        """
+        Ładuje plik jednym COPY do tabeli tymczasowej i jednym INSERT ... ON CONFLICT DO
+        NOTHING (wiersze już obecne w bazie są pomijane). Zwraca liczbę wstawionych
+        wierszy lub None po błędzie (plik zostanie załadowany przy wznowieniu).
+        """
+        try:
+            df = pd.read_parquet(path)
+            df['version_id'] = self.version_id
+            df = transform_dynamic_df(df, table_name, valid_trip_ids=self.valid_trip_ids)
+            inserted = 0
+            if not df.empty:
+                inserted = self._insert(df, table_name)
+            self.manifest.record(LOADED, path, table=table_name, rows=inserted)
+            logger.debug("Backfill: załadowano {} rekordów do tabeli {} z pliku {}.", inserted, table_name, path)
+            return inserted
+        except Exception as e:
+            logger.exception(f"Błąd backfillu pliku {path} do tabeli {table_name}: {e}")
+            return None
+
+    def _insert(self, df: pd.DataFrame, table_name: str) -> int:
+        pk_cols = PRIMARY_KEYS[table_name]
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        staging_table = f"backfill_{table_name}_{uuid.uuid4().hex[:8]}"
+        with self.loader.engine.begin() as conn:
+            conn.execute(text(f"CREATE TEMPORARY TABLE {staging_table} (LIKE public.{table_name} INCLUDING DEFAULTS) "
+                              f"ON COMMIT DROP;"))
+            df.to_sql(staging_table, conn, if_exists='append', index=False, method=copy_insert, chunksize=100000)
+            inserted_keys = conn.execute(text(f"""
+                INSERT INTO public.{table_name} ({columns}) SELECT {columns} FROM {staging_table}
+                ON CONFLICT DO NOTHING
+                RETURNING {', '.join(pk_cols)};
+            """)).fetchall()
+            if not inserted_keys:
+                return 0
+            inserted = df.merge(pd.DataFrame(inserted_keys, columns=list(pk_cols)), on=list(pk_cols))
+            LOADED_ROWS.inc(len(inserted), table=table_name)
+            # Raporty i agregaty jak w loaderze, w tej samej transakcji; bez metryki świeżości danych
+            if table_name == 'trip_updates':
+                if self.loader.report_builder:
+                    self.loader.report_builder.mark_trips(conn, inserted)
+                if self.loader.rollups:
+                    self.loader.rollups.update(conn, inserted)
+        return len(inserted)
+
+
+def run_backfill(config: dict, args) -> Dict[str, int]:
+    """
+    Punkt wejścia podkomendy `main.py backfill`.
+    """
+    backfill = Backfill(config, args.start, args.end, args.source, feeds=args.feeds, run_name=args.run_name,
+                        workers=args.workers, load_workers=args.load_workers, version_id=args.version_id,
+                        load=not args.no_load)
+    return backfill.run()
@@ -1,29 +1,83 @@
 import asyncio
-from datetime import datetime
+import shutil
+import time
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Set
 import pandas as pd
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from loguru import logger
-from etl.gtfs_realtime_pb2 import FeedMessage
-from parsers.trip_update_parser import TripUpdateParser
-from parsers.alert_parser import AlertParser
-from parsers.vehicle_position_parser import VehiclePositionParser
+from parsers.feed_parser import parse_feed
+from etl.trip_vehicle_join import join_positions_to_trip_updates
+from analytics.delay_sketches import DelaySketchStore
+from utils.atomic_io import atomic_path
+from utils.leases import LeaseManager
+from utils.manifest import BOOTSTRAPPED, ETL_DONE, ETL_STARTED, FOLDER_READY, WRITTEN, Manifest
+from utils.metrics import REGISTRY
+from utils.notifications import ParquetReadyNotifier
+from utils.pipeline import StageQueue
+from utils.tracing import TRACER, snapshot_id_from_path, write_traced_parquet
 from utils.transformations import deduplicate_before_parquet
 
+PARSE_SECONDS = REGISTRY.histogram('bimba_etl_parse_seconds', 'Czas dekodowania jednego snapshotu protobuf')
+FOLDER_SECONDS = REGISTRY.histogram('bimba_etl_folder_seconds', 'Czas przetworzenia folderu snapshotów')
+ROWS_WRITTEN = REGISTRY.counter('bimba_etl_rows_written_total', 'Wiersze zapisane do Parquet', ('table',))
+BACKLOG_FOLDERS = REGISTRY.gauge('bimba_etl_backlog_folders', 'Foldery gotowe do przetworzenia przez ETL')
+SHED_FOLDERS = REGISTRY.counter('bimba_etl_shed_folders_total', 'Foldery usunięte po przekroczeniu limitu zaległości')
+
+TRIP_UPDATE_COLUMNS = ['entity_id', 'is_deleted', 'trip_id', 'route_id', 'start_time', 'start_date',
+                       'stop_sequence', 'stop_id', 'arrival_delay', 'departure_delay',
+                       'schedule_relationship', 'timestamp', 'delay']
+VEHICLE_POSITION_COLUMNS = ['entity_id', 'is_deleted', 'trip_id', 'latitude', 'longitude',
+                            'speed', 'bearing', 'occupancy_status', 'timestamp']
+
 class TransformPbToParquetConfig:
     def __init__(self, config: dict):
         self.input_dir = Path(config['etl']['input_dir'])
         self.output_dir = Path(config['etl']['output_dir'])
         self.max_pb_files_per_folder = config['etl'].get('max_pb_files_per_folder', 50)
+        self.scan_interval = config['etl'].get('interval_seconds', 30)
+        self.max_backlog_folders = config['etl'].get('max_backlog_folders')
+        self.join_positions = config['etl'].get('join_positions', True)
+        self.position_join_tolerance = config['etl'].get('position_join_tolerance_seconds', 30)
+        self.delay_sketches = (DelaySketchStore.from_config(config)
+                               if config['etl'].get('delay_sketches', {}).get('enabled', False) else None)
+        self.manifest = Manifest.from_config(config)
+        self.leases = LeaseManager.from_config(config, 'etl')
         self.input_dir.mkdir(parents=True, exist_ok=True)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         logger.debug(f"Config initialized: {self.__dict__}")
 
 class TransformPbToParquet:
-    def __init__(self, config: TransformPbToParquetConfig):
+    """
+    Transforms ready folders of .pb snapshots into Parquet files.
+
+    Standalone, folders are found by watchdog and a periodic scan of the input dir.
+    In the pipeline they arrive from the fetcher via `folder_queue`, and a scan every
+    `scan_interval` seconds picks up folders that were dropped from a full queue.
+    Written files are put on the loader's `parquet_queue` - with the `block` policy
+    the ETL slows down when the loader falls behind.
+
+    All outputs are written atomically. With the manifest enabled, ready folders come
+    from its log instead of directory scans, a folder is marked `etl_done` together
+    with its output files in one transaction, and a folder interrupted by a crash is
+    redone under the same output names, so each file is written exactly once.
+
+    In worker mode several ETL processes (possibly on different hosts) share the
+    input dir: a folder is processed by whoever holds its lease, and a folder of a
+    dead worker is taken over when the lease expires.
+    """
+
+    def __init__(self, config: TransformPbToParquetConfig, notifier: Optional[ParquetReadyNotifier] = None,
+                 folder_queue: Optional[StageQueue] = None, parquet_queue: Optional[StageQueue] = None):
         self.config = config
+        self.notifier = notifier
+        self.folder_queue = folder_queue
+        self.parquet_queue = parquet_queue
+        self.manifest = config.manifest
+        self.leases = config.leases
+        # Folders being transformed - the watchdog handler and the periodic scan may find the same one
+        self.in_progress: Set[Path] = set()
         self.observer = Observer()
         self.loop = asyncio.get_event_loop()
         logger.debug("TransformPbToParquet initialized.")
@@ -32,6 +86,12 @@ class TransformPbToParquet:
         await self.start_monitoring()
 
     async def start_monitoring(self):
+        if self.folder_queue is not None:
+            logger.info(f"Consuming folder queue, rescanning {self.config.input_dir} "
+                        f"every {self.config.scan_interval} s.")
+            await self.consume_folder_queue()
+            return
+
         event_handler = NewFolderHandler(self)
         self.observer.schedule(event_handler, str(self.config.input_dir), recursive=True)
         self.observer.start()
@@ -50,12 +110,110 @@ class TransformPbToParquet:
             self.observer.stop()
             self.observer.join()
 
+    async def consume_folder_queue(self):
+        input_dir = self.config.input_dir.resolve()
+        next_scan = time.monotonic()
+        while True:
+            timeout = max(0.0, next_scan - time.monotonic())
+            for folder in await self.folder_queue.get_batch(timeout=timeout):
+                # The fetcher reports folders of every feed, the ETL only reads its input dir
+                if folder.resolve().parent == input_dir and self.is_ready(folder):
+                    await self.process_folder(folder)
+            if time.monotonic() >= next_scan:
+                try:
+                    await self.process_ready_folders()
+                except Exception as e:
+                    logger.exception(f"Unexpected error while scanning {input_dir}: {e}")
+                next_scan = time.monotonic() + self.config.scan_interval
+
     async def process_ready_folders(self):
-        for folder in self.config.input_dir.iterdir():
-            if folder.is_dir() and (folder / ".done").exists():
-                logger.info(f"Found ready folder: {folder}")
+        ready_folders = self.shed_backlog(self.ready_folders())
+        BACKLOG_FOLDERS.set(len(ready_folders))
+        for folder in ready_folders:
+            logger.info(f"Found ready folder: {folder}")
+            await self.process_folder(folder)
+            BACKLOG_FOLDERS.dec()
+
+    def is_ready(self, folder: Path) -> bool:
+        return (folder / ".done").exists() or (self.manifest is not None and self.manifest.has(FOLDER_READY, folder))
+
+    def ready_folders(self) -> List[Path]:
+        """
+        Folders waiting for the ETL, oldest first. With the manifest they are read from
+        its log; the input dir is listed only once, to adopt folders marked before the
+        manifest was enabled.
+        """
+        input_dir = self.config.input_dir
+        bootstrap = self.manifest is None or not self.manifest.has(BOOTSTRAPPED, input_dir)
+        scanned = sorted(folder for folder in input_dir.iterdir()
+                         if folder.is_dir() and (folder / ".done").exists()) if bootstrap else []
+        if self.manifest is None:
+            return scanned
+        if bootstrap:
+            self.manifest.record_many([(FOLDER_READY, folder, {}) for folder in scanned]
+                                      + [(BOOTSTRAPPED, input_dir, {})])
+        ready_folders = []
+        for folder in sorted(self.manifest.pending(FOLDER_READY, ETL_DONE, input_dir)):
+            if folder.is_dir():
+                ready_folders.append(folder)
+            else:
+                self.manifest.record(ETL_DONE, folder, missing=True)
+        return ready_folders
+
+    async def process_folder(self, folder: Path):
+        key = folder.resolve()
+        if key in self.in_progress:
+            return
+        self.in_progress.add(key)
+        try:
+            await self._process_leased_folder(folder)
+        finally:
+            self.in_progress.discard(key)
+
+    async def _process_leased_folder(self, folder: Path):
+        if self.leases is None:
+            await self._process_folder(folder)
+            return
+        if not self.leases.acquire(folder.name):
+            logger.debug("Folder {} is leased by another worker.", folder)
+            return
+        try:
+            # Another worker may have finished the folder before the lease was taken
+            if (folder / ".done").exists():
+                await self._process_folder(folder)
+        finally:
+            self.leases.release(folder.name)
+
+    async def _process_folder(self, folder: Path):
+        if self.manifest is not None and self.manifest.has(ETL_DONE, folder):
+            # Crashed after the outputs were recorded but before the marker was removed
+            logger.info(f"Folder already transformed: {folder}")
+        else:
+            with FOLDER_SECONDS.time():
                 await self.transform_folder(folder)
-                self.cleanup_done_file(folder)
+        self.cleanup_done_file(folder)
+
+    def shed_backlog(self, ready_folders: List[Path]) -> List[Path]:
+        """
+        Bounds the on-disk backlog: above `max_backlog_folders` ready folders the oldest
+        ones are deleted (folder names are creation timestamps).
+        """
+        limit = self.config.max_backlog_folders
+        if not limit or len(ready_folders) <= limit:
+            return ready_folders
+        shed, kept = ready_folders[:-limit], ready_folders[-limit:]
+        if self.leases is not None:
+            shed = [folder for folder in shed if not self.leases.is_leased(folder.name)]
+            if not shed:
+                return kept
+        for folder in shed:
+            shutil.rmtree(folder, ignore_errors=True)
+        if self.manifest is not None:
+            self.manifest.record_many([(ETL_DONE, folder, {'shed': True}) for folder in shed])
+        SHED_FOLDERS.inc(len(shed))
+        logger.warning(f"ETL backlog exceeded {limit} folders: dropped {len(shed)} oldest "
+                       f"({shed[0].name} .. {shed[-1].name}).")
+        return kept
 
     def cleanup_done_file(self, folder: Path):
         done_file = folder / ".done"
@@ -66,46 +224,71 @@ class TransformPbToParquet:
     async def transform_folder(self, folder: Path):
         logger.info(f"Processing folder: {folder}")
         pb_files = sorted(folder.glob("*.pb"))[:self.config.max_pb_files_per_folder]
-        logger.debug(f"Number of .pb files to process: {len(pb_files)}")
+        logger.debug("Number of .pb files to process: {}", len(pb_files))
 
         if not pb_files:
             logger.warning(f"No .pb files found in folder: {folder}")
+            # A folder still being filled must stay pending until the fetcher marks it ready
+            if self.manifest is not None and self.is_ready(folder):
+                self.manifest.record(ETL_DONE, folder, empty=True)
             return
 
+        timestamp = self.output_timestamp(folder)
+
         all_trip_updates = []
         all_vehicle_positions = []
         all_alerts = []
+        etl_start = time.time()
+        snapshots = []
 
         for pb_file in pb_files:
+            snapshot_id = snapshot_id_from_path(pb_file)
+            if snapshot_id:
+                fetched_at = pb_file.stat().st_mtime
+                snapshots.append({'id': snapshot_id, 'fetched_at': fetched_at})
+                TRACER.record([snapshot_id], 'folder_wait', fetched_at, etl_start, folder=folder.name)
             try:
-                data = self.pb_to_data(pb_file)
+                with TRACER.span([snapshot_id], 'parse'):
+                    data = self.pb_to_data(pb_file)
                 all_trip_updates.extend(data['trip_updates'])
                 all_vehicle_positions.extend(data['vehicle_positions'])
                 all_alerts.extend(data['alerts'])
-                logger.debug(f"Processed file: {pb_file}")
+                logger.debug("Processed file: {}", pb_file)
             except Exception as e:
                 logger.exception(f"Error processing file {pb_file}: {e}")
 
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        enrich = None
+        if self.config.join_positions:
+            positions_df = pd.DataFrame(all_vehicle_positions, columns=VEHICLE_POSITION_COLUMNS)
+            enrich = lambda df: join_positions_to_trip_updates(
+                df, positions_df, self.config.position_join_tolerance)
 
-        await self.save_dataframe(
+        trip_updates_df = await self.save_dataframe(
             data=all_trip_updates,
             df_name="Trip Updates",
             sub_dir="dynamic/trip_updates",
             timestamp=timestamp,
-            columns=['entity_id', 'is_deleted', 'trip_id', 'route_id', 'start_time', 'start_date',
-                     'stop_sequence', 'stop_id', 'arrival_delay', 'departure_delay',
-                     'schedule_relationship', 'timestamp', 'delay']
+            columns=TRIP_UPDATE_COLUMNS,
+            enrich=enrich,
+            snapshots=snapshots,
         )
+        if self.config.delay_sketches is not None and trip_updates_df is not None:
+            try:
+                self.config.delay_sketches.add_batch(trip_updates_df)
+                self.config.delay_sketches.flush(timestamp)
+            except Exception as e:
+                logger.exception(f"Failed to update delay sketches: {e}")
 
-        await self.save_dataframe(
+        vehicle_positions_df = await self.save_dataframe(
             data=all_vehicle_positions,
             df_name="Vehicle Positions",
             sub_dir="dynamic/vehicle_positions",
             timestamp=timestamp,
-            columns=['entity_id', 'is_deleted', 'trip_id', 'latitude', 'longitude',
-                     'speed', 'bearing', 'occupancy_status', 'timestamp']
+            columns=VEHICLE_POSITION_COLUMNS,
+            snapshots=snapshots,
         )
+        TRACER.record([snapshot['id'] for snapshot in snapshots], 'etl', etl_start, time.time(),
+                      folder=folder.name)
 
         await self.save_dataframe(
             data=all_alerts,
@@ -124,56 +307,82 @@ class TransformPbToParquet:
             output_dir = self.config.output_dir / "feeds"
             output_dir.mkdir(parents=True, exist_ok=True)
             output_file = output_dir / f"feeds_{timestamp}.parquet"
-            combined_df.to_parquet(output_file, index=False)
+            with atomic_path(output_file) as tmp_file:
+                combined_df.to_parquet(tmp_file, index=False)
             logger.info(f"Saved combined Feeds Parquet file: {output_file}")
         else:
             logger.info("No alerts present. Feeds.parquet will not be created.")
 
+        loadable = [(sub_dir, df) for sub_dir, df in (("dynamic/trip_updates", trip_updates_df),
+                                                       ("dynamic/vehicle_positions", vehicle_positions_df))
+                    if df is not None]
+        if self.manifest is not None:
+            self.manifest.record_many(
+                [(WRITTEN, self.output_file(sub_dir, timestamp), {'table': sub_dir.split('/')[-1]})
+                 for sub_dir, _ in loadable]
+                + [(ETL_DONE, folder, {'timestamp': timestamp, 'files': len(pb_files)})])
+
+        if self.parquet_queue is not None:
+            for sub_dir, _ in loadable:
+                await self.parquet_queue.put(self.output_file(sub_dir, timestamp))
+
+        if self.notifier and (all_trip_updates or all_vehicle_positions):
+            self.notifier.notify()
+
     async def save_dataframe(self, data: List[Dict], df_name: str, sub_dir: str,
-                            timestamp: str, columns: List[str]):
+                            timestamp: str, columns: List[str],
+                            enrich: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                            snapshots: Optional[List[Dict]] = None) -> Optional[pd.DataFrame]:
         if data:
             try:
                 df = pd.DataFrame(data, columns=columns)
                 # Deduplicate before parquet
                 df = deduplicate_before_parquet(df)
+                if enrich is not None:
+                    df = enrich(df)
 
-                output_dir = self.config.output_dir / sub_dir
-                output_dir.mkdir(parents=True, exist_ok=True)
-
-                output_file = output_dir / f"{sub_dir.split('/')[-1]}_{timestamp}.parquet"
-                df.to_parquet(output_file, index=False)
-                logger.info(f"Saved {df_name} Parquet file: {output_file}")
+                output_file = self.output_file(sub_dir, timestamp)
+                output_file.parent.mkdir(parents=True, exist_ok=True)
+                with atomic_path(output_file) as tmp_file:
+                    if snapshots:
+                        write_traced_parquet(df, tmp_file, snapshots)
+                    else:
+                        df.to_parquet(tmp_file, index=False)
+                ROWS_WRITTEN.inc(len(df), table=sub_dir.split('/')[-1])
+                logger.info("Saved {} Parquet file: {}", df_name, output_file)
+                return df
             except Exception as e:
                 logger.error(f"Failed to save {df_name} Parquet file: {e}")
         else:
             logger.warning(f"No {df_name.lower()} data to save from folder.")
+        return None
+
+    def output_timestamp(self, folder: Path) -> str:
+        """
+        Suffix of the folder's output names: the folder name (its creation time, unique
+        per fetcher). Names do not depend on when or by which worker the folder is
+        processed, so ETL workers sharing output_dir never overwrite each other's files,
+        and a folder restarted after a crash replaces its earlier outputs instead of
+        being loaded twice.
+        """
+        if self.manifest is not None:
+            started = (self.manifest.get(ETL_STARTED, folder) or {}).get('timestamp')
+            if started:
+                logger.info(f"Resuming interrupted folder {folder} (outputs {started}).")
+                return started
+            self.manifest.record(ETL_STARTED, folder, timestamp=folder.name)
+        return folder.name
+
+    def output_file(self, sub_dir: str, timestamp: str) -> Path:
+        return self.config.output_dir / sub_dir / f"{sub_dir.split('/')[-1]}_{timestamp}.parquet"
 
     def pb_to_data(self, pb_file: Path) -> Dict[str, List[dict]]:
         with pb_file.open('rb') as f:
             pb_data = f.read()
 
-        feed_message = FeedMessage()
-        feed_message.ParseFromString(pb_data)
-        logger.debug(f"Parsing file: {pb_file}, entities: {len(feed_message.entity)}")
-
-        trip_updates = []
-        vehicle_positions = []
-        alerts = []
-
-        for entity in feed_message.entity:
-            base_data = {"entity_id": entity.id, "is_deleted": entity.is_deleted}
-            if entity.HasField("trip_update"):
-                trip_updates.extend(TripUpdateParser.parse(base_data, entity.trip_update))
-            if entity.HasField("vehicle"):
-                vehicle_positions.append(VehiclePositionParser.parse(base_data, entity.vehicle))
-            if entity.HasField("alert"):
-                alerts.extend(AlertParser.parse(base_data, entity.alert))
-
-        return {
-            "trip_updates": trip_updates,
-            "vehicle_positions": vehicle_positions,
-            "alerts": alerts
-        }
+        logger.debug("Parsing file: {}", pb_file)
+        with PARSE_SECONDS.time():
+            return parse_feed(pb_data)
 
 class NewFolderHandler(FileSystemEventHandler):
     def __init__(self, transformer: TransformPbToParquet):
@@ -181,8 +390,19 @@ class NewFolderHandler(FileSystemEventHandler):
 
     def on_created(self, event):
         if event.is_directory:
+            # The fetcher is still filling it; the folder is taken when its .done appears
             logger.info(f"New folder created: {event.src_path}")
-            asyncio.run_coroutine_threadsafe(
-                self.transformer.transform_folder(Path(event.src_path)),
-                self.transformer.loop
-            )
+        else:
+            self._on_file(Path(event.src_path))
+
+    def on_moved(self, event):
+        # .done is written atomically, so it appears by a rename
+        if not event.is_directory:
+            self._on_file(Path(event.dest_path))
+
+    def _on_file(self, path: Path):
+        folder = path.parent
+        if path.name != ".done" or folder.parent.resolve() != self.transformer.config.input_dir.resolve():
+            return
+        if self.transformer.is_ready(folder):
+            asyncio.run_coroutine_threadsafe(self.transformer.process_folder(folder), self.transformer.loop)
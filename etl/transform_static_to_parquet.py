@@ -2,6 +2,8 @@ import pandas as pd
 from pathlib import Path
 from loguru import logger
 
+from utils.atomic_io import atomic_path
+
 class TransformStaticToParquet:
     def __init__(self, input_dir: Path, output_dir: Path):
         self.input_dir = input_dir
@@ -18,7 +20,8 @@ class TransformStaticToParquet:
                 try:
                     df = pd.read_csv(input_file)
                     output_file = self.output_dir / f"{gtfs_file.replace('.txt', '')}.parquet"
-                    df.to_parquet(output_file, index=False)
+                    with atomic_path(output_file) as tmp_file:
+                        df.to_parquet(tmp_file, index=False)
                     logger.info(f"Przetworzono plik: {input_file} -> {output_file}")
                 except Exception as e:
                     logger.exception(f"Błąd podczas przetwarzania pliku {input_file}: {e}")
@@ -31,7 +34,8 @@ class TransformStaticToParquet:
             try:
                 df = pd.read_csv(vehicle_dict_file)
                 output_file = self.output_dir / "vehicle_dictionary.parquet"
-                df.to_parquet(output_file, index=False)
+                with atomic_path(output_file) as tmp_file:
+                    df.to_parquet(tmp_file, index=False)
                 logger.info(f"Przetworzono plik: {vehicle_dict_file} -> {output_file}")
             except Exception as e:
                 logger.exception(f"Błąd podczas przetwarzania pliku {vehicle_dict_file}: {e}")
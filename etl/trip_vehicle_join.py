@@ -0,0 +1,57 @@
+import pandas as pd
+from loguru import logger
+
+POSITION_COLUMNS = ['vehicle_id', 'latitude', 'longitude', 'position_timestamp']
+# Fixed dtypes, so that files without a single match get the same Parquet types as the
+# others (an all-None column would be written as `null` and fail to unify in datasets)
+POSITION_DTYPES = {'vehicle_id': 'string', 'latitude': 'float64', 'longitude': 'float64',
+                   'position_timestamp': 'Int64'}
+
+
+def join_positions_to_trip_updates(trip_updates: pd.DataFrame, vehicle_positions: pd.DataFrame,
+                                   tolerance_seconds: int = 30) -> pd.DataFrame:
+    """
+    As-of join: to each trip update row attaches the vehicle position of the same trip
+    that is closest in time, within `tolerance_seconds`.
+
+    Both feeds are timestamped independently, so an exact timestamp match (as in the old
+    daily_report view) almost never happens. Rows without a match keep NaN positions.
+    """
+    enriched = trip_updates.copy()
+    for column in POSITION_COLUMNS:
+        enriched[column] = pd.Series(None, index=enriched.index, dtype=object).astype(POSITION_DTYPES[column])
+    if trip_updates.empty or vehicle_positions.empty:
+        return enriched
+
+    positions = (
+        vehicle_positions[vehicle_positions['trip_id'].notna()
+                          & vehicle_positions['latitude'].notna()
+                          & vehicle_positions['longitude'].notna()]
+        .rename(columns={'entity_id': 'vehicle_id', 'timestamp': 'position_timestamp'})
+        [['trip_id', 'vehicle_id', 'latitude', 'longitude', 'position_timestamp']]
+        .drop_duplicates(subset=['trip_id', 'position_timestamp'])
+    )
+    if positions.empty:
+        return enriched
+    positions['position_timestamp'] = positions['position_timestamp'].astype('int64')
+    positions['_ts'] = positions['position_timestamp']
+
+    left = trip_updates.reset_index(drop=True)
+    left['_row'] = left.index
+    left['_ts'] = left['timestamp'].astype('int64')
+    matched = pd.merge_asof(
+        left[['_row', '_ts', 'trip_id']].sort_values('_ts'),
+        positions.sort_values('_ts'),
+        on='_ts',
+        by='trip_id',
+        direction='nearest',
+        tolerance=tolerance_seconds,
+    ).set_index('_row').sort_index()
+
+    enriched = left.drop(columns=['_row', '_ts'])
+    for column in POSITION_COLUMNS:
+        enriched[column] = pd.Series(matched[column].to_numpy(), index=enriched.index).astype(POSITION_DTYPES[column])
+    match_rate = matched['vehicle_id'].notna().mean()
+    logger.debug(f"Matched vehicle positions to {match_rate:.1%} of trip update rows "
+                 f"(tolerance {tolerance_seconds}s).")
+    return enriched
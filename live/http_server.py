@@ -0,0 +1,73 @@
+import asyncio
+from aiohttp import web
+from loguru import logger
+
+from live.state_store import LiveStateStore
+
+
+class LiveStateServer:
+    """
+    Lokalny endpoint HTTP/JSON nad LiveStateStore:
+
+    - GET /health                      - liczności i wiek stanu
+    - GET /vehicles                    - wszystkie aktualne pojazdy
+    - GET /vehicles/{vehicle_id}       - stan pojazdu
+    - GET /trips/{trip_id}             - stan kursu
+    - GET /routes/{route_id}/vehicles  - pojazdy na linii
+    """
+
+    def __init__(self, store: LiveStateStore, host: str = "127.0.0.1", port: int = 8085):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/health', self.health),
+            web.get('/vehicles', self.vehicles),
+            web.get('/vehicles/{vehicle_id}', self.vehicle),
+            web.get('/trips/{trip_id}', self.trip),
+            web.get('/routes/{route_id}/vehicles', self.route_vehicles),
+        ])
+        self._runner = None
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.store.summary())
+
+    async def vehicles(self, request: web.Request) -> web.Response:
+        return web.json_response(self.store.vehicles_snapshot())
+
+    async def vehicle(self, request: web.Request) -> web.Response:
+        record = self.store.vehicle(request.match_info['vehicle_id'])
+        if record is None:
+            raise web.HTTPNotFound(text="Nieznany pojazd")
+        return web.json_response(record)
+
+    async def trip(self, request: web.Request) -> web.Response:
+        record = self.store.trip(request.match_info['trip_id'])
+        if record is None:
+            raise web.HTTPNotFound(text="Nieznany kurs")
+        return web.json_response(record)
+
+    async def route_vehicles(self, request: web.Request) -> web.Response:
+        return web.json_response(self.store.route_vehicles(request.match_info['route_id']))
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Endpoint stanu bieżącego nasłuchuje na http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def run(self):
+        """
+        Uruchamia serwer i działa do anulowania zadania.
+        """
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
@@ -0,0 +1,245 @@
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from loguru import logger
+
+from parsers.feed_parser import parse_feed
+
+
+class _Interner:
+    """
+    Zamienia identyfikatory tekstowe na kolejne liczby całkowite (indeksy w tablicach).
+    """
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def get(self, value: Optional[str]) -> int:
+        if value is None or value == '':
+            return -1
+        return self.index.get(value, -1)
+
+    def intern(self, value: Optional[str]) -> int:
+        if value is None or value == '':
+            return -1
+        position = self.index.get(value)
+        if position is None:
+            position = len(self.values)
+            self.index[value] = position
+            self.values.append(value)
+        return position
+
+    def name(self, position: int) -> Optional[str]:
+        return self.values[position] if position >= 0 else None
+
+
+class _Columns:
+    """
+    Zestaw tablic NumPy o wspólnej długości, powiększanych dwukrotnie w miarę potrzeby.
+    """
+
+    def __init__(self, dtypes: Dict[str, tuple], capacity: int = 1024):
+        self.dtypes = dtypes
+        self.arrays = {name: np.full(capacity, fill, dtype=dtype) for name, (dtype, fill) in dtypes.items()}
+
+    def ensure(self, size: int):
+        capacity = len(next(iter(self.arrays.values())))
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, (dtype, fill) in self.dtypes.items():
+            grown = np.full(capacity, fill, dtype=dtype)
+            grown[:len(self.arrays[name])] = self.arrays[name]
+            self.arrays[name] = grown
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+class LiveStateStore:
+    """
+    Bieżący stan sieci w pamięci: ostatnia pozycja każdego pojazdu oraz ostatnie
+    opóźnienie każdego kursu, aktualizowane z każdego pobranego snapshotu GTFS-Realtime.
+
+    Identyfikatory pojazdów, kursów, linii i przystanków są internowane, a stan
+    trzymany w tablicach NumPy indeksowanych tymi numerami - odczyt pojazdu lub
+    kursu to O(1), bez udziału bazy danych.
+    """
+
+    def __init__(self, max_age_seconds: int = 600):
+        self.max_age_seconds = max_age_seconds
+        self.vehicle_ids = _Interner()
+        self.trip_ids = _Interner()
+        self.route_ids = _Interner()
+        self.stop_ids = _Interner()
+        self.vehicles = _Columns({
+            'latitude': (np.float64, np.nan),
+            'longitude': (np.float64, np.nan),
+            'speed': (np.float32, np.nan),
+            'bearing': (np.float32, np.nan),
+            'timestamp': (np.int64, 0),
+            'trip': (np.int32, -1),
+        })
+        self.trips = _Columns({
+            'route': (np.int32, -1),
+            'vehicle': (np.int32, -1),
+            'stop_sequence': (np.int32, -1),
+            'stop': (np.int32, -1),
+            'delay': (np.float64, np.nan),
+            'timestamp': (np.int64, 0),
+        })
+        self.last_update: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def apply_feed(self, pb_data: bytes):
+        """
+        Dekoduje snapshot GTFS-Realtime i nanosi go na stan.
+        """
+        data = parse_feed(pb_data)
+        self.apply(data['trip_updates'], data['vehicle_positions'])
+
+    def apply(self, trip_updates: List[dict], vehicle_positions: List[dict]):
+        """
+        Nanosi na stan wiersze w formacie parserów (TripUpdateParser, VehiclePositionParser).
+        Starsze dane niż już zapisane dla danego pojazdu/kursu są pomijane.
+        """
+        with self._lock:
+            for row in vehicle_positions:
+                self._apply_vehicle_position(row)
+            # Dla kursu bieżące opóźnienie to opóźnienie na najbliższym (pierwszym) przystanku z listy
+            nearest: Dict[str, dict] = {}
+            for row in trip_updates:
+                current = nearest.get(row['trip_id'])
+                if current is None or row['stop_sequence'] < current['stop_sequence']:
+                    nearest[row['trip_id']] = row
+            for row in nearest.values():
+                self._apply_trip_update(row)
+            self.last_update = time.time()
+        logger.debug("Stan bieżący: {} pozycji, {} kursów.", len(vehicle_positions), len(nearest))
+
+    def _apply_vehicle_position(self, row: dict):
+        if row.get('is_deleted'):
+            return
+        vehicle = self.vehicle_ids.intern(row['entity_id'])
+        self.vehicles.ensure(vehicle + 1)
+        timestamp = int(row['timestamp'] or 0)
+        if timestamp < self.vehicles['timestamp'][vehicle]:
+            return
+        trip = self.trip_ids.intern(row['trip_id'])
+        self.vehicles['latitude'][vehicle] = np.nan if row['latitude'] is None else row['latitude']
+        self.vehicles['longitude'][vehicle] = np.nan if row['longitude'] is None else row['longitude']
+        self.vehicles['speed'][vehicle] = np.nan if row['speed'] is None else row['speed']
+        self.vehicles['bearing'][vehicle] = np.nan if row['bearing'] is None else row['bearing']
+        self.vehicles['timestamp'][vehicle] = timestamp
+        self.vehicles['trip'][vehicle] = trip
+        if trip >= 0:
+            self.trips.ensure(trip + 1)
+            self.trips['vehicle'][trip] = vehicle
+
+    def _apply_trip_update(self, row: dict):
+        if row.get('is_deleted'):
+            return
+        trip = self.trip_ids.intern(row['trip_id'])
+        if trip < 0:
+            return
+        self.trips.ensure(trip + 1)
+        timestamp = int(row['timestamp'] or 0)
+        if timestamp < self.trips['timestamp'][trip]:
+            return
+        delay = row['arrival_delay'] if row['arrival_delay'] is not None else row['departure_delay']
+        route = self.route_ids.intern(row['route_id'])
+        if route >= 0:
+            self.trips['route'][trip] = route
+        self.trips['stop_sequence'][trip] = row['stop_sequence']
+        self.trips['stop'][trip] = self.stop_ids.intern(row['stop_id'])
+        self.trips['delay'][trip] = np.nan if delay is None else delay
+        self.trips['timestamp'][trip] = timestamp
+
+    def vehicle(self, vehicle_id: str) -> Optional[dict]:
+        """
+        Zwraca ostatni znany stan pojazdu (pozycja, kurs, linia, opóźnienie) lub None.
+        """
+        with self._lock:
+            vehicle = self.vehicle_ids.get(vehicle_id)
+            if vehicle < 0:
+                return None
+            return self._vehicle_record(vehicle)
+
+    def trip(self, trip_id: str) -> Optional[dict]:
+        """
+        Zwraca ostatni znany stan kursu (opóźnienie, najbliższy przystanek, pojazd) lub None.
+        """
+        with self._lock:
+            trip = self.trip_ids.get(trip_id)
+            if trip < 0 or trip >= len(self.trips['timestamp']):
+                return None
+            return self._trip_record(trip)
+
+    def route_vehicles(self, route_id: str) -> List[dict]:
+        """
+        Zwraca aktualne (nie starsze niż max_age_seconds) pojazdy jadące kursami danej linii.
+        """
+        with self._lock:
+            route = self.route_ids.get(route_id)
+            if route < 0:
+                return []
+            count = len(self.vehicle_ids.values)
+            trips = self.vehicles['trip'][:count]
+            trip_routes = np.where(trips >= 0, self.trips['route'][np.maximum(trips, 0)], -1)
+            fresh = self.vehicles['timestamp'][:count] >= int(time.time()) - self.max_age_seconds
+            return [self._vehicle_record(vehicle) for vehicle in np.flatnonzero((trip_routes == route) & fresh)]
+
+    def vehicles_snapshot(self) -> List[dict]:
+        """
+        Zwraca wszystkie aktualne (nie starsze niż max_age_seconds) pojazdy.
+        """
+        with self._lock:
+            count = len(self.vehicle_ids.values)
+            fresh = self.vehicles['timestamp'][:count] >= int(time.time()) - self.max_age_seconds
+            return [self._vehicle_record(vehicle) for vehicle in np.flatnonzero(fresh)]
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'vehicles': len(self.vehicle_ids.values),
+                'trips': len(self.trip_ids.values),
+                'routes': len(self.route_ids.values),
+                'last_update': self.last_update,
+                'age_seconds': None if self.last_update is None else round(time.time() - self.last_update, 3),
+            }
+
+    def _vehicle_record(self, vehicle: int) -> dict:
+        trip = int(self.vehicles['trip'][vehicle])
+        record = {
+            'vehicle_id': self.vehicle_ids.name(vehicle),
+            'latitude': _optional(self.vehicles['latitude'][vehicle]),
+            'longitude': _optional(self.vehicles['longitude'][vehicle]),
+            'speed': _optional(self.vehicles['speed'][vehicle]),
+            'bearing': _optional(self.vehicles['bearing'][vehicle]),
+            'timestamp': int(self.vehicles['timestamp'][vehicle]),
+            'trip_id': self.trip_ids.name(trip),
+            'route_id': None,
+            'delay': None,
+        }
+        if 0 <= trip < len(self.trips['timestamp']):
+            record['route_id'] = self.route_ids.name(int(self.trips['route'][trip]))
+            record['delay'] = _optional(self.trips['delay'][trip])
+        return record
+
+    def _trip_record(self, trip: int) -> dict:
+        return {
+            'trip_id': self.trip_ids.name(trip),
+            'route_id': self.route_ids.name(int(self.trips['route'][trip])),
+            'vehicle_id': self.vehicle_ids.name(int(self.trips['vehicle'][trip])),
+            'stop_sequence': int(self.trips['stop_sequence'][trip]),
+            'stop_id': self.stop_ids.name(int(self.trips['stop'][trip])),
+            'delay': _optional(self.trips['delay'][trip]),
+            'timestamp': int(self.trips['timestamp'][trip]),
+        }
+
+
+def _optional(value) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
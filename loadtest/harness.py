@@ -0,0 +1,239 @@
+"""
+Test obciążeniowy całego potoku (fetch -> ETL -> loader) na serwerze zastępczym.
+
+Dla każdej kombinacji liczby pojazdów i kanałów uruchamia w osobnym procesie
+GtfsRtStubServer z syntetyczną siecią, a w bieżącym `main_async` ze wszystkimi
+modułami, skierowany na ten serwer, lokalny katalog roboczy i podaną bazę
+Postgres (najlepiej pustą, przeznaczoną do testów). Po czasie `duration` zbiera:
+
+- pobrane i załadowane snapshoty na sekundę (po rozgrzewce),
+- opóźnienie od pobrania snapshotu do wstawienia do bazy (p50/p90/p99, ze śladów),
+- wiersze załadowane do bazy, czas CPU, szczytowe RSS i zajętość dysku.
+
+Przykład:
+    python -m loadtest.harness --db-uri postgresql+psycopg2://postgres:@localhost:5432/bimba_loadtest \\
+        --vehicles 200 1000 5000 --feeds 1 3 --duration 180
+"""
+
+import argparse
+import asyncio
+import copy
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import aiohttp
+import pandas as pd
+from loguru import logger
+
+from config import CONFIG
+from main import main_async
+from data_loading.load_to_db import LOADED_ROWS
+from loadtest.stub_server import GtfsRtStubServer, feed_names
+from loadtest.synthetic_feed import SyntheticNetwork
+from utils.logging_config import configure_logging
+from utils.tracing import configure_tracing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def run_stub_server(vehicles: int, feeds: int, port: int, options: dict):
+    """
+    Cel procesu serwera zastępczego - generowanie snapshotów nie obciąża mierzonego procesu.
+    """
+    network = SyntheticNetwork(vehicles=vehicles, routes=max(1, vehicles // 10))
+    server_options = {key: options[key] for key in ('latency', 'failure_rate', 'not_modified_rate')}
+    if options.get('recorded_dir'):
+        server = GtfsRtStubServer.recorded(options['recorded_dir'], network, feeds, options['update_interval'],
+                                           port=port, **server_options)
+    else:
+        server = GtfsRtStubServer.synthetic(network, feeds, options['update_interval'], port=port, **server_options)
+    asyncio.run(server.run())
+
+
+def scenario_config(base_config: dict, workdir: Path, base_url: str, feeds: int, db_uri: str,
+                    interval_seconds: int) -> dict:
+    config = copy.deepcopy(base_config)
+    config['modules'] = {module: True for module in ('fetch_dynamic', 'fetch_static', 'etl', 'load_to_db')}
+    raw_dir, processed_dir = workdir / "raw", workdir / "processed"
+    config['data_acquisition']['dynamic']['interval_seconds'] = interval_seconds
+    config['data_acquisition']['dynamic']['urls'] = {name: f"{base_url}/{name}" for name in feed_names(feeds)}
+    config['data_acquisition']['static']['urls'] = {'gtfs_zip': f"{base_url}/gtfs.zip",
+                                                    'vehicle_dictionary': f"{base_url}/vehicle_dictionary.csv"}
+    config['data_storage'].update(raw_dir=str(raw_dir), processed_dir=str(processed_dir),
+                                  dynamic_dir=str(processed_dir / "dynamic"), static_dir=str(processed_dir))
+    config['etl'].update(input_dir=str(raw_dir / "dynamic" / "feeds"), output_dir=str(processed_dir))
+    config['database']['uri'] = db_uri
+    config['database'].pop('async_uri', None)
+    config['metrics'] = {'enabled': False}
+    config['live'] = {**config.get('live', {}), 'http': {'enabled': False}}
+    config['tracing'] = {'enabled': True, 'file': str(workdir / "traces.jsonl")}
+    config['manifest'] = {**config.get('manifest', {}), 'path': str(workdir / "manifest.sqlite")}
+    return config
+
+
+def disk_usage(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def cpu_seconds() -> float:
+    return time.process_time()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Szczytowe RSS procesu; None na systemach bez modułu `resource` (Windows).
+    """
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def run_scenario(config: dict, duration: float, warmup: float, sample_interval: float = 5.0) -> Dict:
+    """
+    Uruchamia potok na `duration` sekund i zwraca zebrane pomiary.
+    """
+    workdir = Path(config['tracing']['file']).parent
+    configure_tracing(config)
+    rows_before = {table: LOADED_ROWS.value(table=table) for table in ('trip_updates', 'vehicle_positions')}
+    cpu_before = cpu_seconds()
+    started_at = time.time()
+    peak_disk = 0
+
+    pipeline = asyncio.create_task(main_async(config, None))
+    try:
+        while time.time() - started_at < duration and not pipeline.done():
+            await asyncio.sleep(sample_interval)
+            peak_disk = max(peak_disk, await asyncio.to_thread(disk_usage, workdir))
+    finally:
+        pipeline.cancel()
+        await asyncio.gather(pipeline, return_exceptions=True)
+    elapsed = time.time() - started_at
+
+    result = {
+        'duration_s': round(elapsed, 1),
+        'rows_loaded': sum(LOADED_ROWS.value(table=table) - before for table, before in rows_before.items()),
+        'cpu_s': round(cpu_seconds() - cpu_before, 1),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_disk_mb': round(peak_disk / 2 ** 20, 1),
+    }
+    result.update(trace_statistics(Path(config['tracing']['file']), started_at + warmup, elapsed - warmup))
+    return result
+
+
+def trace_statistics(trace_file: Path, window_start: float, window_seconds: float) -> Dict:
+    """
+    Przepustowość i opóźnienie end-to-end ze śladów snapshotów zakończonych po rozgrzewce.
+    """
+    empty = {'fetched_per_s': 0.0, 'loaded_per_s': 0.0, 'lag_p50_s': None, 'lag_p90_s': None, 'lag_p99_s': None}
+    if not trace_file.exists() or window_seconds <= 0:
+        return empty
+    spans = pd.read_json(trace_file, lines=True)
+    if spans.empty:
+        return empty
+    spans = spans[spans['end'] >= window_start]
+    fetched = spans[spans['span'] == 'fetch']
+    # Snapshot trafia do dwóch tabel - liczy się zakończenie ostatniego ładowania
+    loaded = spans[spans['span'] == 'end_to_end'].groupby('trace_id')['duration'].max()
+    lag = loaded.quantile([0.5, 0.9, 0.99]) if not loaded.empty else pd.Series([None] * 3, index=[0.5, 0.9, 0.99])
+    return {
+        'fetched_per_s': round(len(fetched) / window_seconds, 2),
+        'loaded_per_s': round(len(loaded) / window_seconds, 2),
+        'lag_p50_s': lag[0.5],
+        'lag_p90_s': lag[0.9],
+        'lag_p99_s': lag[0.99],
+    }
+
+
+async def server_stats(base_url: str) -> pd.DataFrame:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/stats") as response:
+            return pd.DataFrame(await response.json())
+
+
+async def wait_for_server(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{base_url}/stats") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                if time.time() > deadline:
+                    raise
+            await asyncio.sleep(0.5)
+
+
+def run_load_test(db_uri: str, vehicles: List[int], feeds: List[int], duration: float, workdir: Path,
+                  warmup: float = 30.0, interval_seconds: int = 10, port: int = 8090,
+                  server_options: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Uruchamia scenariusze (pojazdy x kanały) po kolei i zwraca tabelę wyników.
+    """
+    server_options = {'latency': (0.0, 0.0), 'failure_rate': 0.0, 'not_modified_rate': 0.0,
+                      'update_interval': float(interval_seconds), 'recorded_dir': None, **(server_options or {})}
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    for vehicle_count in vehicles:
+        for feed_count in feeds:
+            scenario = f"v{vehicle_count}_f{feed_count}_{time.strftime('%Y%m%d%H%M%S')}"
+            scenario_dir = workdir / scenario
+            scenario_dir.mkdir(parents=True, exist_ok=True)
+            logger.info(f"Scenariusz {scenario}: {vehicle_count} pojazdów, {feed_count} kanałów, {duration} s.")
+            server = multiprocessing.Process(target=run_stub_server, daemon=True,
+                                             args=(vehicle_count, feed_count, port, server_options))
+            server.start()
+            try:
+                asyncio.run(wait_for_server(base_url))
+                config = scenario_config(CONFIG, scenario_dir, base_url, feed_count, db_uri, interval_seconds)
+                result = asyncio.run(run_scenario(config, duration, warmup))
+                responses = asyncio.run(server_stats(base_url))
+            finally:
+                server.terminate()
+                server.join()
+            result = {'scenario': scenario, 'vehicles': vehicle_count, 'feeds': feed_count, **result}
+            if not responses.empty:
+                for status, count in responses.groupby('status')['count'].sum().items():
+                    result[f"http_{status}"] = int(count)
+            logger.info(f"Wynik {scenario}: {result}")
+            results.append(result)
+    results = pd.DataFrame(results)
+    results.to_csv(workdir / "results.csv", index=False)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Projekt Bimba - test obciążeniowy potoku")
+    parser.add_argument('--db-uri', required=True, help='URI lokalnej bazy Postgres do testów')
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[200, 1000], help='Liczby pojazdów')
+    parser.add_argument('--feeds', type=int, nargs='+', default=[1, 3], help='Liczby kanałów dynamicznych')
+    parser.add_argument('--duration', type=float, default=180, help='Czas scenariusza w sekundach')
+    parser.add_argument('--warmup', type=float, default=30, help='Pomijany początek scenariusza w sekundach')
+    parser.add_argument('--interval', type=int, default=10, help='Interwał pobierania i zmian kanałów w sekundach')
+    parser.add_argument('--port', type=int, default=8090, help='Port serwera zastępczego')
+    parser.add_argument('--latency-ms', type=float, nargs=2, default=[0, 0], metavar=('MIN', 'MAX'),
+                        help='Zakres opóźnienia odpowiedzi serwera')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Odsetek odpowiedzi 503')
+    parser.add_argument('--not-modified-rate', type=float, default=0.0, help='Odsetek odpowiedzi 304')
+    parser.add_argument('--recorded-dir', type=Path, help='Katalog z nagranymi snapshotami (układ raw/dynamic)')
+    parser.add_argument('--workdir', type=Path, default=Path('loadtest_runs'), help='Katalog roboczy')
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    configure_logging(str(args.workdir / "harness.log"), "INFO", mode="production",
+                      production=CONFIG['logging'].get('production'))
+    results = run_load_test(args.db_uri, args.vehicles, args.feeds, args.duration, args.workdir,
+                            warmup=args.warmup, interval_seconds=args.interval, port=args.port,
+                            server_options={'latency': (args.latency_ms[0] / 1000, args.latency_ms[1] / 1000),
+                                            'failure_rate': args.failure_rate,
+                                            'not_modified_rate': args.not_modified_rate,
+                                            'recorded_dir': args.recorded_dir})
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from email.utils import formatdate
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from aiohttp import web
+from loguru import logger
+
+from loadtest.synthetic_feed import SyntheticNetwork
+
+
+class FeedEndpoint:
+    """
+    Treść jednego adresu serwera zastępczego. Nowa wersja powstaje co `update_interval`
+    sekund (tak często zmienia się plik u źródła), a między zmianami serwer zwraca
+    tę samą treść i ten sam ETag.
+    """
+
+    def __init__(self, render: Callable[[float], bytes], update_interval: float,
+                 content_type: str = "application/octet-stream"):
+        self.render = render
+        self.update_interval = update_interval
+        self.content_type = content_type
+        self._version: Optional[int] = None
+        self._body = b""
+
+    def current(self, now: float) -> Tuple[int, bytes]:
+        version = int(now // self.update_interval)
+        if version != self._version:
+            self._body = self.render(now)
+            self._version = version
+        return version, self._body
+
+
+def recorded_feed(paths: Iterable[Path]) -> Callable[[float], bytes]:
+    """
+    Odtwarza nagrane snapshoty (.pb) po kolei, w pętli - jeden na każdą wersję endpointu.
+    """
+    paths: List[Path] = sorted(paths)
+    if not paths:
+        raise ValueError("Brak nagranych plików .pb do odtworzenia.")
+    position = 0
+
+    def render(now: float) -> bytes:
+        nonlocal position
+        data = paths[position % len(paths)].read_bytes()
+        position += 1
+        return data
+
+    return render
+
+
+def feed_names(feeds: int) -> List[str]:
+    """
+    Nazwy kanałów dynamicznych: 'feeds' (czytany przez ETL), potem trip_updates,
+    vehicle_positions i kolejne kopie feeds_<n>.
+    """
+    names = ['feeds', 'trip_updates', 'vehicle_positions'][:feeds]
+    return names + [f"feeds_{n}" for n in range(len(names), feeds)]
+
+
+class GtfsRtStubServer:
+    """
+    Lokalny serwer zastępujący ztm.poznan.pl w testach obciążeniowych:
+
+    - GET /{name} - treść endpointu (snapshot GTFS-RT, archiwum GTFS, słownik pojazdów)
+    - GET /stats  - liczba odpowiedzi per endpoint i kod statusu
+
+    Symuluje opóźnienie odpowiedzi (losowe z `latency`), błędy 503 (`failure_rate`)
+    oraz 304 - zawsze, gdy If-None-Match wskazuje bieżącą wersję, i losowo
+    z prawdopodobieństwem `not_modified_rate`.
+    """
+
+    def __init__(self, endpoints: Dict[str, FeedEndpoint], host: str = "127.0.0.1", port: int = 8090,
+                 latency: Tuple[float, float] = (0.0, 0.0), failure_rate: float = 0.0,
+                 not_modified_rate: float = 0.0, seed: int = 0):
+        self.endpoints = endpoints
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.not_modified_rate = not_modified_rate
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/stats', self.handle_stats),
+            web.get('/{name}', self.handle),
+        ])
+        self._runner = None
+
+    @classmethod
+    def synthetic(cls, network: SyntheticNetwork, feeds: int = 1, update_interval: float = 10.0,
+                  static_update_interval: float = 86400.0, **kwargs) -> "GtfsRtStubServer":
+        renderers = {
+            'feeds': lambda now: network.feed(now),
+            'trip_updates': lambda now: network.feed(now, vehicle_positions=False),
+            'vehicle_positions': lambda now: network.feed(now, trip_updates=False),
+        }
+        endpoints = {name: FeedEndpoint(renderers.get(name, renderers['feeds']), update_interval)
+                     for name in feed_names(feeds)}
+        gtfs_zip, vehicle_dictionary = network.gtfs_zip(), network.vehicle_dictionary_csv()
+        endpoints['gtfs.zip'] = FeedEndpoint(lambda now: gtfs_zip, static_update_interval, "application/zip")
+        endpoints['vehicle_dictionary.csv'] = FeedEndpoint(lambda now: vehicle_dictionary, static_update_interval,
+                                                           "text/csv")
+        return cls(endpoints, **kwargs)
+
+    @classmethod
+    def recorded(cls, recorded_dir: Path, network: SyntheticNetwork, feeds: int = 1,
+                 update_interval: float = 10.0, **kwargs) -> "GtfsRtStubServer":
+        """
+        Serwer odtwarzający nagrane snapshoty z `recorded_dir/<kanał>/**/*.pb` (układ katalogu
+        raw/dynamic fetchera); kanały bez nagrań i dane statyczne pochodzą z `network`.
+        """
+        server = cls.synthetic(network, feeds, update_interval, **kwargs)
+        for name in feed_names(feeds):
+            paths = list((Path(recorded_dir) / name).rglob("*.pb"))
+            if paths:
+                server.endpoints[name] = FeedEndpoint(recorded_feed(paths), update_interval)
+        return server
+
+    def url(self, name: str) -> str:
+        return f"http://{self.host}:{self.port}/{name}"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        name = request.match_info['name']
+        endpoint = self.endpoints.get(name)
+        if endpoint is None:
+            raise web.HTTPNotFound(text="Nieznany endpoint")
+        if self.latency[1] > 0:
+            await asyncio.sleep(self.random.uniform(*self.latency))
+        if self.random.random() < self.failure_rate:
+            return self._respond(name, web.Response(status=503, text="Symulowana awaria"))
+
+        version, body = endpoint.current(time.time())
+        etag = f'"{name}-{version}"'
+        headers = {'ETag': etag, 'Last-Modified': formatdate(version * endpoint.update_interval, usegmt=True)}
+        if request.headers.get('If-None-Match') == etag or self.random.random() < self.not_modified_rate:
+            return self._respond(name, web.Response(status=304, headers=headers))
+        return self._respond(name, web.Response(body=body, content_type=endpoint.content_type, headers=headers))
+
+    def _respond(self, name: str, response: web.Response) -> web.Response:
+        self.stats[(name, response.status)] += 1
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response([{'endpoint': name, 'status': status, 'count': count}
+                                  for (name, status), count in sorted(self.stats.items())])
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Serwer zastępczy GTFS-RT nasłuchuje na http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def run(self):
+        """
+        Uruchamia serwer i działa do anulowania zadania.
+        """
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
@@ -0,0 +1,186 @@
+import io
+import zipfile
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+
+from etl.gtfs_realtime_pb2 import FeedMessage
+
+# Środek sieci syntetycznej (Poznań) i przybliżona skala stopni na metry
+CENTER_LAT, CENTER_LON = 52.4064, 16.9252
+METERS_PER_DEG_LAT = 111_320.0
+
+
+class SyntheticNetwork:
+    """
+    Syntetyczna sieć do testów obciążeniowych: `routes` linii prostych wokół środka
+    miasta, po `stops_per_trip` przystanków, i `vehicles` pojazdów, każdy na własnym
+    kursie jeżdżącym w kółko po swojej linii.
+
+    `gtfs_zip` zwraca spójny rozkład GTFS (te same trip_id i stop_id co w danych
+    bieżących), a `feed` - snapshot GTFS-RT z pozycjami i/lub opóźnieniami na chwilę
+    `now`. Opóźnienia pojazdów zmieniają się jak błądzenie losowe.
+    """
+
+    def __init__(self, vehicles: int = 200, routes: int = 20, stops_per_trip: int = 20,
+                 stop_interval_seconds: int = 120, timezone: str = "Europe/Warsaw", seed: int = 0):
+        self.vehicles = vehicles
+        self.routes = routes
+        self.stops_per_trip = stops_per_trip
+        self.stop_interval_seconds = stop_interval_seconds
+        self.timezone = ZoneInfo(timezone)
+        self.rng = np.random.default_rng(seed)
+        self.started_at = datetime.now(self.timezone).replace(microsecond=0)
+
+        angles = self.rng.uniform(0, np.pi, routes)
+        half_length = self.rng.uniform(3_000, 8_000, routes)
+        meters_per_deg_lon = METERS_PER_DEG_LAT * np.cos(np.radians(CENTER_LAT))
+        fractions = np.linspace(-1.0, 1.0, stops_per_trip)
+        # Przystanki linii r: [r, i] dla i-tego przystanku
+        self.stop_lat = CENTER_LAT + np.outer(half_length * np.sin(angles), fractions) / METERS_PER_DEG_LAT
+        self.stop_lon = CENTER_LON + np.outer(half_length * np.cos(angles), fractions) / meters_per_deg_lon
+
+        self.vehicle_route = np.arange(vehicles) % routes
+        self.vehicle_offset = self.rng.uniform(0, self.trip_seconds, vehicles)
+        self.vehicle_delay = self.rng.normal(60, 90, vehicles)
+
+    @property
+    def trip_seconds(self) -> int:
+        return self.stop_interval_seconds * (self.stops_per_trip - 1)
+
+    @staticmethod
+    def stop_id(route: int, sequence: int) -> str:
+        return f"S{route}_{sequence}"
+
+    @staticmethod
+    def trip_id(vehicle: int) -> str:
+        return f"T{vehicle}"
+
+    @staticmethod
+    def vehicle_id(vehicle: int) -> str:
+        return f"V{vehicle}"
+
+    def gtfs_zip(self) -> bytes:
+        """
+        Buduje archiwum GTFS z rozkładem zgodnym z danymi bieżącymi sieci.
+        """
+        today = self.started_at.date()
+        route_ids = [f"R{r}" for r in range(self.routes)]
+        stops = pd.DataFrame({
+            'stop_id': [self.stop_id(r, i) for r in range(self.routes) for i in range(self.stops_per_trip)],
+            'stop_code': None,
+            'stop_name': [f"Przystanek {r}/{i}" for r in range(self.routes) for i in range(self.stops_per_trip)],
+            'stop_lat': self.stop_lat.ravel(),
+            'stop_lon': self.stop_lon.ravel(),
+            'zone_id': 'A',
+        })
+        routes = pd.DataFrame({'route_id': route_ids, 'agency_id': '1',
+                               'route_short_name': [str(r + 1) for r in range(self.routes)],
+                               'route_long_name': None, 'route_desc': None, 'route_type': 3,
+                               'route_color': None, 'route_text_color': None})
+        trips = pd.DataFrame({
+            'route_id': [route_ids[r] for r in self.vehicle_route],
+            'service_id': 'S',
+            'trip_id': [self.trip_id(v) for v in range(self.vehicles)],
+            'trip_headsign': 'Syntetyczny',
+            'direction_id': 0,
+            'block_id': None,
+            'shape_id': [f"SH{r}" for r in self.vehicle_route],
+            'wheelchair_accessible': 1,
+            'brigade': np.arange(self.vehicles) + 1,
+        })
+        # Kurs zaczyna się na pierwszym przystanku w chwili uruchomienia sieci przesuniętej o offset pojazdu
+        midnight = self.started_at.replace(hour=0, minute=0, second=0)
+        first_departure = (self.started_at - midnight).total_seconds() - self.vehicle_offset
+        seconds = first_departure[:, None] + np.arange(self.stops_per_trip) * self.stop_interval_seconds
+        seconds = np.maximum(seconds, 0).astype(int)
+        times = [f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in seconds.ravel()]
+        stop_times = pd.DataFrame({
+            'trip_id': np.repeat([self.trip_id(v) for v in range(self.vehicles)], self.stops_per_trip),
+            'arrival_time': times,
+            'departure_time': times,
+            'stop_id': [self.stop_id(r, i) for r in self.vehicle_route for i in range(self.stops_per_trip)],
+            'stop_sequence': np.tile(np.arange(1, self.stops_per_trip + 1), self.vehicles),
+            'stop_headsign': None,
+            'pickup_type': 0,
+            'drop_off_type': 0,
+        })
+        shapes = pd.DataFrame({
+            'shape_id': np.repeat([f"SH{r}" for r in range(self.routes)], self.stops_per_trip),
+            'shape_pt_lat': self.stop_lat.ravel(),
+            'shape_pt_lon': self.stop_lon.ravel(),
+            'shape_pt_sequence': np.tile(np.arange(1, self.stops_per_trip + 1), self.routes),
+        })
+        start, end = (today - timedelta(days=30)).strftime("%Y%m%d"), (today + timedelta(days=30)).strftime("%Y%m%d")
+        tables = {
+            'agency.txt': pd.DataFrame([{'agency_id': '1', 'agency_name': 'Syntetyczny przewoźnik',
+                                         'agency_url': 'http://localhost', 'agency_timezone': str(self.timezone),
+                                         'agency_phone': None, 'agency_lang': 'pl'}]),
+            'stops.txt': stops,
+            'routes.txt': routes,
+            'trips.txt': trips,
+            'stop_times.txt': stop_times,
+            'calendar.txt': pd.DataFrame([{'service_id': 'S', 'monday': 1, 'tuesday': 1, 'wednesday': 1,
+                                           'thursday': 1, 'friday': 1, 'saturday': 1, 'sunday': 1,
+                                           'start_date': start, 'end_date': end}]),
+            'calendar_dates.txt': pd.DataFrame(columns=['service_id', 'date', 'exception_type']),
+            'shapes.txt': shapes,
+            'feed_info.txt': pd.DataFrame([{'feed_publisher_name': 'loadtest', 'feed_publisher_url': 'http://localhost',
+                                            'feed_lang': 'pl', 'feed_start_date': start, 'feed_end_date': end}]),
+        }
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, df in tables.items():
+                archive.writestr(name, df.to_csv(index=False))
+        return buffer.getvalue()
+
+    def vehicle_dictionary_csv(self) -> bytes:
+        return pd.DataFrame({'vehicle_id': [self.vehicle_id(v) for v in range(self.vehicles)],
+                             'model': 'Syntetyczny'}).to_csv(index=False).encode()
+
+    def feed(self, now: float, trip_updates: bool = True, vehicle_positions: bool = True) -> bytes:
+        """
+        Zwraca zserializowany FeedMessage ze stanem sieci w chwili `now` (epoch).
+        """
+        self.vehicle_delay = np.clip(self.vehicle_delay + self.rng.normal(0, 5, self.vehicles), -300, 1800)
+        elapsed = (now - self.started_at.timestamp() + self.vehicle_offset) % self.trip_seconds
+        position = elapsed / self.stop_interval_seconds
+        segment = np.minimum(position.astype(int), self.stops_per_trip - 2)
+        fraction = position - segment
+        lat = (self.stop_lat[self.vehicle_route, segment] * (1 - fraction)
+               + self.stop_lat[self.vehicle_route, segment + 1] * fraction)
+        lon = (self.stop_lon[self.vehicle_route, segment] * (1 - fraction)
+               + self.stop_lon[self.vehicle_route, segment + 1] * fraction)
+
+        message = FeedMessage()
+        message.header.gtfs_realtime_version = "2.0"
+        message.header.timestamp = int(now)
+        for v in range(self.vehicles):
+            route = int(self.vehicle_route[v])
+            delay = int(self.vehicle_delay[v])
+            if trip_updates:
+                entity = message.entity.add()
+                entity.id = self.trip_id(v)
+                update = entity.trip_update
+                update.trip.trip_id = self.trip_id(v)
+                update.trip.route_id = f"R{route}"
+                update.vehicle.id = self.vehicle_id(v)
+                update.timestamp = int(now)
+                update.delay = delay
+                stop_time = update.stop_time_update.add()
+                stop_time.stop_sequence = int(segment[v]) + 2
+                stop_time.stop_id = self.stop_id(route, int(segment[v]) + 1)
+                stop_time.arrival.delay = delay
+                stop_time.departure.delay = delay
+            if vehicle_positions:
+                entity = message.entity.add()
+                entity.id = self.vehicle_id(v)
+                vehicle = entity.vehicle
+                vehicle.trip.trip_id = self.trip_id(v)
+                vehicle.vehicle.id = self.vehicle_id(v)
+                vehicle.position.latitude = float(lat[v])
+                vehicle.position.longitude = float(lon[v])
+                vehicle.position.speed = 8.0
+                vehicle.timestamp = int(now)
+        return message.SerializeToString()
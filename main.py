@@ -1,49 +1,120 @@
 import asyncio
 import argparse
+import copy
+import multiprocessing
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING
 from loguru import logger
 from utils.logging_config import configure_logging
-from data_acquisition.dynamic.fetch_dynamic import DynamicDataFetcher
-from data_acquisition.static.fetch_static import StaticDataFetcher
-from etl.transform_pb_to_parquet import TransformPbToParquet, TransformPbToParquetConfig
-from data_loading.load_to_db import DataLoader
-from config import CONFIG
+from utils.notifications import ParquetReadyNotifier
+from utils.pipeline import StageQueue, monitor_queues
+from utils.tracing import configure_tracing
+from utils.leases import default_worker_id
+from config import DEFAULT_CONFIG_PATH, load_config
+
+# Moduły z ciężkimi zależnościami (pandas, SQLAlchemy, protobuf, aiohttp) są importowane
+# dopiero wtedy, gdy są włączone - proces samego fetchera startuje bez nich
+if TYPE_CHECKING:
+    from data_loading.load_to_db import DataLoader
+    from live.state_store import LiveStateStore
+
+# Moduły, które w trybie wieloprocesowym działają tylko w pierwszym procesie
+SINGLETON_MODULES = ('fetch_dynamic', 'fetch_static')
 
 async def main_async(config, modules_to_run):
     modules_config = config.get('modules', {})
     tasks = []
     data_loader = None
+    notifier = ParquetReadyNotifier()
 
     if modules_to_run:
         for module in modules_config.keys():
             modules_config[module] = module in modules_to_run
 
+    # Kolejki między etapami działającymi w tym procesie; pliki na dysku pozostają
+    # trwałą warstwą, do której etapy wracają przy przeglądzie katalogów
+    pipeline_config = config.get('pipeline', {})
+    pipeline_enabled = pipeline_config.get('enabled', False)
+    queues = []
+    folder_queue = parquet_queue = None
+    if pipeline_enabled and modules_config.get('fetch_dynamic', False) and modules_config.get('etl', False):
+        folder_queue = StageQueue.from_config(config, 'folders', policy='drop_oldest')
+        queues.append(folder_queue)
+    if pipeline_enabled and modules_config.get('etl', False) and modules_config.get('load_to_db', False):
+        parquet_queue = StageQueue.from_config(config, 'parquet', policy='block')
+        queues.append(parquet_queue)
+
     if modules_config.get('fetch_dynamic', False):
-        dynamic_fetcher = DynamicDataFetcher(config)
+        from data_acquisition.dynamic.fetch_dynamic import DynamicDataFetcher
+        live_config = config.get('live', {})
+        state_store = live_queue = None
+        if live_config.get('enabled', False):
+            from live.state_store import LiveStateStore
+            state_store = LiveStateStore(max_age_seconds=live_config.get('max_age_seconds', 600))
+            http_config = live_config.get('http', {})
+            if http_config.get('enabled', False):
+                from live.http_server import LiveStateServer
+                live_server = LiveStateServer(state_store, host=http_config.get('host', '127.0.0.1'),
+                                              port=http_config.get('port', 8085))
+                tasks.append(asyncio.create_task(live_server.run()))
+            if pipeline_enabled:
+                # Dla stanu bieżącego liczy się tylko najnowszy snapshot każdego kanału
+                live_queue = StageQueue.from_config(config, 'live', key=lambda item: item[0], policy='coalesce')
+                queues.append(live_queue)
+                tasks.append(asyncio.create_task(apply_live_updates(live_queue, state_store)))
+        dynamic_fetcher = DynamicDataFetcher(config, state_store=state_store, live_queue=live_queue,
+                                             folder_queue=folder_queue)
         tasks.append(asyncio.create_task(dynamic_fetcher.run()))
         logger.info("Moduł 'fetch_dynamic' został uruchomiony.")
 
     if modules_config.get('fetch_static', False):
+        from data_acquisition.static.fetch_static import StaticDataFetcher
         static_fetcher = StaticDataFetcher(config)
         tasks.append(asyncio.create_task(static_fetcher.run()))
         logger.info("Moduł 'fetch_static' został uruchomiony.")
 
     if modules_config.get('etl', False):
+        from etl.transform_pb_to_parquet import TransformPbToParquet, TransformPbToParquetConfig
         etl_config = TransformPbToParquetConfig(config)
-        etl_module = TransformPbToParquet(etl_config)
+        etl_module = TransformPbToParquet(etl_config, notifier=notifier, folder_queue=folder_queue,
+                                          parquet_queue=parquet_queue)
         tasks.append(asyncio.create_task(etl_module.run()))
         logger.info("Moduł 'etl' został uruchomiony.")
 
     if modules_config.get('load_to_db', False):
-        data_loader = DataLoader(config)
-        tasks.append(asyncio.create_task(run_data_loader(data_loader)))
+        if config.get('loader', {}).get('mode', 'sync') == 'async':
+            from data_loading.async_loader import AsyncDataLoader
+            data_loader = AsyncDataLoader(config, notifier=notifier, parquet_queue=parquet_queue)
+            tasks.append(asyncio.create_task(data_loader.run()))
+        else:
+            from data_loading.load_to_db import DataLoader
+            data_loader = DataLoader(config, parquet_queue=parquet_queue, loop=asyncio.get_running_loop())
+            tasks.append(asyncio.create_task(run_data_loader(data_loader)))
         logger.info("Moduł 'load_to_db' został uruchomiony.")
 
     if not tasks:
         logger.warning("Żaden moduł nie jest aktywny. Sprawdź konfigurację.")
         return
 
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', False):
+        from utils.metrics_server import MetricsServer
+        metrics_server = MetricsServer(host=metrics_config.get('host', '127.0.0.1'),
+                                       port=metrics_config.get('port', 9108))
+        tasks.append(asyncio.create_task(metrics_server.run()))
+
+    if queues:
+        tasks.append(asyncio.create_task(
+            monitor_queues(queues, pipeline_config.get('lag_check_interval_seconds', 30))))
+
     try:
         await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        logger.info("Zatrzymywanie modułów (anulowanie zadań).")
+        if data_loader:
+            data_loader.stop()
+        raise
     except KeyboardInterrupt:
         logger.info("Zatrzymano aplikację przez użytkownika (KeyboardInterrupt).")
         if data_loader:
@@ -55,26 +126,120 @@ async def main_async(config, modules_to_run):
     finally:
         logger.info("Zakończono działanie main_async.")
 
-async def run_data_loader(data_loader: DataLoader):
+async def run_data_loader(data_loader: "DataLoader"):
     await asyncio.to_thread(data_loader.run)
 
-def main():
-    parser = argparse.ArgumentParser(description="Projekt Bimba - Pobieranie Danych")
-    parser.add_argument('--config', type=str, default='config/config.yaml', help='Ścieżka do pliku konfiguracyjnego')
-    parser.add_argument('--modules', nargs='*', help='Lista modułów do uruchomienia (opcjonalnie)')
-    args = parser.parse_args()
+async def apply_live_updates(live_queue: StageQueue, state_store: "LiveStateStore"):
+    while True:
+        for key, data in await live_queue.get_batch():
+            try:
+                await asyncio.to_thread(state_store.apply_feed, data)
+            except Exception as e:
+                logger.exception(f"Błąd aktualizacji stanu bieżącego ({key}): {e}")
 
-    config = CONFIG
+def setup_logging(config: dict):
     log_file = config['logging']['file']
     log_level = config['logging']['level']
     log_rotation = config['logging'].get('rotation', "10 MB")
     log_compression = config['logging'].get('compression', "zip")
-    configure_logging(log_file, log_level, rotation=log_rotation, compression=log_compression)
+    configure_logging(log_file, log_level, rotation=log_rotation, compression=log_compression,
+                      mode=config['logging'].get('mode', "development"),
+                      production=config['logging'].get('production'))
+    configure_tracing(config)
+
+def worker_config(config: dict, index: int) -> dict:
+    """
+    Konfiguracja `index`-tego procesu workera: tryb dzierżaw, własny plik logów
+    i port metryk (kolejne od bazowego).
+    """
+    config = copy.deepcopy(config)
+    workers_config = config.setdefault('workers', {})
+    workers_config['enabled'] = True
+    if workers_config.get('worker_id'):
+        workers_config['worker_id'] = f"{workers_config['worker_id']}-{index}"
+    log_file = config['logging']['file']
+    config['logging']['file'] = log_file.replace('.log', f".{index}.log") if log_file.endswith('.log') \
+        else f"{log_file}.{index}"
+    if 'port' in config.get('metrics', {}):
+        config['metrics']['port'] += index
+    return config
+
+def run_worker(config: dict, modules):
+    setup_logging(config)
+    logger.info(f"Worker {config['workers'].get('worker_id') or default_worker_id()}: moduły {modules}.")
+    try:
+        asyncio.run(main_async(config, modules))
+    except KeyboardInterrupt:
+        pass
+
+def run_worker_processes(config: dict, modules_to_run, processes: int):
+    """
+    Uruchamia wybrane moduły w `processes` osobnych procesach dzielących pracę przez
+    dzierżawy. Fetchery działają tylko w pierwszym procesie, ETL i loader - w każdym.
+    """
+    modules = list(modules_to_run or [name for name, enabled in config.get('modules', {}).items() if enabled])
+    scalable = [module for module in modules if module not in SINGLETON_MODULES]
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for index in range(processes):
+        worker_modules = modules if index == 0 else scalable
+        if not worker_modules:
+            continue
+        worker = context.Process(target=run_worker, args=(worker_config(config, index), worker_modules),
+                                 name=f"bimba-worker-{index}")
+        worker.start()
+        workers.append(worker)
+    logger.info(f"Uruchomiono {len(workers)} procesów workerów.")
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Projekt Bimba - Pobieranie Danych")
+    parser.add_argument('--config', type=str, default=str(DEFAULT_CONFIG_PATH),
+                        help='Ścieżka do pliku konfiguracyjnego (domyślnie config/config.yaml)')
+    parser.add_argument('--modules', nargs='*', help='Lista modułów do uruchomienia (opcjonalnie)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Liczba procesów workerów (ETL i loader w każdym, fetchery w pierwszym)')
+    parser.add_argument('--worker-id', type=str, help='Identyfikator workera w dzierżawach (domyślnie host-pid)')
+    subparsers = parser.add_subparsers(dest='command')
+    backfill_parser = subparsers.add_parser('backfill', help='Ponowne przetworzenie historycznych snapshotów')
+    backfill_parser.add_argument('--start', type=date.fromisoformat, required=True,
+                                 help='Pierwsza doba (UTC, RRRR-MM-DD)')
+    backfill_parser.add_argument('--end', type=date.fromisoformat, required=True,
+                                 help='Ostatnia doba (UTC, RRRR-MM-DD, włącznie)')
+    backfill_parser.add_argument('--source', type=Path, nargs='+', required=True,
+                                 help='Katalogi surowych danych lub archiwa (.zip, .tar, .tar.gz) ze snapshotami .pb')
+    backfill_parser.add_argument('--feeds', nargs='+', help='Kanały do przetworzenia (domyślnie kanał wejściowy ETL)')
+    backfill_parser.add_argument('--run-name', type=str, help='Nazwa przebiegu (katalog wyników i punktów kontrolnych)')
+    backfill_parser.add_argument('--workers', type=int, help='Procesy dekodujące (domyślnie backfill.workers lub liczba rdzeni)')
+    backfill_parser.add_argument('--load-workers', type=int, help='Wątki ładujące do bazy')
+    backfill_parser.add_argument('--version-id', type=int, help='Wersja danych statycznych (domyślnie bieżąca)')
+    backfill_parser.add_argument('--no-load', action='store_true', help='Tylko dekodowanie i zapis Parquet')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.worker_id:
+        config.setdefault('workers', {})['worker_id'] = args.worker_id
+    setup_logging(config)
 
     logger.info("Aplikacja rozpoczęła działanie.")
 
+    if args.command == 'backfill':
+        from etl.backfill import run_backfill
+        run_backfill(config, args)
+        return
+
     try:
-        asyncio.run(main_async(config, args.modules))
+        if args.processes > 1:
+            run_worker_processes(config, args.modules, args.processes)
+        else:
+            asyncio.run(main_async(config, args.modules))
     except KeyboardInterrupt:
         logger.info("Zatrzymano aplikację przez użytkownika.")
     except Exception as e:
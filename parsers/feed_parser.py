@@ -0,0 +1,35 @@
+# parsers/feed_parser.py
+
+from typing import Dict, List
+
+from etl.gtfs_realtime_pb2 import FeedMessage
+from parsers.trip_update_parser import TripUpdateParser
+from parsers.alert_parser import AlertParser
+from parsers.vehicle_position_parser import VehiclePositionParser
+
+
+def parse_feed(pb_data: bytes) -> Dict[str, List[dict]]:
+    """
+    Dekoduje komunikat GTFS-Realtime i rozdziela encje na trip updates, pozycje pojazdów i alerty.
+    """
+    feed_message = FeedMessage()
+    feed_message.ParseFromString(pb_data)
+
+    trip_updates = []
+    vehicle_positions = []
+    alerts = []
+
+    for entity in feed_message.entity:
+        base_data = {"entity_id": entity.id, "is_deleted": entity.is_deleted}
+        if entity.HasField("trip_update"):
+            trip_updates.extend(TripUpdateParser.parse(base_data, entity.trip_update))
+        if entity.HasField("vehicle"):
+            vehicle_positions.append(VehiclePositionParser.parse(base_data, entity.vehicle))
+        if entity.HasField("alert"):
+            alerts.extend(AlertParser.parse(base_data, entity.alert))
+
+    return {
+        "trip_updates": trip_updates,
+        "vehicle_positions": vehicle_positions,
+        "alerts": alerts
+    }
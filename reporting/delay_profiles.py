@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, Optional
+import pandas as pd
+from sqlalchemy import create_engine, text
+from loguru import logger
+
+from reporting.delay_report import DelayReportBuilder
+
+PROFILE_COLUMNS = """
+    r.trip_id, r.stop_sequence, r.arrival_delay, r.stop_id, r.stop_name,
+    r.route_id, r.route_short_name, r.direction_id, r.trip_headsign,
+    r.trip_start_time, r.trip_end_time, r.arrival_time, r.local_timestamp,
+    a.delay_sum::float / NULLIF(a.delay_count, 0) AS route_stop_avg_delay
+"""
+
+PROFILE_FROM = """
+    FROM delay_report r
+    LEFT JOIN delay_report_route_stop_agg a
+        ON a.service_day = r.service_day AND a.route_id = r.route_id AND a.stop_id = r.stop_id
+"""
+
+TRIP_PROFILE_QUERY = text(f"""
+    SELECT {PROFILE_COLUMNS} {PROFILE_FROM}
+    WHERE r.service_day = :service_day AND r.trip_id = :trip_id
+    ORDER BY r.stop_sequence, r.local_timestamp;
+""")
+
+ROUTE_PROFILE_QUERY = text(f"""
+    SELECT {PROFILE_COLUMNS} {PROFILE_FROM}
+    WHERE r.service_day = :service_day AND r.route_id = :route_id
+      AND (CAST(:direction_id AS INT) IS NULL OR r.direction_id = :direction_id)
+    ORDER BY r.trip_id, r.stop_sequence, r.local_timestamp;
+""")
+
+DAY_REFRESHED_QUERY = text("SELECT refreshed_at FROM delay_report_days WHERE service_day = :service_day;")
+
+
+class TTLCache:
+    """
+    Pamięć podręczna LRU z czasem życia wpisów. Bezpieczna dla wielu wątków.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DelayProfileService:
+    """
+    Profile opóźnień kursu i linii z przyrostowego raportu delay_report, z pamięcią
+    podręczną LRU/TTL kluczowaną (rodzaj, kurs/linia, kierunek, doba).
+
+    Zapytania są parametryzowane (bez składania SQL z identyfikatorów). `prefetch_route`
+    pobiera jednym zapytaniem całą linię i wypełnia pamięć dla wszystkich jej kursów.
+    Wpisy doby są unieważniane, gdy raport tej doby zostanie przeliczony: od razu, jeśli
+    serwis dostał DelayReportBuilder przeliczający raport w tym samym procesie (nasłuch),
+    a poza nim (notatniki) po sprawdzeniu znacznika delay_report_days najwyżej co
+    `revalidate_seconds`.
+    """
+
+    def __init__(self, engine, report_builder: Optional[DelayReportBuilder] = None,
+                 max_entries: int = 1024, ttl_seconds: float = 300.0, revalidate_seconds: float = 5.0):
+        self.engine = engine
+        self.cache = TTLCache(max_entries, ttl_seconds)
+        self.revalidate_seconds = revalidate_seconds
+        # doba -> (znacznik odświeżenia raportu, czas ostatniego sprawdzenia)
+        self._day_versions: Dict[date, tuple] = {}
+        if report_builder is not None:
+            report_builder.add_refresh_listener(self.invalidate_day)
+
+    @classmethod
+    def from_config(cls, config: dict, report_builder: Optional[DelayReportBuilder] = None,
+                    engine=None) -> "DelayProfileService":
+        cache_config = config.get('reporting', {}).get('profile_cache', {})
+        return cls(engine if engine is not None else create_engine(config['database']['uri']),
+                   report_builder=report_builder,
+                   max_entries=cache_config.get('max_entries', 1024),
+                   ttl_seconds=cache_config.get('ttl_seconds', 300.0),
+                   revalidate_seconds=cache_config.get('revalidate_seconds', 5.0))
+
+    def trip_profile(self, trip_id: str, service_day: date) -> pd.DataFrame:
+        """
+        Zwraca opóźnienia kursu na kolejnych przystankach doby `service_day`
+        wraz ze średnią linii na przystanku.
+        """
+        self._revalidate(service_day)
+        key = ('trip', trip_id, None, service_day)
+        profile = self.cache.get(key)
+        if profile is None:
+            profile = self._query(TRIP_PROFILE_QUERY, {'service_day': service_day, 'trip_id': trip_id})
+            self.cache.put(key, profile)
+        return profile
+
+    def route_profile(self, route_id: str, service_day: date, direction_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Zwraca opóźnienia wszystkich kursów linii (opcjonalnie w jednym kierunku) w dobie.
+        """
+        self._revalidate(service_day)
+        key = ('route', route_id, direction_id, service_day)
+        profile = self.cache.get(key)
+        if profile is None:
+            profile = self.prefetch_route(route_id, service_day, direction_id)
+        return profile
+
+    def prefetch_route(self, route_id: str, service_day: date, direction_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Pobiera jednym zapytaniem profil linii i zapisuje w pamięci także profile jej kursów.
+        """
+        profile = self._query(ROUTE_PROFILE_QUERY, {'service_day': service_day, 'route_id': route_id,
+                                                    'direction_id': direction_id})
+        self.cache.put(('route', route_id, direction_id, service_day), profile)
+        for trip_id, trip_profile in profile.groupby('trip_id', sort=False):
+            self.cache.put(('trip', trip_id, None, service_day), trip_profile.reset_index(drop=True))
+        logger.debug(f"Wczytano profil linii {route_id} ({service_day}): {profile['trip_id'].nunique()} kursów.")
+        return profile
+
+    def invalidate_day(self, service_day: date):
+        removed = self.cache.invalidate(lambda key: key[3] == service_day)
+        self._day_versions.pop(service_day, None)
+        if removed:
+            logger.debug(f"Unieważniono {removed} profili opóźnień doby {service_day}.")
+
+    def _revalidate(self, service_day: date):
+        now = time.monotonic()
+        known = self._day_versions.get(service_day)
+        if known is not None and now - known[1] < self.revalidate_seconds:
+            return
+        with self.engine.connect() as conn:
+            refreshed_at = conn.execute(DAY_REFRESHED_QUERY, {'service_day': service_day}).scalar()
+        if known is not None and known[0] != refreshed_at:
+            self.invalidate_day(service_day)
+        self._day_versions[service_day] = (refreshed_at, now)
+
+    def _query(self, query, params: dict) -> pd.DataFrame:
+        with self.engine.connect() as conn:
+            df = pd.read_sql(query, conn, params=params)
+        if not df.empty:
+            df['local_timestamp'] = pd.to_datetime(df['local_timestamp'])
+        return df
@@ -0,0 +1,277 @@
+from datetime import date, timedelta
+from typing import Callable, Iterable, List, Optional
+import pandas as pd
+from sqlalchemy import text
+from loguru import logger
+
+from utils.service_day import service_day_bounds, service_days_of
+
+# Wiersze raportu dla kursów z listy pending w jednej dobie przewozowej.
+# Odpowiednik SQL/create_full_trip_view_plus_avg.sql bez średnich liczonych oknami -
+# średnie trzymane są osobno jako sumy i liczności (delay_report_route_stop_agg).
+# Pozycja pojazdu jest dołączana do trip_updates już w ETL (etl/trip_vehicle_join.py).
+REPORT_ROWS_QUERY = """
+    SELECT
+        CAST(:service_day AS DATE) AS service_day,
+        t.vehicle_id AS entity_id,
+        t.trip_id,
+        tr.route_id,
+        r.route_short_name,
+        t.stop_sequence,
+        t.arrival_delay,
+        (to_timestamp(t.timestamp) AT TIME ZONE :timezone) AS local_timestamp,
+        t.latitude,
+        t.longitude,
+        stt.stop_id,
+        s.stop_name,
+        stt.arrival_time,
+        stt.departure_time,
+        tr.service_id,
+        r.route_type,
+        t.version_id,
+        c.start_date AS service_start_date,
+        c.end_date AS service_end_date,
+        tr.direction_id,
+        tr.trip_headsign,
+        MIN(stt.arrival_time) OVER (PARTITION BY t.trip_id) AS trip_start_time,
+        MAX(stt.departure_time) OVER (PARTITION BY t.trip_id) AS trip_end_time
+    FROM trip_updates t
+    JOIN pending_report_trips p ON p.trip_id = t.trip_id
+    JOIN trips tr ON t.trip_id = tr.trip_id AND static_row_visible(tr.version_id, tr.valid_to_version, t.version_id)
+    JOIN routes r ON tr.route_id = r.route_id AND static_row_visible(r.version_id, r.valid_to_version, t.version_id)
+    JOIN stop_times stt ON t.trip_id = stt.trip_id AND t.stop_sequence = stt.stop_sequence
+        AND static_row_visible(stt.version_id, stt.valid_to_version, t.version_id)
+    LEFT JOIN calendar c ON tr.service_id = c.service_id AND static_row_visible(c.version_id, c.valid_to_version, t.version_id)
+    LEFT JOIN stops s ON stt.stop_id = s.stop_id AND static_row_visible(s.version_id, s.valid_to_version, t.version_id)
+    WHERE t.timestamp >= :day_start AND t.timestamp < :day_end
+"""
+
+
+class DelayReportBuilder:
+    """
+    Utrzymuje przyrostowo raport opóźnień (delay_report) partycjonowany po dobie przewozowej.
+
+    Loader zgłasza kursy dotknięte nowymi danymi (mark_trips), a refresh_pending
+    przelicza tylko te kursy w ich dobach oraz agregaty linii, do których należą.
+    Średnie linia/przystanek są przechowywane jako (suma, liczność), więc łączą się
+    dla dowolnego zakresu dat bez przebudowy raportu.
+    """
+
+    def __init__(self, engine, timezone: str = "Europe/Warsaw", day_start_hour: int = 4):
+        self.engine = engine
+        self.timezone = timezone
+        self.day_start_hour = day_start_hour
+        self.refresh_listeners: List[Callable[[date], None]] = []
+
+    def add_refresh_listener(self, listener: Callable[[date], None]):
+        """
+        Rejestruje funkcję wywoływaną z dobą po każdym przeliczeniu raportu tej doby.
+        """
+        self.refresh_listeners.append(listener)
+
+    def create_tables_if_not_exists(self):
+        create_statements = [
+            """
+            CREATE TABLE IF NOT EXISTS public.report_pending_trips (
+                service_day DATE NOT NULL,
+                trip_id TEXT NOT NULL,
+                PRIMARY KEY (service_day, trip_id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.delay_report (
+                service_day DATE NOT NULL,
+                entity_id TEXT,
+                trip_id TEXT NOT NULL,
+                route_id TEXT,
+                route_short_name TEXT,
+                stop_sequence INT,
+                arrival_delay INT,
+                local_timestamp TIMESTAMP,
+                latitude DOUBLE PRECISION,
+                longitude DOUBLE PRECISION,
+                stop_id TEXT,
+                stop_name TEXT,
+                arrival_time TEXT,
+                departure_time TEXT,
+                service_id TEXT,
+                route_type INT,
+                version_id INT,
+                service_start_date DATE,
+                service_end_date DATE,
+                direction_id INT,
+                trip_headsign TEXT,
+                trip_start_time TEXT,
+                trip_end_time TEXT
+            ) PARTITION BY RANGE (service_day);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_delay_report_trip ON public.delay_report (service_day, trip_id, stop_sequence);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_delay_report_route_stop ON public.delay_report (service_day, route_id, stop_id);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.delay_report_route_stop_agg (
+                service_day DATE NOT NULL,
+                route_id TEXT NOT NULL,
+                stop_id TEXT NOT NULL,
+                delay_sum BIGINT NOT NULL,
+                delay_count BIGINT NOT NULL,
+                PRIMARY KEY (service_day, route_id, stop_id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.delay_report_days (
+                service_day DATE PRIMARY KEY,
+                refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """,
+        ]
+        with self.engine.begin() as conn:
+            for stmt in create_statements:
+                conn.execute(text(stmt))
+        logger.info("Tabele raportu opóźnień zostały utworzone (jeśli wcześniej nie istniały).")
+
+    def mark_trips(self, conn, df: pd.DataFrame):
+        """
+        Zapisuje (doba, kurs) z nowo załadowanych trip_updates do kolejki przeliczeń.
+        Wywoływane w transakcji loadera, razem ze wstawieniem danych.
+        """
+        if df.empty:
+            return
+        pending = pd.DataFrame({
+            'service_day': service_days_of(df['timestamp'], self.timezone, self.day_start_hour),
+            'trip_id': df['trip_id'],
+        }).drop_duplicates()
+        conn.execute(
+            text("""
+                INSERT INTO report_pending_trips (service_day, trip_id)
+                VALUES (:service_day, :trip_id)
+                ON CONFLICT DO NOTHING;
+            """),
+            pending.to_dict('records'),
+        )
+
+    def refresh_pending(self) -> List[date]:
+        """
+        Przelicza wszystkie doby, w których są kursy oczekujące na przeliczenie.
+        """
+        with self.engine.connect() as conn:
+            days = [row[0] for row in conn.execute(text(
+                "SELECT DISTINCT service_day FROM report_pending_trips ORDER BY service_day;"
+            ))]
+        for day in days:
+            self.refresh_day(day)
+        return days
+
+    def refresh_day(self, day: date, trip_ids: Optional[Iterable[str]] = None):
+        """
+        Przelicza wiersze raportu dla kursów oczekujących w dobie `day` (lub podanych `trip_ids`)
+        oraz agregaty linii, do których należą.
+        """
+        day_start, day_end = service_day_bounds(day, self.timezone, self.day_start_hour)
+        params = {'service_day': day, 'day_start': day_start, 'day_end': day_end, 'timezone': self.timezone}
+        with self.engine.begin() as conn:
+            self._ensure_partition(conn, day)
+            conn.execute(text("CREATE TEMPORARY TABLE pending_report_trips (trip_id TEXT PRIMARY KEY) ON COMMIT DROP;"))
+            if trip_ids is None:
+                conn.execute(text("""
+                    WITH taken AS (
+                        DELETE FROM report_pending_trips WHERE service_day = :service_day RETURNING trip_id
+                    )
+                    INSERT INTO pending_report_trips SELECT DISTINCT trip_id FROM taken;
+                """), params)
+            else:
+                conn.execute(text("INSERT INTO pending_report_trips (trip_id) VALUES (:trip_id) ON CONFLICT DO NOTHING;"),
+                             [{'trip_id': trip_id} for trip_id in trip_ids])
+
+            # Linie, których agregaty trzeba przeliczyć: dotychczasowe i nowe przypisanie kursów
+            conn.execute(text("""
+                CREATE TEMPORARY TABLE pending_report_routes ON COMMIT DROP AS
+                SELECT DISTINCT route_id FROM delay_report
+                WHERE service_day = :service_day AND trip_id IN (SELECT trip_id FROM pending_report_trips);
+            """), params)
+            conn.execute(text("""
+                DELETE FROM delay_report
+                WHERE service_day = :service_day AND trip_id IN (SELECT trip_id FROM pending_report_trips);
+            """), params)
+            inserted = conn.execute(text(f"INSERT INTO delay_report {REPORT_ROWS_QUERY};"), params).rowcount
+            conn.execute(text("""
+                INSERT INTO pending_report_routes
+                SELECT DISTINCT route_id FROM delay_report
+                WHERE service_day = :service_day AND trip_id IN (SELECT trip_id FROM pending_report_trips);
+            """), params)
+
+            conn.execute(text("""
+                DELETE FROM delay_report_route_stop_agg
+                WHERE service_day = :service_day AND route_id IN (SELECT route_id FROM pending_report_routes);
+            """), params)
+            conn.execute(text("""
+                INSERT INTO delay_report_route_stop_agg (service_day, route_id, stop_id, delay_sum, delay_count)
+                SELECT service_day, route_id, stop_id, SUM(arrival_delay), COUNT(arrival_delay)
+                FROM delay_report
+                WHERE service_day = :service_day
+                  AND route_id IN (SELECT route_id FROM pending_report_routes)
+                  AND stop_sequence > 0
+                  AND arrival_delay IS NOT NULL
+                GROUP BY service_day, route_id, stop_id;
+            """), params)
+            conn.execute(text("""
+                INSERT INTO delay_report_days (service_day, refreshed_at) VALUES (:service_day, clock_timestamp())
+                ON CONFLICT (service_day) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at;
+            """), params)
+        logger.info(f"Przeliczono raport opóźnień dla doby {day}: {inserted} wierszy.")
+        for listener in self.refresh_listeners:
+            listener(day)
+
+    def rebuild_range(self, start_day: date, end_day: date):
+        """
+        Przelicza od zera wszystkie kursy w dobach [start_day, end_day] (np. po zmianie logiki raportu).
+        """
+        day = start_day
+        while day <= end_day:
+            day_start, day_end = service_day_bounds(day, self.timezone, self.day_start_hour)
+            with self.engine.connect() as conn:
+                trip_ids = [row[0] for row in conn.execute(text("""
+                    SELECT DISTINCT trip_id FROM trip_updates WHERE timestamp >= :day_start AND timestamp < :day_end;
+                """), {'day_start': day_start, 'day_end': day_end})]
+            if trip_ids:
+                self.refresh_day(day, trip_ids)
+            day += timedelta(days=1)
+
+    def route_stop_averages(self, start_day: date, end_day: date) -> pd.DataFrame:
+        """
+        Zwraca średnie opóźnienie linii oraz linii na przystanku dla zakresu dób [start_day, end_day].
+        """
+        query = text("""
+            SELECT route_id, stop_id,
+                   SUM(delay_sum)::float / NULLIF(SUM(delay_count), 0) AS route_stop_avg_delay,
+                   SUM(SUM(delay_sum)) OVER (PARTITION BY route_id)::float
+                       / NULLIF(SUM(SUM(delay_count)) OVER (PARTITION BY route_id), 0) AS route_avg_delay
+            FROM delay_report_route_stop_agg
+            WHERE service_day BETWEEN :start_day AND :end_day
+            GROUP BY route_id, stop_id;
+        """)
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn, params={'start_day': start_day, 'end_day': end_day})
+
+    def report(self, start_day: date, end_day: date) -> pd.DataFrame:
+        """
+        Zwraca wiersze raportu z zakresu dób wraz ze średnimi (kolumny jak w daily_report).
+        """
+        query = text("""
+            SELECT * FROM delay_report
+            WHERE service_day BETWEEN :start_day AND :end_day
+            ORDER BY trip_id, local_timestamp, stop_sequence;
+        """)
+        with self.engine.connect() as conn:
+            rows = pd.read_sql(query, conn, params={'start_day': start_day, 'end_day': end_day})
+        return rows.merge(self.route_stop_averages(start_day, end_day), on=['route_id', 'stop_id'], how='left')
+
+    @staticmethod
+    def _ensure_partition(conn, day: date):
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS public.delay_report_p{day:%Y%m%d} PARTITION OF public.delay_report
+            FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}');
+        """))
@@ -0,0 +1,196 @@
+from datetime import date
+from typing import Dict, Optional, Sequence
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from loguru import logger
+
+from utils.service_day import service_days_of
+
+# Histogram opóźnień: kubełki co BUCKET_SECONDS w zakresie [MIN_DELAY, MAX_DELAY],
+# wartości spoza zakresu trafiają do skrajnych kubełków.
+BUCKET_SECONDS = 30
+MIN_DELAY = -1800
+MAX_DELAY = 3600
+
+
+class DelayRollups:
+    """
+    Agregaty opóźnień per (doba, linia, przystanek, kierunek, godzina) aktualizowane
+    z każdej wstawionej paczki trip_updates.
+
+    Trzymane są liczność, suma i suma kwadratów (średnia, odchylenie) oraz histogram
+    w kubełkach co 30 s (percentyle). Wszystkie wartości są addytywne, więc agregaty
+    łączą się dla dowolnego zakresu dób, linii czy godzin jednym GROUP BY.
+    """
+
+    def __init__(self, engine, timezone: str = "Europe/Warsaw", day_start_hour: int = 4):
+        self.engine = engine
+        self.timezone = timezone
+        self.day_start_hour = day_start_hour
+
+    def create_tables_if_not_exists(self):
+        create_statements = [
+            """
+            CREATE TABLE IF NOT EXISTS public.delay_rollup (
+                service_day DATE NOT NULL,
+                route_id TEXT NOT NULL,
+                stop_id TEXT NOT NULL,
+                direction_id INT NOT NULL,
+                hour SMALLINT NOT NULL,
+                delay_count BIGINT NOT NULL,
+                delay_sum BIGINT NOT NULL,
+                delay_sum_sq DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (service_day, route_id, stop_id, direction_id, hour)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.delay_rollup_hist (
+                service_day DATE NOT NULL,
+                route_id TEXT NOT NULL,
+                stop_id TEXT NOT NULL,
+                direction_id INT NOT NULL,
+                hour SMALLINT NOT NULL,
+                bucket SMALLINT NOT NULL,
+                delay_count BIGINT NOT NULL,
+                PRIMARY KEY (service_day, route_id, stop_id, direction_id, hour, bucket)
+            );
+            """,
+        ]
+        with self.engine.begin() as conn:
+            for stmt in create_statements:
+                conn.execute(text(stmt))
+        logger.info("Tabele agregatów opóźnień zostały utworzone (jeśli wcześniej nie istniały).")
+
+    def update(self, conn, df: pd.DataFrame):
+        """
+        Dolicza paczkę nowo wstawionych trip_updates do agregatów.
+        Wywoływane w transakcji loadera, więc paczka jest liczona dokładnie raz.
+        """
+        batch = df[df['arrival_delay'].notna() & (df['stop_sequence'] > 0)]
+        if batch.empty:
+            return
+        local = pd.to_datetime(batch['timestamp'], unit='s', utc=True).dt.tz_convert(self.timezone)
+        batch = pd.DataFrame({
+            'service_day': service_days_of(batch['timestamp'], self.timezone, self.day_start_hour),
+            'hour': local.dt.hour,
+            'trip_id': batch['trip_id'],
+            'stop_sequence': batch['stop_sequence'],
+            'stop_id': batch['stop_id'] if 'stop_id' in batch else None,
+            'arrival_delay': batch['arrival_delay'].astype('int64'),
+            'bucket': self.bucket_of(batch['arrival_delay'].to_numpy()),
+            'version_id': batch['version_id'],
+        })
+
+        conn.execute(text("""
+            CREATE TEMPORARY TABLE rollup_batch (
+                service_day DATE, hour SMALLINT, trip_id TEXT, stop_sequence INT, stop_id TEXT,
+                arrival_delay INT, bucket SMALLINT, version_id INT
+            ) ON COMMIT DROP;
+        """))
+        batch.to_sql('rollup_batch', conn, if_exists='append', index=False)
+        # Linia i kierunek z kursu, przystanek z rozkładu, jeśli feed go nie podał
+        conn.execute(text("""
+            CREATE TEMPORARY TABLE rollup_keyed ON COMMIT DROP AS
+            SELECT b.service_day, tr.route_id, COALESCE(b.stop_id, stt.stop_id) AS stop_id,
+                   COALESCE(tr.direction_id, -1) AS direction_id, b.hour, b.arrival_delay, b.bucket
+            FROM rollup_batch b
+            JOIN trips tr ON tr.trip_id = b.trip_id
+                AND static_row_visible(tr.version_id, tr.valid_to_version, b.version_id)
+            LEFT JOIN stop_times stt ON stt.trip_id = b.trip_id AND stt.stop_sequence = b.stop_sequence
+                AND static_row_visible(stt.version_id, stt.valid_to_version, b.version_id)
+            WHERE COALESCE(b.stop_id, stt.stop_id) IS NOT NULL;
+        """))
+        conn.execute(text("""
+            INSERT INTO delay_rollup (service_day, route_id, stop_id, direction_id, hour,
+                                      delay_count, delay_sum, delay_sum_sq)
+            SELECT service_day, route_id, stop_id, direction_id, hour,
+                   COUNT(*), SUM(arrival_delay), SUM(arrival_delay::float * arrival_delay)
+            FROM rollup_keyed
+            GROUP BY service_day, route_id, stop_id, direction_id, hour
+            ON CONFLICT (service_day, route_id, stop_id, direction_id, hour) DO UPDATE
+            SET delay_count = delay_rollup.delay_count + EXCLUDED.delay_count,
+                delay_sum = delay_rollup.delay_sum + EXCLUDED.delay_sum,
+                delay_sum_sq = delay_rollup.delay_sum_sq + EXCLUDED.delay_sum_sq;
+        """))
+        conn.execute(text("""
+            INSERT INTO delay_rollup_hist (service_day, route_id, stop_id, direction_id, hour, bucket, delay_count)
+            SELECT service_day, route_id, stop_id, direction_id, hour, bucket, COUNT(*)
+            FROM rollup_keyed
+            GROUP BY service_day, route_id, stop_id, direction_id, hour, bucket
+            ON CONFLICT (service_day, route_id, stop_id, direction_id, hour, bucket) DO UPDATE
+            SET delay_count = delay_rollup_hist.delay_count + EXCLUDED.delay_count;
+        """))
+
+    def stats(self, start_day: date, end_day: date, group_by: Sequence[str] = ('route_id',),
+              route_id: Optional[str] = None, stop_id: Optional[str] = None,
+              direction_id: Optional[int] = None, hour: Optional[int] = None) -> pd.DataFrame:
+        """
+        Zwraca liczność, średnią i odchylenie standardowe opóźnienia dla zakresu dób,
+        pogrupowane po `group_by` (podzbiór route_id, stop_id, direction_id, hour).
+        """
+        where, params = self._filters(start_day, end_day, route_id, stop_id, direction_id, hour)
+        group_cols = ', '.join(self._check_group_by(group_by))
+        query = text(f"""
+            SELECT {group_cols},
+                   SUM(delay_count) AS delay_count,
+                   SUM(delay_sum)::float / SUM(delay_count) AS avg_delay,
+                   SQRT(GREATEST(SUM(delay_sum_sq) / SUM(delay_count)
+                                 - POWER(SUM(delay_sum)::float / SUM(delay_count), 2), 0)) AS std_delay
+            FROM delay_rollup
+            WHERE {where}
+            GROUP BY {group_cols}
+            ORDER BY {group_cols};
+        """)
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn, params=params)
+
+    def percentiles(self, start_day: date, end_day: date, quantiles: Sequence[float] = (0.5, 0.9, 0.99),
+                    route_id: Optional[str] = None, stop_id: Optional[str] = None,
+                    direction_id: Optional[int] = None, hour: Optional[int] = None) -> Dict[float, float]:
+        """
+        Zwraca percentyle opóźnienia (w sekundach, z dokładnością do kubełka) z histogramu.
+        """
+        where, params = self._filters(start_day, end_day, route_id, stop_id, direction_id, hour)
+        query = text(f"""
+            SELECT bucket, SUM(delay_count) AS delay_count
+            FROM delay_rollup_hist
+            WHERE {where}
+            GROUP BY bucket
+            ORDER BY bucket;
+        """)
+        with self.engine.connect() as conn:
+            hist = pd.read_sql(query, conn, params=params)
+        if hist.empty:
+            return {q: float('nan') for q in quantiles}
+        cumulative = hist['delay_count'].cumsum().to_numpy() / hist['delay_count'].sum()
+        buckets = hist['bucket'].to_numpy()
+        return {q: self.bucket_center(buckets[min(np.searchsorted(cumulative, q), len(buckets) - 1)])
+                for q in quantiles}
+
+    @staticmethod
+    def bucket_of(delays: np.ndarray) -> np.ndarray:
+        return (np.clip(delays, MIN_DELAY, MAX_DELAY) // BUCKET_SECONDS).astype(np.int16)
+
+    @staticmethod
+    def bucket_center(bucket: int) -> float:
+        return bucket * BUCKET_SECONDS + BUCKET_SECONDS / 2
+
+    @staticmethod
+    def _check_group_by(group_by: Sequence[str]) -> Sequence[str]:
+        allowed = {'route_id', 'stop_id', 'direction_id', 'hour', 'service_day'}
+        invalid = set(group_by) - allowed
+        if invalid or not group_by:
+            raise ValueError(f"Nieprawidłowe kolumny grupowania: {sorted(invalid) or group_by}")
+        return group_by
+
+    @staticmethod
+    def _filters(start_day, end_day, route_id, stop_id, direction_id, hour):
+        conditions = ["service_day BETWEEN :start_day AND :end_day"]
+        params = {'start_day': start_day, 'end_day': end_day}
+        for column, value in (('route_id', route_id), ('stop_id', stop_id),
+                              ('direction_id', direction_id), ('hour', hour)):
+            if value is not None:
+                conditions.append(f"{column} = :{column}")
+                params[column] = value
+        return ' AND '.join(conditions), params
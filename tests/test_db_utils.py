@@ -0,0 +1,41 @@
+import io
+from types import SimpleNamespace
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from utils.db_utils import copy_insert
+
+
+class _CopyCursor:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, sql, buffer):
+        self.sink.append((sql, buffer.read()))
+
+
+def test_copy_insert_writes_integers_for_blank_int_columns():
+    df = pd.read_csv(io.StringIO(
+        "trip_id,stop_sequence,pickup_type,shape_dist_traveled\n"
+        "t1,1,0,0.5\n"
+        "t1,2,,1.25\n"
+    ))
+    assert df['pickup_type'].dtype == 'float64'
+
+    copied = []
+    fake_conn = SimpleNamespace(connection=SimpleNamespace(cursor=lambda: _CopyCursor(copied)))
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        df.to_sql('stop_times', conn, index=False,
+                  method=lambda table, _, keys, data_iter: copy_insert(table, fake_conn, keys, data_iter))
+
+    sql, data = copied[0]
+    assert 'COPY stop_times ("trip_id", "stop_sequence", "pickup_type", "shape_dist_traveled")' in sql
+    assert data.splitlines() == ["t1,1,0,0.5", "t1,2,,1.25"]
@@ -0,0 +1,56 @@
+# utils/atomic_io.py
+
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+def fsync_dir(directory: Path):
+    """
+    Utrwala wpisy katalogu (utworzenie, zmiana nazwy pliku). Na systemach bez
+    katalogowego fsync (Windows) nic nie robi.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """
+    Zwraca ścieżkę pliku tymczasowego w katalogu docelowym. Po udanym zapisie plik
+    jest utrwalany (fsync) i podmieniany na `path` jednym `os.replace`, a wpis
+    katalogu utrwalany - czytelnik widzi stary plik albo cały nowy, nigdy urwany.
+    Przy błędzie plik tymczasowy jest usuwany.
+
+    Nazwa tymczasowa (.<nazwa>.<id>.tmp) nie pasuje do wzorców *.pb i *.parquet,
+    więc ETL i loader jej nie podejmą.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        yield tmp_path
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    fsync_dir(path.parent)
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """
+    Atomowy odpowiednik `Path.write_bytes` (plik tymczasowy, fsync, zmiana nazwy).
+    """
+    with atomic_path(path) as tmp_path:
+        tmp_path.write_bytes(data)
@@ -3,13 +3,20 @@
 from pathlib import Path
 import logging
 from datetime import datetime
+from typing import Callable, Optional
+
+from utils.atomic_io import atomic_write_bytes
+from utils.manifest import FOLDER_READY, Manifest
 
 logger = logging.getLogger(__name__)
 
 class FolderManager:
-    def __init__(self, base_dir: Path, max_files: int = 10):
+    def __init__(self, base_dir: Path, max_files: int = 10, on_done: Optional[Callable[[Path], None]] = None,
+                 manifest: Optional[Manifest] = None):
         self.base_dir = base_dir
         self.max_files = max_files
+        self.on_done = on_done
+        self.manifest = manifest
 
     def get_current_folder(self, category: str) -> Path:
         """
@@ -25,7 +32,7 @@ class FolderManager:
 
         # Sprawdź ostatni folder
         last_folder = subfolders[-1]
-        num_files = len([f for f in last_folder.iterdir() if f.is_file()])
+        num_files = len([f for f in last_folder.iterdir() if f.is_file() and f.suffix != '.tmp'])
         if num_files >= self.max_files:
             self._mark_folder_as_done(last_folder)
             return self._create_new_folder(category_dir)
@@ -43,7 +50,12 @@ class FolderManager:
     def _mark_folder_as_done(self, folder: Path):
         """
         Tworzy plik `.done` w folderze, aby oznaczyć go jako gotowy do przetwarzania.
+        Przejście trafia do manifestu przed znacznikiem, więc ETL czytający manifest
+        nie zgubi folderu, nawet gdy awaria nastąpi przed utworzeniem `.done`.
         """
-        done_file = folder / ".done"
-        done_file.touch()
-        logger.info(f"Folder marked as done: {folder}")
\ No newline at end of file
+        if self.manifest is not None:
+            self.manifest.record(FOLDER_READY, folder)
+        atomic_write_bytes(folder / ".done", b"")
+        logger.info("Folder marked as done: %s", folder)
+        if self.on_done is not None:
+            self.on_done(folder)
\ No newline at end of file
@@ -4,6 +4,8 @@ import json
 import logging
 from pathlib import Path
 
+from utils.atomic_io import atomic_write_bytes
+
 logger = logging.getLogger(__name__)
 
 class LastModifiedManager:
@@ -47,8 +49,7 @@ class LastModifiedManager:
         """
         file_path = self._get_file_path(key)
         try:
-            with open(file_path, 'w') as f:
-                json.dump(data, f)
+            atomic_write_bytes(file_path, json.dumps(data).encode())
             logger.debug(f"Dane zapisane w pliku: {file_path} ({len(data)} wpisów)")
         except Exception as e:
             logger.error(f"Nie udało się zapisać pliku {file_path}: {e}")
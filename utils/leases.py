@@ -0,0 +1,191 @@
+# utils/leases.py
+
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+
+from utils.metrics import REGISTRY
+
+LEASES_ACQUIRED = REGISTRY.counter('bimba_leases_acquired_total', 'Przejęte dzierżawy pracy', ('kind',))
+LEASES_EXPIRED = REGISTRY.counter('bimba_leases_expired_total',
+                                  'Dzierżawy przejęte po wygaśnięciu (martwy worker)', ('kind',))
+LEASES_HELD = REGISTRY.gauge('bimba_leases_held', 'Dzierżawy utrzymywane przez ten proces', ('kind',))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseManager:
+    """
+    Dzierżawy jednostek pracy (folder ETL, plik Parquet) na wspólnym dysku, dzięki
+    którym kilka procesów lub hostów dzieli pracę bez centralnego koordynatora.
+
+    Dzierżawa to plik `<lease_dir>/<nazwa>.lease` tworzony atomowo (O_CREAT | O_EXCL)
+    z identyfikatorem workera. Wątek w tle co `heartbeat_seconds` odświeża czas
+    modyfikacji utrzymywanych dzierżaw; dzierżawę nieodświeżaną dłużej niż
+    `ttl_seconds` przejmuje inny worker - najpierw zmienia nazwę starego pliku
+    (wygrywa dokładnie jeden), potem tworzy własny. Wymaga zsynchronizowanych zegarów
+    hostów (NTP) i systemu plików z atomowym rename i O_EXCL (lokalny, NFSv3+).
+    """
+
+    def __init__(self, lease_dir: Path, kind: str, worker_id: Optional[str] = None,
+                 ttl_seconds: float = 120.0, heartbeat_seconds: float = 30.0):
+        self.lease_dir = Path(lease_dir) / kind
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.kind = kind
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._held: Dict[str, Path] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: dict, kind: str) -> Optional["LeaseManager"]:
+        """
+        Zwraca menedżera dzierżaw z sekcji `workers` (None poza trybem workerów).
+        """
+        workers_config = config.get('workers', {})
+        if not workers_config.get('enabled', False):
+            return None
+        return cls(workers_config.get('lease_dir', "data_storage/leases"), kind,
+                   worker_id=workers_config.get('worker_id'),
+                   ttl_seconds=workers_config.get('lease_ttl_seconds', 120),
+                   heartbeat_seconds=workers_config.get('heartbeat_seconds', 30))
+
+    def _path(self, name: str) -> Path:
+        return self.lease_dir / f"{name}.lease"
+
+    def acquire(self, name: str) -> bool:
+        """
+        Próbuje przejąć dzierżawę `name`; False, gdy ważną dzierżawę ma inny worker.
+        """
+        path = self._path(name)
+        if self._create(path):
+            self._hold(name, path)
+            return True
+        try:
+            age = time.time() - path.stat().st_mtime
+            holder = path.read_text(encoding='utf-8', errors='replace')
+        except FileNotFoundError:
+            age = None  # zwolniona w międzyczasie
+        if age is not None and age < self.ttl_seconds:
+            return False
+        if age is not None:
+            stale = path.with_name(f"{path.name}.{self.worker_id}.stale")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return False  # przejął ją inny worker
+            # Między odczytem a zmianą nazwy inny worker mógł przejąć dzierżawę i utworzyć
+            # świeżą - wtedy przeniesiony plik nie jest tym sprawdzonym i trzeba go oddać
+            try:
+                renamed_age = time.time() - stale.stat().st_mtime
+                renamed_holder = stale.read_text(encoding='utf-8', errors='replace')
+            except FileNotFoundError:
+                return False
+            if renamed_age < self.ttl_seconds or renamed_holder != holder:
+                self._restore(stale, path)
+                return False
+            stale.unlink(missing_ok=True)
+            LEASES_EXPIRED.inc(kind=self.kind)
+            logger.warning(f"Przejęto wygasłą dzierżawę {self.kind}/{name} workera {holder.strip()} "
+                           f"(brak odświeżenia przez {age:.0f} s).")
+        if not self._create(path):
+            return False
+        self._hold(name, path)
+        return True
+
+    def _create(self, path: Path) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.worker_id)
+        return True
+
+    @staticmethod
+    def _restore(stale: Path, path: Path):
+        """
+        Oddaje omyłkowo przeniesioną dzierżawę, nie nadpisując pliku utworzonego w międzyczasie.
+        """
+        try:
+            os.link(stale, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            try:
+                os.rename(stale, path)  # system plików bez twardych dowiązań
+            except OSError:
+                pass
+        stale.unlink(missing_ok=True)
+
+    def _hold(self, name: str, path: Path):
+        with self._lock:
+            self._held[name] = path
+            LEASES_HELD.set(len(self._held), kind=self.kind)
+        LEASES_ACQUIRED.inc(kind=self.kind)
+        self._ensure_heartbeat()
+
+    def release(self, name: str):
+        with self._lock:
+            path = self._held.pop(name, None)
+            LEASES_HELD.set(len(self._held), kind=self.kind)
+        if path is None:
+            return
+        try:
+            if path.read_text(encoding='utf-8') == self.worker_id:
+                path.unlink()
+            else:
+                logger.warning(f"Dzierżawa {self.kind}/{name} została przejęta przez inny worker przed zwolnieniem.")
+        except FileNotFoundError:
+            pass
+
+    def is_leased(self, name: str) -> bool:
+        """
+        Czy `name` ma ważną (odświeżaną) dzierżawę dowolnego workera.
+        """
+        try:
+            return time.time() - self._path(name).stat().st_mtime < self.ttl_seconds
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self):
+        with self._lock:
+            held = dict(self._held)
+        for name, path in held.items():
+            try:
+                if path.read_text(encoding='utf-8') == self.worker_id:
+                    os.utime(path)
+                    continue
+            except FileNotFoundError:
+                pass
+            # Dzierżawa wygasła (np. długa przerwa procesu) i przejął ją inny worker
+            logger.warning(f"Utracono dzierżawę {self.kind}/{name}.")
+            with self._lock:
+                self._held.pop(name, None)
+                LEASES_HELD.set(len(self._held), kind=self.kind)
+
+    def _ensure_heartbeat(self):
+        # Wątek, a nie zadanie asyncio - ETL dekoduje snapshoty w pętli zdarzeń
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._heartbeat_loop, name=f"lease-heartbeat-{self.kind}",
+                                            daemon=True)
+            self._thread.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            self.heartbeat()
+
+    def close(self):
+        self._stop.set()
+        for name in list(self._held):
+            self.release(name)
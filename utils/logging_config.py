@@ -3,32 +3,105 @@
 from loguru import logger
 import logging
 import sys
-from typing import Optional
+import threading
+import time
+from typing import Dict, Optional
+
+
+class RateLimitFilter:
+    """
+    Filtr Loguru ograniczający wpisy z jednego miejsca wywołania (moduł, funkcja, linia).
+
+    Z każdego miejsca przechodzi najwyżej `max_per_interval` wpisów w oknie
+    `interval_seconds`; liczba pominiętych trafia do `extra['suppressed']` pierwszego
+    wpisu następnego okna. `sampling` ({poziom: ułamek}) przepuszcza deterministycznie
+    co n-ty wpis danego poziomu, np. {'DEBUG': 0.01} - co setny.
+    """
+
+    def __init__(self, max_per_interval: int = 20, interval_seconds: float = 60.0,
+                 sampling: Optional[Dict[str, float]] = None):
+        self.max_per_interval = max_per_interval
+        self.interval_seconds = interval_seconds
+        self.sample_every = {level.upper(): max(1, round(1 / rate)) for level, rate in (sampling or {}).items()
+                             if rate > 0}
+        self.dropped_levels = {level.upper() for level, rate in (sampling or {}).items() if rate <= 0}
+        # miejsce wywołania -> [początek okna, przepuszczone, pominięte, wszystkie]
+        self._sites: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record) -> bool:
+        level = record['level'].name
+        if level in self.dropped_levels:
+            return False
+        site = (record['name'], record['function'], record['line'])
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None:
+                state = self._sites[site] = [now, 0, 0, 0]
+            state[3] += 1
+            if (state[3] - 1) % self.sample_every.get(level, 1):
+                return False
+            if now - state[0] >= self.interval_seconds:
+                if state[2]:
+                    record['extra']['suppressed'] = state[2]
+                state[0], state[1], state[2] = now, 0, 0
+            if state[1] >= self.max_per_interval:
+                state[2] += 1
+                return False
+            state[1] += 1
+            return True
+
 
 def configure_logging(
     log_file: str,
     log_level: str,
     rotation: str = "10 MB",
     compression: str = "zip",
-    format: str = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
+    format: str = "{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}",
+    mode: str = "development",
+    production: Optional[dict] = None
 ):
     """
     Konfiguruje logowanie za pomocą Loguru i integruje standardowe logowanie z Loguru.
 
+    W trybie `production` zapis odbywa się w wątku w tle (enqueue), plik logów
+    zawiera wpisy JSON, a każde miejsce wywołania podlega limitowi i próbkowaniu
+    (RateLimitFilter). Poziomy i limity pochodzą ze słownika `production`.
+
     :param log_file: Ścieżka do pliku logów.
     :param log_level: Poziom logowania (np. DEBUG, INFO).
     :param rotation: Maksymalny rozmiar pliku przed rotacją (np. "10 MB").
     :param compression: Typ kompresji dla starych logów (np. "zip").
     :param format: Format logów.
+    :param mode: Tryb logowania: development lub production.
+    :param production: Ustawienia trybu produkcyjnego (level, stderr_level, serialize, rate_limit, sampling).
     """
     # Usunięcie domyślnych handlerów Loguru
     logger.remove()
 
-    # Dodanie nowego handlera dla pliku logów
-    logger.add(log_file, level=log_level, rotation=rotation, compression=compression, format=format)
+    if mode == "production":
+        production = production or {}
+        log_level = production.get('level', "INFO")
+        rate_limit = production.get('rate_limit', {})
+
+        def rate_limit_filter():
+            return RateLimitFilter(max_per_interval=rate_limit.get('max_per_interval', 20),
+                                   interval_seconds=rate_limit.get('interval_seconds', 60.0),
+                                   sampling=production.get('sampling'))
+
+        # Formatowanie i zapis w wątku w tle; każdy handler ma własny limit
+        logger.add(log_file, level=log_level, rotation=rotation, compression=compression, format=format,
+                   serialize=production.get('serialize', True), enqueue=True, backtrace=False, diagnose=False,
+                   filter=rate_limit_filter())
+        logger.add(sys.stderr, level=production.get('stderr_level', "WARNING"), format=format,
+                   enqueue=True, backtrace=False, diagnose=False, filter=rate_limit_filter())
+    else:
+        # Dodanie nowego handlera dla pliku logów
+        logger.add(log_file, level=log_level, rotation=rotation, compression=compression, format=format)
 
-    # Dodanie handlera dla terminala
-    logger.add(sys.stderr, level=log_level, format=format)
+        # Dodanie handlera dla terminala
+        logger.add(sys.stderr, level=log_level, format=format)
 
     # Przekierowanie logowania standardowego do Loguru
     class InterceptHandler(logging.Handler):
@@ -40,6 +113,7 @@ def configure_logging(
             logger_opt = logger.opt(depth=6, exception=record.exc_info)
             logger_opt.log(level, record.getMessage())
 
+    # Rekordy poniżej poziomu odrzuca już moduł logging, zanim trafią do InterceptHandler
     logging.basicConfig(handlers=[InterceptHandler()], level=log_level)
 
     # Informacja o zakończonej konfiguracji logowania
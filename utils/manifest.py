@@ -0,0 +1,154 @@
+# utils/manifest.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from loguru import logger
+
+# Etapy zapisywane w manifeście (artefakt -> etap)
+FOLDER_READY = 'folder_ready'  # folder snapshotów .pb zamknięty przez fetcher
+ETL_STARTED = 'etl_started'    # ETL zaczął folder; szczegóły zawierają znacznik czasu plików wynikowych
+ETL_DONE = 'etl_done'          # wszystkie pliki wynikowe folderu zapisane
+WRITTEN = 'written'            # plik Parquet gotowy do załadowania
+LOADED = 'loaded'              # plik Parquet załadowany do bazy
+BOOTSTRAPPED = 'bootstrapped'  # katalog przeskanowany jednorazowo (pliki sprzed manifestu)
+
+PathLike = Union[str, Path]
+
+
+class Manifest:
+    """
+    Lokalny dziennik przejść między etapami potoku w SQLite (tryb WAL).
+
+    Każde przejście to nowy wiersz (artefakt, etap, czas, szczegóły) - wpisy nie są
+    modyfikowane, a usuwane dopiero po `retention_days`. ETL i loader odczytują z
+    manifestu, co zostało do zrobienia (`pending`), więc po restarcie wznawiają pracę
+    bez skanowania katalogów i bez ponownego parsowania zakończonych folderów.
+    Artefakty to ścieżki bezwzględne; `scope` (katalog nadrzędny) zawęża zapytania.
+
+    Połączenie jest współdzielone przez wątki procesu (blokada), a kilka procesów
+    może korzystać z tego samego pliku.
+    """
+
+    def __init__(self, path: PathLike, retention_days: Optional[float] = 14):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Wpis musi przetrwać awarię razem z plikiem, którego dotyczy
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS transitions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                artifact TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                recorded_at REAL NOT NULL,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS transitions_stage_scope ON transitions (stage, scope, id);
+            CREATE INDEX IF NOT EXISTS transitions_artifact ON transitions (artifact, stage);
+        """)
+        if retention_days:
+            self.prune(retention_days)
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["Manifest"]:
+        """
+        Zwraca manifest z sekcji `manifest` konfiguracji (None, gdy wyłączony). Moduły
+        jednego procesu dostają tę samą instancję. W trybie workerów (`workers.enabled`)
+        manifest nie jest używany - lokalny plik nie widzi pracy innych hostów, a podział
+        pracy zapewniają dzierżawy na wspólnym dysku (utils/leases.py).
+        """
+        manifest_config = config.get('manifest', {})
+        if not manifest_config.get('enabled', False) or config.get('workers', {}).get('enabled', False):
+            return None
+        path = os.path.abspath(manifest_config.get('path', "data_storage/manifest.sqlite"))
+        with _INSTANCES_LOCK:
+            if path not in _INSTANCES:
+                _INSTANCES[path] = cls(path, manifest_config.get('retention_days', 14))
+                logger.info(f"Manifest potoku: {path}")
+            return _INSTANCES[path]
+
+    @staticmethod
+    def _key(artifact: PathLike) -> Tuple[str, str]:
+        artifact = os.path.abspath(artifact)
+        return artifact, os.path.dirname(artifact)
+
+    def record(self, stage: str, artifact: PathLike, **detail):
+        self.record_many([(stage, artifact, detail)])
+
+    def record_many(self, transitions: Iterable[Tuple[str, PathLike, Dict]]):
+        """
+        Zapisuje kilka przejść w jednej transakcji - wszystkie albo żadne.
+        """
+        now = time.time()
+        rows = [(*self._key(artifact), stage, now, json.dumps(detail, default=str) if detail else None)
+                for stage, artifact, detail in transitions]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO transitions (artifact, scope, stage, recorded_at, detail) VALUES (?, ?, ?, ?, ?)",
+                    rows)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def get(self, stage: str, artifact: PathLike) -> Optional[dict]:
+        """
+        Szczegóły ostatniego przejścia artefaktu do etapu (None, gdy go nie było).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT detail FROM transitions WHERE artifact = ? AND stage = ? ORDER BY id DESC LIMIT 1",
+                (self._key(artifact)[0], stage)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]) if row[0] else {}
+
+    def has(self, stage: str, artifact: PathLike) -> bool:
+        return self.get(stage, artifact) is not None
+
+    def pending(self, stage: str, next_stage: str, scope: PathLike) -> List[Path]:
+        """
+        Artefakty z katalogu `scope`, które osiągnęły `stage`, a jeszcze nie `next_stage`,
+        w kolejności zapisu.
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT artifact FROM transitions t
+                WHERE t.stage = ? AND t.scope = ?
+                  AND NOT EXISTS (SELECT 1 FROM transitions n WHERE n.artifact = t.artifact AND n.stage = ?)
+                GROUP BY artifact
+                ORDER BY MIN(id)
+            """, (stage, os.path.abspath(scope), next_stage)).fetchall()
+        return [Path(row[0]) for row in rows]
+
+    def prune(self, retention_days: float) -> int:
+        """
+        Usuwa przejścia starsze niż `retention_days` dni.
+        """
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM transitions WHERE recorded_at < ?",
+                                         (time.time() - retention_days * 86400,)).rowcount
+        if deleted:
+            logger.info(f"Usunięto {deleted} przejść starszych niż {retention_days} dni z manifestu {self.path}.")
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_INSTANCES: Dict[str, Manifest] = {}
+_INSTANCES_LOCK = threading.Lock()
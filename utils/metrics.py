@@ -0,0 +1,157 @@
+# utils/metrics.py
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metryka {self.name} wymaga etykiet {self.labelnames}, podano {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values)) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, list] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[position] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Mierzy czas wykonania bloku (również zakończonego wyjątkiem).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+        for key, bucket_counts in counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(key)} {sums[key]}"
+            yield f"{self.name}_count{self._format_labels(key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Wspólny rejestr metryk wszystkich modułów. Metryki są tworzone przy pierwszym
+    użyciu nazwy i współdzielone przy kolejnych (get-or-create), a `render` zwraca
+    je w formacie tekstowym Prometheusa.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metryka {name} jest już zarejestrowana z innym typem lub etykietami.")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,35 @@
+# utils/metrics_server.py
+
+import asyncio
+
+from aiohttp import web
+from loguru import logger
+
+from utils.metrics import REGISTRY, MetricsRegistry
+
+
+class MetricsServer:
+    """
+    Lokalny endpoint HTTP z metrykami w formacie Prometheusa (GET /metrics).
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self.app.add_routes([web.get('/metrics', self.metrics)])
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def run(self):
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Metryki dostępne na http://{self.host}:{self.port}/metrics")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
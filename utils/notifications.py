@@ -0,0 +1,44 @@
+# utils/notifications.py
+
+import asyncio
+from typing import Optional
+
+
+class ParquetReadyNotifier:
+    """
+    Powiadamia loader o nowych plikach Parquet zapisanych przez ETL.
+
+    `notify` można wywołać z dowolnego wątku (np. z handlera watchdog),
+    `wait` czeka na powiadomienie w pętli zdarzeń loadera.
+    """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def notify(self):
+        if self._loop is None:
+            self._event.set()
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Czeka na powiadomienie najdłużej `timeout` sekund.
+        Zwraca True, jeśli przyszło powiadomienie, False przy przekroczeniu czasu.
+        """
+        self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
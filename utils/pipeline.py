@@ -0,0 +1,144 @@
+# utils/pipeline.py
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Hashable, Iterable, List, Optional
+
+from loguru import logger
+
+from utils.metrics import REGISTRY
+
+POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+QUEUE_DEPTH = REGISTRY.gauge('bimba_pipeline_queue_depth', 'Elementy oczekujące w kolejce etapu', ('stage',))
+QUEUE_LAG = REGISTRY.gauge('bimba_pipeline_queue_lag_seconds', 'Wiek najstarszego elementu w kolejce etapu',
+                           ('stage',))
+QUEUE_SPILLED = REGISTRY.counter('bimba_pipeline_spilled_total',
+                                 'Elementy usunięte z pełnej kolejki (dane pozostają na dysku)', ('stage',))
+QUEUE_COALESCED = REGISTRY.counter('bimba_pipeline_coalesced_total',
+                                   'Elementy zastąpione nowszymi o tym samym kluczu', ('stage',))
+QUEUE_BLOCKED_SECONDS = REGISTRY.histogram('bimba_pipeline_blocked_seconds',
+                                           'Czas oczekiwania producenta na miejsce w kolejce', ('stage',))
+LAG_ALARMS = REGISTRY.counter('bimba_pipeline_lag_alarms_total', 'Przekroczenia dopuszczalnego opóźnienia kolejki',
+                              ('stage',))
+
+
+class StageQueue:
+    """
+    Ograniczona kolejka między etapami potoku (fetch -> ETL -> loader) z polityką
+    przeciążenia:
+
+    - `block` - producent czeka na miejsce (spowolnienie propaguje się w górę potoku),
+    - `drop_oldest` - najstarszy element wypada z kolejki; przenoszone są tylko
+      odwołania do plików, więc dane zostają na dysku i konsument wraca do nich
+      przy okresowym przeglądzie katalogu,
+    - `coalesce` - nowy element zastępuje oczekujący o tym samym kluczu `key(item)`
+      (liczy się tylko najnowszy stan), przy pełnej kolejce jak `drop_oldest`.
+
+    Wiek najstarszego elementu jest wystawiany jako metryka, a `check_lag` zgłasza
+    alarm po przekroczeniu `lag_alarm_seconds`.
+    """
+
+    def __init__(self, name: str, maxsize: int = 100, policy: str = 'block', lag_alarm_seconds: float = 600.0,
+                 key: Optional[Callable[[Any], Hashable]] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Nieznana polityka kolejki {name}: {policy} (dostępne: {', '.join(POLICIES)})")
+        if policy == 'coalesce' and key is None:
+            raise ValueError(f"Kolejka {name} z polityką coalesce wymaga funkcji klucza.")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.lag_alarm_seconds = lag_alarm_seconds
+        self.key = key
+        # Elementy jako [klucz, wartość, czas dodania]; lista, by coalesce mógł podmienić wartość w miejscu
+        self._items: Deque[list] = deque()
+        self._changed = asyncio.Condition()
+        self._alarm = False
+
+    @classmethod
+    def from_config(cls, config: dict, name: str, key: Optional[Callable[[Any], Hashable]] = None,
+                    **defaults) -> "StageQueue":
+        queue_config = {**defaults, **config.get('pipeline', {}).get('queues', {}).get(name, {})}
+        return cls(name,
+                   maxsize=queue_config.get('maxsize', 100),
+                   policy=queue_config.get('policy', 'block'),
+                   lag_alarm_seconds=queue_config.get('lag_alarm_seconds', 600.0),
+                   key=key)
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    async def put(self, item: Any):
+        async with self._changed:
+            item_key = self.key(item) if self.key is not None else None
+            if self.policy == 'coalesce':
+                for entry in self._items:
+                    if entry[0] == item_key:
+                        # Czas dodania zostaje - opóźnienie liczy się od najstarszych niezastosowanych danych
+                        entry[1] = item
+                        QUEUE_COALESCED.inc(stage=self.name)
+                        return
+            if len(self._items) >= self.maxsize:
+                if self.policy == 'block':
+                    with QUEUE_BLOCKED_SECONDS.time(stage=self.name):
+                        await self._changed.wait_for(lambda: len(self._items) < self.maxsize)
+                else:
+                    self._items.popleft()
+                    QUEUE_SPILLED.inc(stage=self.name)
+            self._items.append([item_key, item, time.time()])
+            QUEUE_DEPTH.set(len(self._items), stage=self.name)
+            self._changed.notify_all()
+
+    async def get_batch(self, max_items: Optional[int] = None, timeout: Optional[float] = None) -> List[Any]:
+        """
+        Zwraca do `max_items` najstarszych elementów, czekając na pierwszy najdłużej
+        `timeout` sekund (pusta lista po przekroczeniu czasu).
+        """
+        async with self._changed:
+            if not self._items:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: bool(self._items)), timeout)
+                except asyncio.TimeoutError:
+                    return []
+            count = len(self._items) if max_items is None else min(max_items, len(self._items))
+            entries = [self._items.popleft() for _ in range(count)]
+            QUEUE_DEPTH.set(len(self._items), stage=self.name)
+            QUEUE_LAG.set(self.lag_seconds(), stage=self.name)
+            self._changed.notify_all()
+        return [entry[1] for entry in entries]
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        items = await self.get_batch(1, timeout)
+        return items[0] if items else None
+
+    def lag_seconds(self) -> float:
+        return time.time() - self._items[0][2] if self._items else 0.0
+
+    def check_lag(self) -> bool:
+        """
+        Aktualizuje metrykę opóźnienia i zgłasza alarm (raz na przekroczenie) oraz jego ustąpienie.
+        """
+        lag = self.lag_seconds()
+        QUEUE_LAG.set(lag, stage=self.name)
+        if lag > self.lag_alarm_seconds:
+            if not self._alarm:
+                LAG_ALARMS.inc(stage=self.name)
+                logger.warning(f"Kolejka {self.name} nie nadąża: najstarszy element czeka {lag:.0f} s "
+                               f"(próg {self.lag_alarm_seconds:.0f} s, {len(self._items)} w kolejce).")
+            self._alarm = True
+        elif self._alarm:
+            logger.info(f"Kolejka {self.name} odrobiła zaległości (opóźnienie {lag:.0f} s).")
+            self._alarm = False
+        return self._alarm
+
+
+async def monitor_queues(queues: Iterable[StageQueue], interval: float = 30.0):
+    """
+    Okresowo sprawdza opóźnienia kolejek potoku.
+    """
+    queues = list(queues)
+    while True:
+        for queue in queues:
+            queue.check_lag()
+        await asyncio.sleep(interval)
@@ -1,8 +1,141 @@
 import asyncio
 import functools
-from typing import Callable, Type, Tuple
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Type, Tuple
 import logging
 
+from utils.metrics import REGISTRY
+
+RETRY_OUTCOMES = REGISTRY.counter('bimba_retry_outcomes_total', 'Wyniki wywołań z ponawianiem',
+                                  ('operation', 'outcome'))
+RETRY_ATTEMPTS = REGISTRY.counter('bimba_retry_attempts_total', 'Ponowienia wywołań po błędzie', ('operation',))
+BREAKER_STATE = REGISTRY.gauge('bimba_circuit_breaker_state', 'Stan obwodu: 0 zamknięty, 1 półotwarty, 2 otwarty',
+                               ('operation',))
+
+
+class CircuitOpenError(Exception):
+    """
+    Wywołanie pominięte, bo obwód dla tego endpointu jest otwarty.
+    """
+
+
+class CircuitBreaker:
+    """
+    Bezpiecznik dla jednego endpointu. Po `failure_threshold` kolejnych nieudanych
+    wywołaniach obwód się otwiera i wywołania są od razu odrzucane. Po `reset_timeout`
+    sekundach przepuszczane jest jedno wywołanie próbne (półotwarty): sukces zamyka
+    obwód, błąd otwiera go ponownie.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.set(self._STATE_VALUES[state], operation=self.name)
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+async def call_with_retry(
+    func: Callable[..., Awaitable[Any]],
+    *args,
+    exceptions: Tuple[Type[BaseException], ...],
+    tries: int = 3,
+    delay: float = 1.0,
+    backoff: float = 2.0,
+    max_delay: float = 30.0,
+    jitter: bool = False,
+    deadline: Optional[float] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    name: Optional[str] = None,
+    logger: logging.Logger = None,
+    **kwargs
+) -> Any:
+    """
+    Wywołuje `func(*args, **kwargs)`, ponawiając je po wyjątkach z `exceptions`.
+
+    Czas oczekiwania rośnie wykładniczo (`delay`, `backoff`, `max_delay`); przy `jitter`
+    jest losowany z przedziału [0, wyliczony czas] (full jitter). `deadline` (wartość
+    `time.monotonic()`) ogranicza łączny czas: pojedyncza próba jest przerywana
+    (asyncio.TimeoutError), a ponowienie, które nie zdąży przed terminem, nie jest
+    podejmowane. Przy otwartym `breaker` funkcja nie jest wywoływana (CircuitOpenError).
+    Wynik trafia do metryki bimba_retry_outcomes_total pod etykietą `name`.
+    """
+    operation = name or getattr(func, '__name__', 'call')
+    if breaker is not None and not breaker.allow():
+        RETRY_OUTCOMES.inc(operation=operation, outcome='circuit_open')
+        raise CircuitOpenError(f"Obwód {breaker.name} jest otwarty.")
+
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            try:
+                if deadline is None:
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.wait_for(func(*args, **kwargs), max(0.0, deadline - time.monotonic()))
+            except exceptions + (asyncio.TimeoutError,) as e:
+                timed_out = (isinstance(e, asyncio.TimeoutError) and deadline is not None
+                             and time.monotonic() >= deadline)
+                if not timed_out and not isinstance(e, exceptions):
+                    raise
+                wait = min(delay * backoff ** (attempt - 1), max_delay)
+                if jitter:
+                    wait = random.uniform(0.0, wait)
+                if attempt >= tries or timed_out or (deadline is not None and time.monotonic() + wait >= deadline):
+                    outcome = 'failed' if attempt >= tries else 'deadline_exceeded'
+                    RETRY_OUTCOMES.inc(operation=operation, outcome=outcome)
+                    logger.error(f"{operation} failed after {attempt} attempt(s) ({outcome}): {e!r}")
+                    raise
+                RETRY_ATTEMPTS.inc(operation=operation)
+                logger.warning(f"{operation} failed with {e!r}, retrying in {wait:.2f} seconds... "
+                               f"(Attempts left: {tries - attempt})")
+                await asyncio.sleep(wait)
+            else:
+                RETRY_OUTCOMES.inc(operation=operation, outcome='success' if attempt == 1 else 'success_after_retry')
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+    except BaseException:
+        # Każde zakończenie bez wyniku (również anulowanie) zwalnia próbę półotwartego obwodu
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+
+
 def retry_async(
     exceptions: Tuple[Type[BaseException], ...],
     tries: int = 3,
@@ -10,12 +143,14 @@ def retry_async(
     backoff: float = 2.0,
     max_delay: float = 30.0,  # Dodano max_delay jako parametr
     logger: logging.Logger = None,
+    jitter: bool = False,
 ) -> Callable:
     """
     Dekorator do ponownego wykonywania asynchronicznych funkcji w przypadku wystąpienia określonych wyjątków.
 
     Dekorator próbuje ponownie wykonać funkcję asynchroniczną, jeśli zgłosi wyjątek zdefiniowany w `exceptions`.
     Liczba prób oraz czas oczekiwania między próbami są kontrolowane za pomocą parametrów `tries`, `delay`, `backoff` i `max_delay`.
+    Terminy i bezpieczniki obsługuje `call_with_retry`.
 
     Args:
         exceptions (Tuple[Type[BaseException], ...]): Wyjątki, które wyzwalają ponowienie.
@@ -24,6 +159,7 @@ def retry_async(
         backoff (float): Współczynnik zwiększania czasu oczekiwania między kolejnymi próbami (domyślnie 2.0).
         max_delay (float): Maksymalny czas oczekiwania między próbami w sekundach (domyślnie 30.0).
         logger (logging.Logger): Logger do użycia do logowania informacji o błędach (wymagane).
+        jitter (bool): Losowy czas oczekiwania z przedziału [0, wyliczony czas] (domyślnie False).
 
     Returns:
         Callable: Dekorowana funkcja.
@@ -37,22 +173,8 @@ def retry_async(
     def decorator_retry(func: Callable) -> Callable:
         @functools.wraps(func)
         async def wrapper_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return await func(*args, **kwargs)
-                except exceptions as e:
-                    msg = f"{func.__name__} failed with {e}, retrying in {mdelay:.2f} seconds... (Attempts left: {mtries - 1})"
-                    logger.warning(msg)
-                    # Oczekiwanie z uwzględnieniem limitu maksymalnego opóźnienia
-                    await asyncio.sleep(min(mdelay, max_delay))
-                    mtries -= 1
-                    mdelay = min(mdelay * backoff, max_delay)
-            # Ostatnia próba
-            try:
-                return await func(*args, **kwargs)
-            except exceptions as e:
-                logger.error(f"{func.__name__} failed on the last attempt: {e}")
-                raise  # Propaguj wyjątek dalej
+            return await call_with_retry(func, *args, exceptions=exceptions, tries=tries, delay=delay,
+                                         backoff=backoff, max_delay=max_delay, jitter=jitter,
+                                         name=func.__name__, logger=logger, **kwargs)
         return wrapper_retry
     return decorator_retry
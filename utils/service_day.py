@@ -0,0 +1,44 @@
+# utils/service_day.py
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+DEFAULT_TIMEZONE = "Europe/Warsaw"
+DEFAULT_DAY_START_HOUR = 4
+
+
+def service_day_start(day: date, timezone: str = DEFAULT_TIMEZONE, day_start_hour: int = DEFAULT_DAY_START_HOUR) -> int:
+    """
+    Zwraca początek doby przewozowej (epoch w sekundach) dla podanej daty.
+    Doba przewozowa zaczyna się o `day_start_hour` czasu lokalnego, tak jak w daily_report.
+    """
+    local_start = datetime.combine(day, time(hour=day_start_hour), tzinfo=ZoneInfo(timezone))
+    return int(local_start.timestamp())
+
+
+def service_day_bounds(day: date, timezone: str = DEFAULT_TIMEZONE, day_start_hour: int = DEFAULT_DAY_START_HOUR):
+    """
+    Zwraca przedział [początek, koniec) doby przewozowej w sekundach epoch.
+    Przy zmianie czasu doba ma 23 lub 25 godzin.
+    """
+    return (service_day_start(day, timezone, day_start_hour),
+            service_day_start(day + timedelta(days=1), timezone, day_start_hour))
+
+
+def service_day_of(timestamp: int, timezone: str = DEFAULT_TIMEZONE, day_start_hour: int = DEFAULT_DAY_START_HOUR) -> date:
+    """
+    Zwraca dobę przewozową, do której należy znacznik czasu (epoch w sekundach).
+    """
+    local = datetime.fromtimestamp(timestamp, tz=ZoneInfo(timezone))
+    return (local - timedelta(hours=day_start_hour)).date()
+
+
+def service_days_of(timestamps: pd.Series, timezone: str = DEFAULT_TIMEZONE,
+                    day_start_hour: int = DEFAULT_DAY_START_HOUR) -> pd.Series:
+    """
+    Wektorowa wersja service_day_of dla kolumny znaczników czasu (epoch w sekundach).
+    """
+    local = pd.to_datetime(timestamps, unit='s', utc=True).dt.tz_convert(timezone).dt.tz_localize(None)
+    return (local - pd.Timedelta(hours=day_start_hour)).dt.date
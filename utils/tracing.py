@@ -0,0 +1,173 @@
+# utils/tracing.py
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+# pandas i pyarrow są potrzebne tylko przy zapisie i odczycie Parquet - fetcher,
+# który jedynie zapisuje odcinki, ich nie ładuje
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Klucz metadanych Parquet z listą snapshotów, z których powstał plik
+SNAPSHOTS_METADATA_KEY = b'bimba.snapshots'
+WRITTEN_AT_METADATA_KEY = b'bimba.written_at'
+
+
+def new_snapshot_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def snapshot_id_from_path(path: Path) -> Optional[str]:
+    """
+    Odczytuje identyfikator snapshotu z nazwy pliku <klucz>_<czas>_<id>.pb
+    (None dla plików zapisanych przed wprowadzeniem śledzenia).
+    """
+    parts = Path(path).stem.split('_')
+    return parts[-1] if len(parts) >= 3 and len(parts[-1]) == 16 else None
+
+
+class Tracer:
+    """
+    Lekkie śledzenie snapshotów przez etapy fetch -> folder -> ETL -> baza.
+
+    Każdy odcinek (span) to jedna linia JSON w pliku `path`: identyfikator snapshotu,
+    nazwa etapu, początek, koniec i czas trwania w sekundach. Gdy śledzenie jest
+    wyłączone (brak ścieżki), metody nic nie robią. Po przekroczeniu `max_bytes`
+    plik jest rotowany (`<plik>.1` .. `<plik>.<backups>`, najstarszy usuwany).
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: Optional[int] = None, backups: int = 3):
+        self._lock = threading.Lock()
+        self._file = None
+        self.configure(path, max_bytes, backups)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def configure(self, path: Optional[Path], max_bytes: Optional[int] = None, backups: int = 3):
+        with self._lock:
+            self._close()
+            self.path = Path(path) if path else None
+            self.max_bytes = max_bytes
+            self.backups = backups
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, trace_ids: Iterable[str], span: str, start: float, end: float, **attributes):
+        """
+        Zapisuje odcinek [start, end] (epoch w sekundach) dla każdego z podanych snapshotów.
+        """
+        if not self.enabled:
+            return
+        lines = [json.dumps({'trace_id': trace_id, 'span': span, 'start': round(start, 6), 'end': round(end, 6),
+                             'duration': round(end - start, 6), **attributes}, default=str)
+                 for trace_id in trace_ids if trace_id]
+        if not lines:
+            return
+        with self._lock:
+            if self._file is None:
+                self._file = self.path.open('a', encoding='utf-8')
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._close()
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def span(self, trace_ids: Iterable[str], span: str, **attributes):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(list(trace_ids), span, start, time.time(), **attributes)
+
+
+TRACER = Tracer()
+
+
+def configure_tracing(config: dict):
+    tracing_config = config.get('tracing', {})
+    max_mb = tracing_config.get('max_mb')
+    TRACER.configure(tracing_config.get('file') if tracing_config.get('enabled', False) else None,
+                     max_bytes=int(max_mb * 2 ** 20) if max_mb else None,
+                     backups=tracing_config.get('backups', 3))
+
+
+def write_traced_parquet(df: "pd.DataFrame", output_file: Path, snapshots: List[Dict]):
+    """
+    Zapisuje DataFrame do Parquet, dopisując do metadanych pliku listę snapshotów
+    ({'id', 'fetched_at'}) i czas zapisu - loader odtwarza z nich ślad.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOTS_METADATA_KEY] = json.dumps(snapshots).encode()
+    metadata[WRITTEN_AT_METADATA_KEY] = str(time.time()).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), output_file)
+
+
+def read_trace_metadata(path: Path) -> tuple:
+    """
+    Zwraca (snapshoty, czas zapisu) z metadanych pliku Parquet; ([], None) dla plików bez śladu.
+    """
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(path).metadata or {}
+    snapshots = json.loads(metadata[SNAPSHOTS_METADATA_KEY]) if SNAPSHOTS_METADATA_KEY in metadata else []
+    written_at = float(metadata[WRITTEN_AT_METADATA_KEY]) if WRITTEN_AT_METADATA_KEY in metadata else None
+    return snapshots, written_at
+
+
+def trace_load(path: Path, table_name: str, start: float, end: float):
+    """
+    Zapisuje etapy loadera dla snapshotów pliku: oczekiwanie na załadowanie, wstawienie
+    i czas całkowity od pobrania snapshotu do wstawienia do bazy.
+    """
+    if not TRACER.enabled:
+        return
+    snapshots, written_at = read_trace_metadata(path)
+    trace_ids = [snapshot['id'] for snapshot in snapshots]
+    if written_at is not None:
+        TRACER.record(trace_ids, 'load_wait', written_at, start, table=table_name)
+    TRACER.record(trace_ids, 'load', start, end, table=table_name)
+    for snapshot in snapshots:
+        TRACER.record([snapshot['id']], 'end_to_end', snapshot['fetched_at'], end, table=table_name)
+
+
+def summarize_traces(path: Path, quantiles=(0.5, 0.9, 0.99)) -> "pd.DataFrame":
+    """
+    Rozkład czasu trwania per etap (liczność i percentyle w sekundach) z pliku śladów.
+    """
+    import pandas as pd
+
+    spans = pd.read_json(path, lines=True)
+    if spans.empty:
+        return pd.DataFrame()
+    summary = spans.groupby('span')['duration'].quantile(list(quantiles)).unstack()
+    summary.columns = [f"p{round(q * 100):g}" for q in quantiles]
+    summary.insert(0, 'count', spans.groupby('span').size())
+    return summary.reset_index()